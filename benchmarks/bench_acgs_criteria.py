@@ -0,0 +1,55 @@
+"""
+Micro-benchmark of ACGS criteria normalisation and comment building, for
+report dataframes of increasing size (one row per interpret sheet), comparing
+the previous row-by-row implementations with the column-wise ones in utils.
+
+Usage:
+    python benchmarks/bench_acgs_criteria.py
+"""
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests import legacy_implementations as legacy
+from tests.test_workbook_parsing import make_random_report_df
+from utils import utils
+
+
+def legacy_run(df, config):
+    acgs = config["acgs_criteria"]
+    df = legacy.legacy_make_acgs_criteria_null_if_not_applied(df, acgs)
+    return legacy.legacy_add_comment_on_classification(df, acgs, config)
+
+
+def new_run(df, config):
+    acgs = config["acgs_criteria"]
+    df = utils.make_acgs_criteria_null_if_not_applied(df, acgs)
+    return utils.add_comment_on_classification(df, acgs, config)
+
+
+def main():
+    with open(os.path.join(ROOT, "tests", "test_data", "test_config.json")) as f:
+        config = json.load(f)
+
+    for n_sheets in [3, 10, 50, 200]:
+        df = make_random_report_df(config, n_sheets)
+        repeats = 5
+        timings = {}
+        for name, func in [("legacy", legacy_run), ("column-wise", new_run)]:
+            timings[name] = min(timeit.repeat(
+                lambda: func(df.copy(), config), number=1, repeat=repeats
+            ))
+        print(
+            f"{n_sheets:>4} interpret sheets: "
+            f"legacy {timings['legacy'] * 1000:8.1f} ms, "
+            f"column-wise {timings['column-wise'] * 1000:6.1f} ms "
+            f"({timings['legacy'] / timings['column-wise']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Micro-benchmark of building ClinVar submission dictionaries for backlogs of
+variants of increasing size, comparing the previous row-by-row extraction
+with iterrows and the records-based builder in utils.clinvar.
+
+Usage:
+    python benchmarks/bench_clinvar_payload.py
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tests import legacy_implementations as legacy
+from tests.test_clinvar import make_random_variant_df
+from utils import clinvar
+
+REF_GENOMES = ["GRCh37.p13", "GRCh38.p13"]
+
+
+def main():
+    for n_variants in [100, 1000, 10000]:
+        df = make_random_variant_df(n_variants)
+        repeats = 3
+        timings = {}
+        for name, func in [
+            ("legacy", legacy.legacy_collect_clinvar_data_to_submit),
+            ("records", clinvar.build_submission_records),
+        ]:
+            timings[name] = min(timeit.repeat(
+                lambda: func(df, REF_GENOMES), number=1, repeat=repeats
+            ))
+        print(
+            f"{n_variants:>6} variants: "
+            f"iterrows {timings['legacy'] * 1000:8.1f} ms, "
+            f"records {timings['records'] * 1000:6.1f} ms "
+            f"({timings['legacy'] / timings['records']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark extraction of config field_cells from interpret sheets, comparing
+cell by cell extraction into a growing dataframe with the precompiled
+extraction plan, for workbooks with increasing numbers of interpret sheets.
+Workbooks are made by copying the first interpret sheet of a test workbook.
+
+Usage:
+    python benchmarks/bench_report_extraction.py
+"""
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+from openpyxl import load_workbook
+from tests import legacy_implementations as legacy
+from utils import workbook_loader
+
+TEST_DATA_DIR = os.path.join(ROOT, "tests", "test_data")
+
+
+def make_workbook(n_sheets, tmp_dir):
+    '''
+    Save a copy of the CUH test workbook with n_sheets interpret sheets
+    '''
+    workbook = load_workbook(os.path.join(TEST_DATA_DIR, "CUH", "cuh.xlsx"))
+    template = workbook["interpret_1"]
+    for i in range(len(workbook.sheetnames), n_sheets + 3):
+        workbook.copy_worksheet(template).title = f"interpret_{i}"
+    filename = os.path.join(tmp_dir, f"interpret_{n_sheets}.xlsx")
+    workbook.save(filename)
+    return filename
+
+
+def plan_extract(workbook, field_cells):
+    plan = workbook_loader.get_extraction_plan(field_cells)
+    records = [
+        plan.extract(workbook[sheet]) for sheet in workbook.sheetnames
+        if sheet.lower().startswith("interpret")
+    ]
+    return pd.DataFrame(
+        [record for record in records if record], columns=plan.fields,
+        dtype=object
+    )
+
+
+def main():
+    with open(os.path.join(TEST_DATA_DIR, "test_config.json")) as f:
+        field_cells = json.load(f)["field_cells"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_sheets in [3, 12, 30]:
+            workbook = workbook_loader.load_workbook_values(
+                make_workbook(n_sheets, tmp_dir)
+            )
+            n_sheets = len([
+                x for x in workbook.sheetnames if x.startswith("interpret")
+            ])
+            timings = {}
+            for name, func in [
+                ("cell by cell", legacy.legacy_extract_report_fields),
+                ("plan", plan_extract),
+            ]:
+                timings[name] = min(timeit.repeat(
+                    lambda: func(workbook, field_cells), number=1, repeat=5
+                ))
+            print(
+                f"{n_sheets:>3} interpret sheets: cell by cell "
+                f"{timings['cell by cell'] * 1000:7.1f} ms, plan "
+                f"{timings['plan'] * 1000:5.1f} ms "
+                f"({timings['cell by cell'] / timings['plan']:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main()
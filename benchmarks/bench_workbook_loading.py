@@ -0,0 +1,98 @@
+"""
+Benchmark per-workbook wall time and peak RSS of workbook parsing, comparing
+the previous approach (full read/write openpyxl load followed by a second
+parse of the included sheet with pd.read_excel) against the single-open
+read-only loader in utils.workbook_loader.
+
+Usage:
+    python benchmarks/bench_workbook_loading.py [workbook.xlsx ...]
+"""
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from openpyxl import load_workbook
+from utils import utils
+from utils import workbook_loader
+
+TEST_DATA_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tests", "test_data"
+)
+INCLUDED_COLUMNS = [
+    "CHROM", "POS", "REF", "ALT", "SYMBOL", "HGVSc", "Consequence",
+    "Interpreted", "Comment",
+]
+
+
+def legacy_parse(filename, config):
+    '''
+    Parse workbook the way pandora did before the single-open loader
+    '''
+    workbook = load_workbook(filename)
+    utils.get_summary_fields(workbook, config, filename)
+    pd.read_excel(
+        filename, sheet_name="included", usecols=INCLUDED_COLUMNS,
+        nrows=workbook["summary"]["C38"].value
+    )
+    utils.checking_sheets(workbook)
+
+
+def loader_parse(filename, config):
+    '''
+    Parse workbook with the single-open read-only loader
+    '''
+    workbook = workbook_loader.load_workbook_values(filename)
+    utils.get_summary_fields(workbook, config, filename)
+    workbook_loader.sheet_to_dataframe(
+        workbook["included"], usecols=INCLUDED_COLUMNS,
+        nrows=workbook["summary"]["C38"].value
+    )
+    utils.checking_sheets(workbook)
+
+
+def measure(mode, filenames, config, queue):
+    '''
+    Run one parse mode in a fresh process and report mean wall time per
+    workbook and peak RSS
+    '''
+    parse = legacy_parse if mode == "legacy" else loader_parse
+    start = time.perf_counter()
+    for filename in filenames:
+        parse(filename, config)
+    elapsed = time.perf_counter() - start
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((mode, elapsed / len(filenames), peak_rss_kb))
+
+
+def main():
+    filenames = sys.argv[1:] or [
+        TEST_DATA_DIR + "/CUH/cuh.xlsx", TEST_DATA_DIR + "/NUH/nuh.xlsx"
+    ]
+    with open(TEST_DATA_DIR + "/test_config.json") as f:
+        config = json.load(f)
+
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    for mode in ["legacy", "loader"]:
+        process = context.Process(
+            target=measure, args=(mode, filenames, config, queue)
+        )
+        process.start()
+        process.join()
+        mode, per_workbook, peak_rss_kb = queue.get()
+        print(
+            f"{mode:>7}: {per_workbook * 1000:8.1f} ms/workbook, "
+            f"peak RSS {peak_rss_kb / 1024:7.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,29 @@ Script to add variants from workbooks to Shire database and submit variants
 from Shire database to ClinVar
 Version: 1.0.0
 """
+import datetime
 import json
 import argparse
 import os.path
-import glob
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import repeat
 import utils.utils as utils
 import utils.clinvar as clinvar
 import utils.database_actions as db
+import utils.fingerprints as fingerprints
+import utils.migrations as migrations
+import utils.poll_schedule as poll_schedule
+import utils.profiling as profiling
+import utils.summary_cache as summary_cache
+import utils.workbook_scanner as workbook_scanner
 import warnings
-from openpyxl import load_workbook
-from sqlalchemy import create_engine
+import pandas as pd
+from sqlalchemy.exc import SQLAlchemyError
+
+# organisations in config to submit variants for, each with an org ID,
+# ACGS url and folder in config and a ClinVar API key
+ORGANISATIONS = ["CUH", "NUH"]
 
 
 def open_json(file):
@@ -59,34 +72,456 @@ def parse_args():
         help='JSON containing credentials to connect to AWS database'
         )
     parser.add_argument(
-        '--path_to_workbooks', help='Path to variant workbooks'
+        '--path_to_workbooks', nargs='+',
+        help='Path(s) to folders of variant workbooks'
+        )
+    parser.add_argument(
+        '--org_subfolders', action='store_true',
+        help='Boolean determining whether to search the CUH and NUH folders '
+        'given in the config within each path_to_workbooks'
+        )
+    parser.add_argument(
+        '--recursive', action='store_true',
+        help='Boolean determining whether to search subfolders of '
+        'path_to_workbooks'
+        )
+    parser.add_argument(
+        '--scan_manifest',
+        default=os.path.join(
+            os.path.expanduser("~"), ".cache", "pandora",
+            "scan_manifest.json"
+        ),
+        help='Path to manifest of workbooks found by the previous scan'
+        )
+    parser.add_argument(
+        '--full_scan', action='store_true',
+        help='Boolean determining whether to check every workbook file for '
+        'changes, ignoring the scan manifest'
         )
     parser.add_argument(
         '--config', required=True,
         help='JSON config file containing required inputs'
         )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of processes to use to parse workbooks in parallel'
+        )
+    parser.add_argument(
+        '--apply_migrations', action='store_true',
+        help='Boolean determining whether to apply any pending database '
+        'schema migrations before running'
+        )
+    parser.add_argument(
+        '--db_pool_size', type=int, default=5,
+        help='Number of database connections to keep open and reuse'
+        )
+    parser.add_argument(
+        '--db_batch_size', type=int, default=1,
+        help='Number of parsed workbooks to write to the database together, '
+        'in one transaction with their variants added in one bulk insert'
+        )
+    parser.add_argument(
+        '--select_chunk_size', type=int, default=1000,
+        help='Number of variants to read from the database at a time when '
+        'selecting variants to submit'
+        )
+    parser.add_argument(
+        '--failed_retry_days', type=float, default=7,
+        help='Days after which a workbook that failed parsing is retried '
+        'even if the file has not changed'
+        )
+    parser.add_argument(
+        '--retry_all_failed', action='store_true',
+        help='Boolean determining whether to retry all workbooks that '
+        'previously failed parsing, whether or not they have changed'
+        )
+    parser.add_argument(
+        '--poll_workers', type=int, default=8,
+        help='Maximum number of ClinVar submission statuses to check at once'
+        )
+    parser.add_argument(
+        '--submission_batch_size', type=int,
+        default=clinvar.MAX_BATCH_RECORDS,
+        help='Maximum number of variants in one ClinVar submission'
+        )
+    parser.add_argument(
+        '--submission_batch_bytes', type=int,
+        default=clinvar.MAX_BATCH_BYTES,
+        help='Maximum size in bytes of the variant JSON in one ClinVar '
+        'submission'
+        )
+    parser.add_argument(
+        '--submission_workers', type=int, default=2,
+        help='Maximum number of ClinVar submissions to make at once for '
+        'each organisation'
+        )
+    parser.add_argument(
+        '--clinvar_rate', type=float, default=5,
+        help='Maximum number of ClinVar API requests to start each second '
+        'for each API key'
+        )
+    parser.add_argument(
+        '--poll_interval_hours', type=float, default=1,
+        help='Hours after submission to first check the status of a ClinVar '
+        'submission. The interval doubles after each check of a submission '
+        'that has not been processed'
+        )
+    parser.add_argument(
+        '--max_poll_interval_hours', type=float, default=168,
+        help='Longest interval in hours between checks of the status of a '
+        'ClinVar submission'
+        )
+    parser.add_argument(
+        '--summary_cache',
+        default=os.path.join(
+            os.path.expanduser("~"), ".cache", "pandora", "summary_files"
+        ),
+        help='Directory to cache the summary files of processed ClinVar '
+        'submissions in'
+        )
+    parser.add_argument(
+        '--summary_cache_size', type=int, default=500,
+        help='Maximum size of the summary file cache in MB'
+        )
+    parser.add_argument(
+        '--reapply_cached_summaries', action='store_true',
+        help='Boolean determining whether to only check submissions with a '
+        'cached summary file, writing their results to the database again '
+        'without calling the ClinVar API'
+        )
+    parser.add_argument(
+        '--hash_cache',
+        default=os.path.join(
+            os.path.expanduser("~"), ".cache", "pandora",
+            "workbook_hashes.json"
+        ),
+        help='Path to local cache of workbook content hashes'
+        )
+    parser.add_argument(
+        '--profile',
+        help='Path to write a JSON report of the time taken by each stage '
+        'of the run, in total and for each workbook'
+        )
+    parser.add_argument(
+        '--cprofile',
+        help='Path to write cProfile stats for workbook parsing to. Only '
+        'used with --profile'
+        )
     args = parser.parse_args()
     return args
 
 
-def main():
+def _map(func, workers, *iterables):
     '''
-    Script entry point
+    Map func over iterables, across a process pool if more than one worker
+    is requested
     '''
-    args = parse_args()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(func, *iterables)
+    else:
+        yield from map(func, *iterables)
+
+
+def parse_workbooks(filenames, config, workers, cprofile=False):
+    '''
+    Parse workbooks, in parallel across a process pool if more than one
+    worker is requested. If profiling is enabled, the timings of each
+    workbook, from whichever process parsed it, are added to the profiler
+    Inputs
+        filenames (list): paths of workbooks to parse
+        config (dict): config variable
+        workers (int): number of worker processes
+        cprofile (bool): if True and profiling is enabled, also collect
+        cProfile stats for parsing
+    Outputs
+        results (iterator): (filename, df, error) for each workbook, in the
+        same order as filenames
+    '''
+    if len(filenames) < 2:
+        workers = 1
+
+    profiler = profiling.get_profiler()
+    if profiler is None:
+        yield from _map(
+            utils.parse_workbook_file, workers, filenames, repeat(config)
+        )
+        return
+
+    for result, stages, stats in _map(
+        profiling.run_profiled, workers, repeat(cprofile),
+        repeat(utils.parse_workbook_file), filenames, repeat(config)
+    ):
+        profiler.merge(stages, os.path.basename(result[0]))
+        if stats is not None:
+            profiler.add_cprofile_stats(stats)
+        yield result
+
+
+def write_workbook_results(results, engine):
+    '''
+    Record the results of parsing a batch of workbooks in the database. All
+    database writes for parsed workbooks go through this function in the
+    main process, in a single transaction per batch, with the variants of
+    all workbooks in the batch added together. If the writes fail they are
+    rolled back and, for a batch of several workbooks, each is retried on
+    its own. Workbooks that still cannot be written are left to be parsed
+    again on the next run
+    Inputs
+        results (list): (filename, df, error, previously_failed, fingerprint)
+        for each workbook, where df is the data frame extracted from the
+        workbook or None, error is the reason it failed parsing or None,
+        previously_failed is True if it is already in the inca_workbooks
+        table from a failed parse and fingerprint is the FileFingerprint of
+        the workbook file, taken when it was selected for parsing
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        written (int): number of workbooks written to the db
+    '''
+    try:
+        with db.workbook_transaction(engine) as connection:
+            variants = []
+            parsed = []
+            for filename, df, error, previously_failed, fingerprint in results:
+                file = os.path.basename(filename)
+                if not previously_failed:
+                    db.add_wb_to_db(file, "NULL", connection)
+
+                if error is not None:
+                    print(f"{file} failed parsing: {error}")
+                    db.add_error_to_db(connection, file, error, fingerprint)
+                    continue
+
+                if not df.empty:
+                    print(f"{df.shape[0]} variants to add to inca table.")
+                    variants.append(df)
+                parsed.append((file, fingerprint))
+
+            if len(variants) == 1:
+                db.add_variants_to_db(variants[0], connection)
+            elif variants:
+                db.add_variants_to_db(
+                    pd.concat(variants, ignore_index=True), connection
+                )
+            for file, fingerprint in parsed:
+                db.update_db_for_parsed_wb(file, connection, fingerprint)
+    except SQLAlchemyError as err:
+        if len(results) > 1:
+            print(
+                f"Batch of {len(results)} workbooks could not be written to "
+                f"the database, writing each separately: {err}"
+            )
+            return sum(
+                write_workbook_results([result], engine) for result in results
+            )
+        print(
+            f"{os.path.basename(results[0][0])} could not be written to the "
+            f"database and will be retried on the next run: {err}"
+        )
+        return 0
+
+    return len(results)
+
+
+def get_fingerprints(filenames, hash_cache):
+    '''
+    Get the fingerprints of workbooks, skipping any that cannot be read,
+    e.g. because they were moved or deleted since they were found
+    Inputs
+        filenames (list): paths of workbooks
+        hash_cache (fingerprints.FingerprintCache): cache of fingerprints
+    Outputs
+        file_fingerprints (dict): path -> FileFingerprint of each workbook
+        that could be read
+    '''
+    file_fingerprints = {}
+    for filename in filenames:
+        try:
+            file_fingerprints[filename] = hash_cache.get(filename)
+        except OSError as err:
+            print(f"Could not read {filename}. Skipping: {err}")
+    return file_fingerprints
+
 
+def get_organisations(config):
+    '''
+    Get the ClinVar organisations that pandora submits for
+    Inputs
+        config (dict): config variable
+    Outputs
+        organisations (dict): ClinVar organisation ID -> name of
+        organisation in config, e.g. CUH
+    '''
+    return {config[f"{name} org ID"]: name for name in ORGANISATIONS}
+
+
+def prepare_schema(engine, apply):
+    '''
+    Apply pending database schema migrations, or check that there are none,
+    so a run stops before doing any work rather than failing part way
+    through when a query needs a column or table the migrations add
+    Inputs
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+        apply (bool): if True, apply any pending migrations
+    '''
+    if apply:
+        migrations.apply_migrations(engine)
+        return
+    pending = migrations.get_pending_versions(engine)
+    if pending:
+        raise SystemExit(
+            "Database schema is out of date, migrations "
+            f"{', '.join(str(x) for x in pending)} have not been applied. "
+            "Run with --apply_migrations to apply them"
+        )
+
+
+def collect_batches_to_submit(
+    organisation_ids, engine, config, chunksize,
+    max_records=clinvar.MAX_BATCH_RECORDS, max_bytes=clinvar.MAX_BATCH_BYTES
+):
+    '''
+    Select the interpreted variants of all organisations that have not been
+    submitted, in one query reading only the columns needed for submission
+    in chunks, and split them into batches within ClinVar's limits as the
+    chunks arrive. Each organisation's last, partly filled batch is carried
+    over to the next chunk, so at most one chunk and one batch for each
+    organisation are held in memory at once
+    Inputs
+        organisation_ids (list): ClinVar organisation IDs
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+        config (dict): config variable
+        chunksize (int): number of variants read from the db at a time
+        max_records (int): maximum number of variants in a batch
+        max_bytes (int): maximum size of the variants in a batch
+    Outputs
+        batches (generator): (organisation_id, batches) for the batches
+        ready to submit after each chunk, where batches is a list of
+        (records, local_ids) as returned by clinvar.split_into_batches
+    '''
+    pending = {
+        organisation_id: ([], []) for organisation_id in organisation_ids
+    }
+    for dfs in db.select_variants_by_organisation(
+        organisation_ids, engine, "NULL", config["exclude"],
+        columns=clinvar.SUBMISSION_COLUMNS, chunksize=chunksize
+    ):
+        for organisation_id, df in dfs.items():
+            if df.empty:
+                continue
+            # the carried over batch is already serialized
+            records, local_ids = pending[organisation_id]
+            batches = list(clinvar.split_into_batches(
+                records + clinvar.collect_clinvar_data_to_submit(
+                    df, config['ref_genomes']
+                ),
+                local_ids + list(df["local_id"]), max_records, max_bytes
+            ))
+            pending[organisation_id] = batches.pop()
+            if batches:
+                yield organisation_id, batches
+
+    for organisation_id, batch in pending.items():
+        if batch[0]:
+            yield organisation_id, [batch]
+
+
+def record_batch_submission(
+    local_ids, response, engine, interval_hours, max_interval_hours
+):
+    '''
+    Record the result of submitting a batch of variants to ClinVar as soon
+    as it is known: the batch's submission ID and first status check, or an
+    error against its variants if ClinVar rejected the batch or its
+    response could not be read. If the submission ID of an accepted batch
+    cannot be recorded, it is printed so it can be recorded by hand and
+    SubmissionRecordError is raised to stop further submissions; other
+    database errors are printed rather than raised
+    Inputs
+        local_ids (list): local IDs of variants in batch
+        response (requests.Response): ClinVar API response to submission
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+        interval_hours (float): interval before the first status check
+        max_interval_hours (float): longest interval between status checks
+    '''
+    try:
+        response_json = response.json()
+    except ValueError:
+        response_json = None
+    if not 200 <= response.status_code < 300 or not isinstance(
+        response_json, dict
+    ):
+        message = None
+        if isinstance(response_json, dict):
+            message = response_json.get("message")
+        response_json = {
+            "message": message or (
+                f"HTTP {response.status_code} response to submission"
+            )
+        }
+
+    submission_id = response_json.get("id")
+    try:
+        db.add_submission_id_to_db(response_json, engine, local_ids)
+    except SQLAlchemyError as err:
+        if not submission_id:
+            print(
+                f"Could not record submission result {response_json} for "
+                f"variants {', '.join(local_ids)}: {err}"
+            )
+            return
+        # the variants would otherwise be submitted again on the next run
+        print(
+            f"ClinVar accepted submission {submission_id} but it could not "
+            f"be recorded: {err}\nRecord submission ID {submission_id} "
+            f"against variants {', '.join(local_ids)} by hand before the "
+            "next run"
+        )
+        raise clinvar.SubmissionRecordError(
+            f"submission {submission_id} could not be recorded"
+        ) from err
+
+    if not submission_id:
+        return
+    try:
+        # first check after ClinVar has had time to process the submission
+        now = datetime.datetime.now()
+        db.record_submission_polls({
+            submission_id: (
+                None, 0, poll_schedule.next_poll_at(
+                    0, now, interval_hours, max_interval_hours
+                ), False
+            )
+        }, engine)
+    except SQLAlchemyError as err:
+        print(
+            f"Could not schedule status checks of submission "
+            f"{submission_id}; it will be checked on the next run: {err}"
+        )
+
+
+def run(args):
+    '''
+    Poll ClinVar for accession IDs, parse workbooks and submit variants
+    Inputs
+        args (argparse.Namespace): command line arguments
+    '''
     # Read files
     config = open_json(args.config)
     api_keys = open_json(args.clinvar_api_key)
     db_creds = open_json(args.db_credentials)
 
-    # Set up API headers and select API url
-    cuh_api_key = api_keys["cuh"]
-    nuh_api_key = api_keys["nuh"]
-
-    cuh_header = clinvar.create_header(cuh_api_key)
-    nuh_header = clinvar.create_header(nuh_api_key)
+    # Set up API headers for each organisation and select API url
+    organisations = get_organisations(config)
+    headers = {
+        organisation_id: clinvar.create_header(api_keys[name.lower()])
+        for organisation_id, name in organisations.items()
+    }
     api_url = utils.select_api_url(args.clinvar_testing, config)
+    clinvar_client = clinvar.ClinVarClient(
+        pool_size=max(args.poll_workers, args.submission_workers),
+        rate=args.clinvar_rate
+    )
 
     # Create SQLAlchemy engine to connect to AWS database
     url = (
@@ -94,84 +529,231 @@ def main():
         f"{db_creds['user']}:{db_creds['pwd']}@{db_creds['endpoint']}/ngtd"
     )
 
-    engine = create_engine(url)
+    engine = db.create_db_engine(url, pool_size=args.db_pool_size)
+
+    prepare_schema(engine, args.apply_migrations)
 
     # Ignore UserWarnings from setting dataframe attributes
     warnings.simplefilter(action='ignore', category=UserWarning)
 
-    # Identify cases in database which have a submission ID but no accession ID
-    print("Searching for variants will no accession ID...")
-    cuh_submission_df = db.select_variants_from_db(288359, engine, "NOT NULL")
-    nuh_submission_df = db.select_variants_from_db(509428, engine, "NOT NULL")
+    # Identify cases in database which have a submission ID but no accession
+    # ID, and query clinvar API to retrieve accession IDs, checking
+    # submissions concurrently and writing the results back together
+    with profiling.stage("accession_polling"):
+        # Submissions whose summary files have been downloaded before are
+        # read from the local cache; optionally only those are checked, to
+        # write their results to the database again without calling the API.
+        # Otherwise only submissions due to be checked are selected, with the
+        # interval between checks of a submission doubling each time, and
+        # submissions in a terminal state are not checked again
+        summary_files = summary_cache.SummaryFileCache(
+            args.summary_cache, args.summary_cache_size * 1024 ** 2
+        )
+        now = datetime.datetime.now()
+        if args.reapply_cached_summaries:
+            submission_dfs = db.select_variants_by_organisation(
+                list(organisations), engine, "NOT NULL",
+                columns=["submission_id"]
+            )
+            submissions = [
+                (organisation_id, submission_id)
+                for organisation_id, df in submission_dfs.items()
+                for submission_id in df["submission_id"].unique()
+                if submission_id in summary_files
+            ]
+            schedule = db.select_poll_schedule(
+                [submission_id for _, submission_id in submissions], engine
+            )
+            print(
+                f"Re-applying cached summary files of {len(submissions)} "
+                "submissions"
+            )
+        else:
+            print("Searching for submissions due to be checked...")
+            submissions, schedule = db.select_due_submissions(
+                list(organisations), engine, now
+            )
+            for organisation_id, name in organisations.items():
+                count = sum(x[0] == organisation_id for x in submissions)
+                print(
+                    f"Found {count} submissions without accession IDs due "
+                    f"to be checked for {name}."
+                )
+        accession_ids, errors, statuses = clinvar.poll_submission_statuses(
+            submissions, headers, api_url, args.poll_workers, clinvar_client,
+            summary_files
+        )
+        summary_files.save()
+
+        if accession_ids != {}:
+            db.add_accession_ids_to_db(accession_ids, engine)
+
+        if errors != {}:
+            db.add_clinvar_submission_error_to_db(errors, engine)
 
-    print(
-        f"Found {nuh_submission_df.shape[0]} with submission IDs but no "
-        f"accession IDs for NUH.\nFound {cuh_submission_df.shape[0]} "
-        "with submission IDs but no accession IDs for CUH."
+        # recorded once the results are written, so a submission is only
+        # marked as terminal after its accession IDs and errors are stored
+        db.record_submission_polls(
+            poll_schedule.update_schedule(
+                statuses, schedule, now, args.poll_interval_hours,
+                args.max_poll_interval_hours
+            ),
+            engine
         )
 
-    cuh_submission_df.header = cuh_header
-    nuh_submission_df.header = nuh_header
+    # Get any new workbooks and re-run any failed workbooks in given path
+    if args.path_to_workbooks:
+        roots = args.path_to_workbooks
+        if args.org_subfolders:
+            roots = [
+                os.path.join(path, config[f"{name} folder"])
+                for path in args.path_to_workbooks
+                for name in ORGANISATIONS
+            ]
+        with profiling.stage("workbook_scan"):
+            print(f"Searching {', '.join(roots)}...")
+            scanner = workbook_scanner.WorkbookScanner(
+                args.scan_manifest, args.recursive
+            )
+            changed, unchanged = scanner.scan(roots, args.full_scan)
+            print(
+                f"Found {len(changed) + len(unchanged)} workbooks, "
+                f"{len(changed)} new or changed since last scan"
+            )
 
-    # If any exist, query clinvar API to retrieve accession IDs
-    for df in [cuh_submission_df, nuh_submission_df]:
-        if not df.empty:
-            for submission_id in list(df["submission_id"].unique()):
-                status, response = utils.submission_status_check(
-                    submission_id, df.header, api_url
-                )
-                accession_ids, errors = clinvar.process_submission_status(
-                    status, response
+        # Look up which of the workbooks found are already in the database.
+        # Unchanged workbooks the manifest records as parsed on an earlier
+        # run are skipped without a lookup, unless doing a full scan
+        with profiling.stage("workbook_selection"):
+            candidates = changed + [
+                filename for filename in unchanged
+                if args.full_scan or not scanner.is_parsed(filename)
+            ]
+            parsed_list, failed_list, unhashed_list = (
+                db.lookup_known_workbooks(
+                    {os.path.basename(x) for x in candidates}, engine
                 )
+            )
+            scanner.mark_parsed(
+                filename for filename in candidates
+                if os.path.basename(filename) in parsed_list
+            )
 
-                if accession_ids != {}:
-                    db.add_accession_ids_to_db(accession_ids, engine)
+            # Unchanged workbooks only need considering if they have not been
+            # parsed successfully, e.g. failed workbooks due a retry
+            filenames = changed + [
+                filename for filename in candidates[len(changed):]
+                if os.path.basename(filename) not in parsed_list
+            ]
+            failed_workbooks = {}
+            if failed_list and not args.retry_all_failed:
+                failed_workbooks = {
+                    record.workbook_name: record
+                    for record in db.select_workbooks_by_name(
+                        failed_list.intersection(
+                            os.path.basename(x) for x in filenames
+                        ),
+                        engine
+                    ).itertuples(index=False)
+                }
 
-                if errors != {}:
-                    db.add_clinvar_submission_error_to_db(
-                        errors, engine.connect()
+            # Hash workbooks not yet parsed, and parsed workbooks without a
+            # stored hash, then look up previously parsed workbooks with the
+            # same contents to skip workbooks that were renamed or copied to
+            # another folder. Workbooks moved or deleted since the scan are
+            # skipped, and found again by the next scan if they reappear
+            hash_cache = fingerprints.FingerprintCache(args.hash_cache)
+            to_hash = [
+                filename for filename in filenames
+                if os.path.basename(filename) not in parsed_list
+                or os.path.basename(filename) in unhashed_list
+            ]
+            file_fingerprints = get_fingerprints(to_hash, hash_cache)
+            filenames = [
+                filename for filename in filenames
+                if filename in file_fingerprints or filename not in to_hash
+            ]
+            hash_index = {}
+            if file_fingerprints:
+                hash_index = fingerprints.build_hash_index(
+                    db.select_parsed_workbooks_by_hash(
+                        {x.file_hash for x in file_fingerprints.values()},
+                        engine
                     )
+                )
+            duplicates = []
 
-    # Get any new workbooks and re-run any failed workbooks in given path
-    if args.path_to_workbooks:
-        print(f"Searching {args.path_to_workbooks}...")
-        filenames = glob.glob(args.path_to_workbooks + "*.xlsx")
-        print(f"Found {len(filenames)} workbooks")
-
-        # Get previously parsed workbooks
-        parsed_workbook_df = db.select_workbooks_from_db(
-            engine, "parse_status = TRUE"
-        )
-        parsed_list = parsed_workbook_df['workbook_name'].values
-        failed_parsing_df = db.select_workbooks_from_db(
-            engine, "parse_status = FALSE"
-        )
-        failed_list = failed_parsing_df['workbook_name'].values
+            to_parse = []
+            for filename in filenames:
+                print(f"Processing {filename}")
+                # check if wb has not already been processed
+                file = os.path.basename(filename)
+                if file in parsed_list:
+                    print(f"{file} has already been parsed. Skipping...")
+                    if file in unhashed_list:
+                        # backfill hash for workbooks parsed before hashing
+                        fingerprint = file_fingerprints[filename]
+                        hash_index.setdefault(fingerprint.file_hash, file)
+                        db.add_fingerprint_to_db(file, fingerprint, engine)
+                    continue
 
-        for filename in filenames:
-            print(f"Processing {filename}")
-            # check if wb has not already been processed
-            file = os.path.basename(filename)
-            if file not in parsed_list:
+                fingerprint = file_fingerprints[filename]
+                duplicate_of = hash_index.get(fingerprint.file_hash)
+                if duplicate_of is not None:
+                    print(
+                        f"{file} has the same contents as {duplicate_of}. "
+                        "Skipping..."
+                    )
+                    duplicates.append((file, duplicate_of))
+                    scanner.mark_parsed([filename])
+                    continue
+                if file in failed_workbooks and not args.retry_all_failed:
+                    try:
+                        retry = fingerprints.should_retry_failed_workbook(
+                            filename, failed_workbooks[file],
+                            args.failed_retry_days
+                        )
+                    except OSError as err:
+                        print(f"Could not read {filename}. Skipping: {err}")
+                        continue
+                    if not retry:
+                        print(
+                            f"{file} previously failed parsing and has not "
+                            "changed. Skipping..."
+                        )
+                        continue
                 print(
-                    f"{file} has not previously been parsed successfully.\n"
-                    f"Parsing {file}..."
+                    f"{file} has not previously been parsed "
+                    f"successfully.\nParsing {file}..."
                 )
-                workbook = load_workbook(filename)
-                if file not in failed_list:
-                    db.add_wb_to_db(file, "NULL", engine.connect())
+                hash_index[fingerprint.file_hash] = file
+                to_parse.append(filename)
+            hash_cache.save()
 
-                # Get a df of data from each sheet in workbook:
-                df = utils.get_workbook_data(
-                    workbook, config, filename, file, engine.connect()
-                )
-                if df is not None:
-                    if not df.empty:
-                        print(f"{df.shape[0]} variants to add to inca table.")
-                        db.add_variants_to_db(df, engine.connect())
-                    db.update_db_for_parsed_wb(file, engine.connect())
-            else:
-                print(f"{file} has already been parsed. Skipping...")
+        if duplicates:
+            print(f"Found {len(duplicates)} duplicate workbooks not parsed:")
+            for file, duplicate_of in duplicates:
+                print(f"{file} is a duplicate of {duplicate_of}")
+
+        # Parse workbooks (optionally in parallel) and write the results to
+        # the database from this process in batches, in the order the files
+        # were found
+        batch = []
+        for filename, df, error in parse_workbooks(
+            to_parse, config, args.workers, bool(args.cprofile)
+        ):
+            file = os.path.basename(filename)
+            batch.append((
+                filename, df, error, file in failed_workbooks,
+                file_fingerprints[filename]
+            ))
+            if len(batch) >= args.db_batch_size or filename == to_parse[-1]:
+                # attribute write time to the workbook if written alone
+                with profiling.workbook(file if len(batch) == 1 else None):
+                    with profiling.stage("db_write"):
+                        write_workbook_results(batch, engine)
+                batch = []
+        scanner.save()
 
     else:
         print("no path_to_workbooks to specified. Nothing to parse")
@@ -179,34 +761,66 @@ def main():
     # Select all variants that have interpreted = yes and are not submitted
     # Also exclude any variants meeting exclusion criteria set in the config
     if not args.hold_for_review:
-        exclude = config["exclude"]
-        cuh_df = db.select_variants_from_db(288359, engine, "NULL", exclude)
-        nuh_df = db.select_variants_from_db(509428, engine, "NULL", exclude)
-        print(
-            f"Found {nuh_df.shape[0]} interpreted variants to submit for NUH.\n"
-            f"Found {cuh_df.shape[0]} interpreted variants to submit for CUH."
-            )
-        cuh_df.url, cuh_df.header = config.get("CUH_acgs_url"), cuh_header
-        nuh_df.url, nuh_df.header = config.get("NUH_acgs_url"), nuh_header
-
-        # Get clinvar information from each variant and submit
-        for df in [cuh_df, nuh_df]:
-            if not df.empty:
-                variants = clinvar.collect_clinvar_data_to_submit(
-                    df, config['ref_genomes']
+        with profiling.stage("clinvar_submission"):
+            # Submit clinvar information of each variant, in batches within
+            # ClinVar's limits as the variants are read from the database,
+            # recording each batch's submission ID against the variants in it
+            on_result = None
+            if args.clinvar_testing is False:
+                on_result = partial(
+                    record_batch_submission, engine=engine,
+                    interval_hours=args.poll_interval_hours,
+                    max_interval_hours=args.max_poll_interval_hours
                 )
-                response = clinvar.clinvar_api_request(
-                    api_url, df.header, variants, df.url,
-                    args.print_submission_json
+            submitted = dict.fromkeys(organisations, 0)
+            for organisation_id, batches in collect_batches_to_submit(
+                list(organisations), engine, config, args.select_chunk_size,
+                args.submission_batch_size, args.submission_batch_bytes
+            ):
+                name = organisations[organisation_id]
+                variant_count = sum(len(x[1]) for x in batches)
+                print(
+                    f"Submitting {variant_count} variants for {name} in "
+                    f"{len(batches)} batches"
                 )
-                if args.clinvar_testing is False:
-                    db.add_submission_id_to_db(
-                        response.json(),
-                        engine.connect(),
-                        df['local_id'].values
+                try:
+                    clinvar.submit_batches(
+                        api_url, headers[organisation_id], batches,
+                        config.get(f"{name}_acgs_url"),
+                        args.print_submission_json, clinvar_client,
+                        args.submission_workers, on_result
                     )
+                except clinvar.SubmissionRecordError as err:
+                    clinvar_client.close()
+                    raise SystemExit(
+                        f"Stopped submitting variants, {err}. Check the "
+                        "database connection before running again"
+                    ) from err
+                submitted[organisation_id] += variant_count
+            for organisation_id, name in organisations.items():
+                print(
+                    f"Submitted {submitted[organisation_id]} interpreted "
+                    f"variants for {name}."
+                )
     else:
         print("hold_for_review specified. Variants will not be submitted.")
 
+    clinvar_client.close()
+
+
+def main():
+    '''
+    Script entry point
+    '''
+    args = parse_args()
+    profiler = profiling.enable_profiling() if args.profile else None
+    try:
+        run(args)
+    finally:
+        # write timings even if the run failed, to show where it got to
+        if profiler is not None:
+            profiler.write_report(args.profile, args.cprofile)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,281 @@
+"""
+Previous row-by-row implementations of functions in utils, kept as reference
+implementations for parity tests and benchmarks of their replacements
+"""
+import re
+import numpy as np
+import pandas as pd
+from utils.clinvar import extract_clinvar_information
+
+
+def legacy_make_acgs_criteria_null_if_not_applied(df, acgs_criteria):
+    '''
+    The workbook has a value "NA" for ACGS criteria that was not applied. This
+    function finds any variant row that had "NA" for a criteria and changes it
+    to null. If an ACGS criteria is null, the evidence column for that column
+    should also be null, so this function also sets any evidence field for a
+    criteria that was not applied to null.
+    Inputs:
+        df (pd.Dataframe): a dataframe with a column for each ACGS criterion
+        and each row the strength of that criteria applied to the row's variant
+        acgs_criteria (list): list of ACGS criteria that make up the columns in
+        the df
+    Outputs:
+        df (pd.Dataframe): the same dataframe, now with null instead of "NA"
+        for criteria that were not applied, and a null value for evidence for
+        all criteria not applied.
+    '''
+    for index, row, in df.iterrows():
+        for criterion in acgs_criteria:
+            if row[criterion] == "NA":
+                df.loc[index, criterion] = np.nan
+
+    for index, row, in df.iterrows():
+        for criterion in acgs_criteria:
+            if pd.isna(row[criterion]):
+                df.loc[index, criterion + "_evidence"] = np.nan
+
+    return df
+
+
+def legacy_add_comment_on_classification(df, acgs_criteria, config):
+    '''
+    This function should take in a df with a column for each ACGS criteria with
+    the values in that column being the strength of the criteria and return the
+    same df but with a value in the comment_on_classification column that
+    summarises all the ACGS criteria applied for each variant.
+    If the criterion has the same strength as default for that criterion, the
+    strength is not included, if it differs it is included
+    e.g. if the df has:
+        pvs1    pm3         pp3
+        null    supporting  supporting
+    the comment_on_classification should be PM3_Supporting,PP3
+
+    Inputs:
+        df (pd.Dataframe): dataframe with a column for each ACGS criterion and
+        each row the strength of that criteria applied to the row's variant
+        acgs_criteria (list): list of ACGS criteria that make up the columns in
+        the df
+        config (dict): config file as dict, contains a dict mapping ACGS
+        criteria to their default strength
+    Outputs:
+        df (pd.Dataframe): the same dataframe, now with a value in the
+        comment_on_classification column which summarises all the ACGS criteria
+        applied for the variants
+    '''
+    matched_strength = config.get("matched_strength")
+    df["comment_on_classification"] = ""
+
+    for index, row, in df.iterrows():
+        acgs = {}
+        for criterion in acgs_criteria:
+            if pd.notna(row[criterion]):
+                acgs[criterion.upper()] = row[criterion]
+                if matched_strength[criterion.upper()[:-1]] == row[criterion]:
+                    acgs[criterion.upper()] = ""
+
+        comment = ','.join([
+            f"{criterion}_{strength}"if strength != ""
+            else criterion for criterion, strength in acgs.items()
+        ])
+        df.loc[index, "comment_on_classification"] = comment
+
+    return df
+
+
+def legacy_check_interpret_table(df_interpret, df_included, config):
+    '''
+    Check if ACMG classification and HGVSc are correctly
+    filled in in the interpret table(s)
+    Inputs
+        df_interpret (pd.Dataframe): df from interpret sheet(s)
+        df_included (pd.Dataframe): df from included sheet
+        config (dict): config variable
+    Outputs
+      error_msg (str): error message
+    '''
+    error_msg = []
+    strength_dropdown = config.get("strength_dropdown")
+    BA1_dropdown = config.get("BA1_dropdown")
+    for row in range(df_interpret.shape[0]):
+        try:
+            assert (
+                pd.notna(df_interpret.loc[row, "germline_classification"])
+            ), "empty ACMG classification in interpret table"
+            assert df_interpret.loc[row, "germline_classification"] in [
+                "Pathogenic",
+                "Likely Pathogenic",
+                "Uncertain Significance",
+                "Likely Benign",
+                "Benign",
+            ], "wrong ACMG classification in interpret table"
+            assert (
+                pd.notna(df_interpret.loc[row, "hgvsc"])
+            ), "empty HGVSc in interpret table"
+            assert df_interpret.loc[row, "hgvsc"] in list(df_included["hgvsc"]), (
+                "HGVSc in interpret table does not match with that in "
+                "included sheet"
+            )
+            acgs_criteria = config.get("acgs_criteria")
+            for criteria in acgs_criteria:
+                if pd.notna(df_interpret.loc[row, criteria]):
+                    assert (
+                        df_interpret.loc[row, criteria] in strength_dropdown
+                    ), f"Wrong strength in {criteria}"
+
+            if pd.notna(df_interpret.loc[row, "ba1"]):
+                assert (
+                    df_interpret.loc[row, "ba1"] in BA1_dropdown
+                ), "Wrong strength in BA1"
+
+        except AssertionError as msg:
+            error_msg.append(str(msg))
+
+    error_msg = "".join(error_msg)
+
+    if error_msg == "":
+        error_msg = None
+
+    return error_msg
+
+
+def legacy_checking_sheets(workbook):
+    '''
+    Check if extra row(s)/col(s) are added in the sheets
+    Inputs
+        workbook (WorkbookValues or openpyxl wb object): object of query
+        workbook with variants
+    Outputs
+        error_msg (str): error message
+    '''
+    summary = workbook["summary"]
+    reports = [
+        idx
+        for idx in workbook.sheetnames
+        if idx.lower().startswith("interpret")
+    ]
+    try:
+        assert (
+            summary["G21"].value == "Date"
+        ), "extra col(s) added or change(s) done in summary sheet"
+        for sheet in reports:
+            report = workbook[sheet]
+            assert report["B26"].value == "FINAL ACMG CLASSIFICATION", (
+                "extra row(s) or col(s) added or change(s) done in "
+                "interpret sheet"
+            )
+            assert report["L8"].value == "B_POINTS", (
+                "extra row(s) or col(s) added or change(s) done in "
+                "interpret sheet"
+            )
+        error_msg = None
+    except AssertionError as msg:
+        error_msg = str(msg)
+
+    return error_msg
+
+
+def legacy_check_interpreted_col(df):
+    '''
+    Check if interpreted col in included sheet is correctly filled in
+    Inputs
+        df (pd.DataFrame): merged dataframe with data from workbook
+        error_msg (str): error message
+    '''
+    error_msg = []
+    yes_df = df[df["interpreted"] == "yes"]
+    no_df = df[df["interpreted"] == "no"]
+
+    if not df["interpreted"].isin(['yes', 'no']).all():
+        error_msg.append(
+            "Values in interpreted column are not all either 'yes' or 'no'"
+        )
+
+    for index, row in yes_df.iterrows():
+        if pd.isna(row["germline_classification"]):
+            error_msg.append(
+                f"Variant {row['hgvsc']} has interpreted = yes, but no final "
+                "classification could be extracted from interpret sheets."
+            )
+
+    for index, row in no_df.iterrows():
+        if pd.notna(row["germline_classification"]):
+            error_msg.append(
+                f"Variant {row['hgvsc']} has interpreted = no, but a final "
+                "classification could be extracted from interpret sheets."
+            )
+
+    error_msg = " ".join(error_msg)
+
+    if error_msg == "":
+        error_msg = None
+
+    return error_msg
+
+
+def legacy_check_sample_name(instrumentID, sample_ID, batchID, testcode, probesetID):
+    '''
+    Checking that individual parts of sample name have expected naming format
+    Inputs
+      str values for instrumentID, sample_ID, batchID, testcode,
+      probesetID
+    Outputs
+        error_msg (str): error message
+    '''
+    try:
+        assert re.match(
+            r"^\d{9}$", instrumentID
+        ), "Unusual name for instrumentID"
+        assert re.match(r"^\d{5}[A-Z]\d{4}$", sample_ID), "Unusual sampleID"
+        assert re.match(r"^\d{2}[A-Z]{5}\d{1,}$", batchID), "Unusual batchID"
+        assert re.match(r"^\d{4}$", testcode), "Unusual testcode"
+        assert 0 < len(probesetID) < 20, "probesetID is too long/short"
+        assert (
+            probesetID.isalnum() and not probesetID.isalpha()
+        ), "Unusual probesetID"
+        error_msg = None
+    except AssertionError as msg:
+        error_msg = str(msg)
+
+    return error_msg
+
+
+def legacy_extract_report_fields(workbook, field_cells):
+    '''
+    Cell by cell extraction of field_cells from interpret sheets, as
+    previously done in get_report_fields
+    '''
+    col_name = [i[0] for i in field_cells]
+    df_report = pd.DataFrame(columns=col_name)
+    report_sheets = [
+        idx
+        for idx in workbook.sheetnames
+        if idx.lower().startswith("interpret")
+    ]
+
+    for idx, sheet in enumerate(report_sheets):
+        for field, cell in field_cells:
+            if workbook[sheet][cell].value is not None:
+                df_report.loc[idx, field] = workbook[sheet][cell].value
+    df_report.reset_index(drop=True, inplace=True)
+    return df_report
+
+
+def legacy_collect_clinvar_data_to_submit(clinvar_df, ref_genomes):
+    '''
+    Cycle through a dataframe, and extract variants for each row. Call the
+    function to reformat this into a dictionary for submission to ClinVar and
+    return a list of these dictionaries
+    Inputs
+        clinvar_df (pandas.Dataframe): variant dataframe
+        ref_genomes (list): list of valid reference genome values from config
+    Outputs
+        variants (list): list of dictionaries with variant data for submission
+        to ClinVar
+    '''
+    variants = []
+    for index, variant in clinvar_df.iterrows():
+        clinvar_dict = extract_clinvar_information(variant, ref_genomes)
+        variants.append(clinvar_dict)
+
+    return variants
@@ -1,9 +1,46 @@
 import utils.clinvar as clinvar
 import pandas as pd
+import threading
 import unittest
 import unittest.mock as mock
 import json
+import requests
 from copy import deepcopy
+import numpy as np
+from tests import legacy_implementations as legacy
+
+
+def make_random_variant_df(n_variants, seed=0):
+    '''
+    Make a dataframe of variants to submit, as selected from the inca table,
+    with a mix of value types and missing values
+    '''
+    rng = np.random.default_rng(seed)
+
+    def choice(values):
+        return rng.choice(np.array(values, dtype=object), n_variants)
+
+    return pd.DataFrame({
+        "local_id": [f"uid_{x}" for x in range(n_variants)],
+        "linking_id": [f"uid_{x}" for x in range(n_variants)],
+        "ref_genome": choice(["GRCh37.p13", "GRCh38.p13"]),
+        "germline_classification": choice(
+            ["Pathogenic", "Likely pathogenic", "Uncertain significance"]
+        ),
+        "comment_on_classification": choice(["PVS1,PM3_Strong", None]),
+        "date_last_evaluated": choice(
+            [pd.Timestamp("2024-10-10"), "2024-10-11", None]
+        ),
+        "preferred_condition_name": choice(["Cystic fibrosis", None]),
+        "affected_status": "yes",
+        "allele_origin": "germline",
+        "collection_method": "clinical testing",
+        "chromosome": choice([7, "X", 17]),
+        "start": rng.integers(1, 2 ** 28, n_variants),
+        "reference_allele": choice(["C", "G", "TA"]),
+        "alternate_allele": choice(["CA", "T", np.nan]),
+        "gene_symbol": choice(["CFTR", "BRCA1", None]),
+    })
 
 
 class TestClinvar(unittest.TestCase):
@@ -99,6 +136,17 @@ class TestClinvar(unittest.TestCase):
         )
         assert clinvar_submission == self.correct_submission_dict
 
+    def test_submission_columns_are_all_that_is_needed(self):
+        '''
+        Variants selected with only SUBMISSION_COLUMNS should give the same
+        submission as the full record
+        '''
+        projected = self.df[list(clinvar.SUBMISSION_COLUMNS)]
+        clinvar_submission = clinvar.extract_clinvar_information(
+            projected.iloc[0], self.ref_genomes
+        )
+        assert clinvar_submission == self.correct_submission_dict
+
     def test_error_if_ref_genome_not_in_list_of_ref_genomes(self):
         invalid_df = self.df.copy()
         invalid_df.loc[0, 'ref_genome'] = 'invalid'
@@ -124,6 +172,26 @@ class TestClinvar(unittest.TestCase):
             self.correct_submission_dict
         ]
 
+    def test_records_match_row_by_row_extraction(self):
+        for n_variants in [0, 1, 50]:
+            df = make_random_variant_df(n_variants, seed=n_variants)
+            with self.subTest(n_variants=n_variants):
+                assert json.dumps(
+                    clinvar.build_submission_records(df, self.ref_genomes),
+                    default=str
+                ) == json.dumps(
+                    legacy.legacy_collect_clinvar_data_to_submit(
+                        df, self.ref_genomes
+                    ),
+                    default=str
+                )
+
+    def test_records_error_if_ref_genome_not_in_list_of_ref_genomes(self):
+        df = make_random_variant_df(5)
+        df.loc[3, "ref_genome"] = "invalid"
+        with self.assertRaises(ValueError, msg="Invalid genome build"):
+            clinvar.build_submission_records(df, self.ref_genomes)
+
     def test_create_header(self):
         assert clinvar.create_header('foobar') == (
             {"SP-API-KEY": 'foobar', "Content-type": "application/json"}
@@ -135,7 +203,8 @@ class TestClinvar(unittest.TestCase):
         Test that the clinvar API request function makes post requests as
         expected.
         '''
-        mock_session.return_value.post.return_value = {'id': 'SUB12345'}
+        mock_response = mock.MagicMock(status_code=200)
+        mock_session.return_value.post.return_value = mock_response
 
         # Define inputs to clinvar_api_request
         api_url = 'https://clinvar-api.fake-url.com/submit'
@@ -165,11 +234,23 @@ class TestClinvar(unittest.TestCase):
         )
         with self.subTest("Check the function was called with expected data"):
             mock_session.return_value.post.assert_called_once_with(
-                api_url, data=json.dumps(correct_data), headers=headers
+                api_url, data=clinvar.encode_payload(correct_data),
+                headers=headers,
+                timeout=clinvar.CLINVAR_TIMEOUT
             )
 
         with self.subTest("Check the function returned the mocked response"):
-            assert response == {'id': 'SUB12345'}
+            assert response is mock_response
+
+    @mock.patch('builtins.print')
+    def test_clinvar_api_request_printed_json_is_body(self, mock_print):
+        client = mock.MagicMock()
+        clinvar.clinvar_api_request(
+            'https://clinvar-api.fake-url.com/submit', {},
+            [self.correct_submission_dict], 'https://acgs', True, client
+        )
+        body = client.post.call_args[0][1]
+        mock_print.assert_called_with(body.decode())
 
     def test_process_submission_status_with_one_error_message(self):
         assert clinvar.process_submission_status(
@@ -204,3 +285,448 @@ class TestClinvar(unittest.TestCase):
         assert clinvar.process_submission_status('processed', response) == (
             {"uid_67890": "SCV000067890", "uid_12345": "SCV000012345"}, {}
         )
+
+
+class TestEncodePayload(unittest.TestCase):
+    data = {
+        "timestamp": pd.Timestamp("2024-10-10"),
+        "date": pd.Timestamp("2024-10-11").date(),
+        "int": np.int64(117232266),
+        "float": np.float64(1.5),
+        "bool": np.bool_(True),
+        "array": np.array([1, 2]),
+        "none": None,
+        "text": "c.1521_1523del",
+    }
+    expected = {
+        "timestamp": "2024-10-10 00:00:00",
+        "date": "2024-10-11",
+        "int": 117232266,
+        "float": 1.5,
+        "bool": True,
+        "array": [1, 2],
+        "none": None,
+        "text": "c.1521_1523del",
+    }
+
+    def test_types_converted_with_json(self):
+        with mock.patch("utils.clinvar.orjson", None):
+            body = clinvar.encode_payload(self.data)
+        assert json.loads(body) == self.expected
+
+    def test_types_converted_with_orjson(self):
+        if clinvar.orjson is None:
+            self.skipTest("orjson not installed")
+        assert json.loads(clinvar.encode_payload(self.data)) == self.expected
+
+    def test_backends_give_same_bytes(self):
+        data = {
+            "text": "Caén",
+            "nan": np.nan,
+            "float_nan": np.float32("nan"),
+            "nested": [
+                {"inf": float("inf"), "array": np.array([1.5, np.nan])}
+            ],
+            "tuple": (1, 2),
+            "date": pd.Timestamp("2024-10-11").date(),
+        }
+        expected = (
+            '{"text":"Caén","nan":null,"float_nan":null,'
+            '"nested":[{"inf":null,"array":[1.5,null]}],"tuple":[1,2],'
+            '"date":"2024-10-11"}'
+        ).encode()
+        with self.subTest("json"):
+            with mock.patch("utils.clinvar.orjson", None):
+                assert clinvar.encode_payload(data) == expected
+        with self.subTest("orjson"):
+            if clinvar.orjson is None:
+                self.skipTest("orjson not installed")
+            assert clinvar.encode_payload(data) == expected
+
+
+class TestClinVarClient(unittest.TestCase):
+    cuh = {"SP-API-KEY": "cuh", "Content-type": "application/json"}
+    nuh = {"SP-API-KEY": "nuh", "Content-type": "application/json"}
+
+    @mock.patch("requests.Session")
+    def test_one_session_per_api_key(self, mock_session):
+        mock_session.side_effect = lambda: mock.MagicMock(**{
+            "get.return_value.status_code": 200,
+            "post.return_value.status_code": 200,
+        })
+        client = clinvar.ClinVarClient(pool_size=4)
+        client.get("https://clinvar/SUB1/actions", self.cuh)
+        client.post("https://clinvar", "{}", self.cuh)
+        client.get("https://clinvar/SUB2/actions", self.nuh)
+        with self.subTest("Sessions reused for each key"):
+            assert mock_session.call_count == 2
+            assert client.session(self.cuh) is not client.session(self.nuh)
+        with self.subTest("Requests made with timeout"):
+            client.session(self.cuh).post.assert_called_once_with(
+                "https://clinvar", data="{}", headers=self.cuh,
+                timeout=clinvar.CLINVAR_TIMEOUT
+            )
+        with self.subTest("Sessions closed"):
+            session = client.session(self.nuh)
+            client.close()
+            session.close.assert_called_once_with()
+
+    def test_connection_pool_sized(self):
+        client = clinvar.ClinVarClient(pool_size=16)
+        adapter = client.session(self.cuh).get_adapter("https://clinvar")
+        assert adapter._pool_maxsize == 16
+        assert adapter.max_retries.total == 3
+
+
+class TestRateLimitingAndCircuitBreaker(unittest.TestCase):
+    header = {"SP-API-KEY": "cuh"}
+
+    @staticmethod
+    def response(status_code, headers=None):
+        return mock.MagicMock(status_code=status_code, headers=headers or {})
+
+    def client_with_responses(self, responses, **kwargs):
+        client = clinvar.ClinVarClient(**kwargs)
+        session = mock.MagicMock()
+        session.get.side_effect = responses
+        client._sessions[self.header["SP-API-KEY"]] = session
+        return client, session
+
+    @mock.patch("utils.clinvar.time")
+    def test_rate_limited_request_retried_after_delay(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        client, session = self.client_with_responses([
+            self.response(429, {"Retry-After": "7"}), self.response(200)
+        ])
+        response = client.get("https://clinvar/SUB1/actions", self.header)
+        with self.subTest("Retried once"):
+            assert response.status_code == 200
+            assert session.get.call_count == 2
+        with self.subTest("Waited for Retry-After"):
+            mock_time.sleep.assert_called_once_with(7.0)
+
+    def test_long_retry_after_not_waited_for(self):
+        client, session = self.client_with_responses(
+            [self.response(429, {"Retry-After": "3600"})]
+        )
+        response = client.get("https://clinvar/SUB1/actions", self.header)
+        assert response.status_code == 429
+        assert session.get.call_count == 1
+
+    def test_circuit_opens_and_fails_fast(self):
+        breaker = clinvar.CircuitBreaker(
+            failure_rate=0.5, min_calls=4, window=4
+        )
+        client, session = self.client_with_responses(
+            [self.response(200), self.response(503), self.response(503)],
+            circuit_breaker=breaker
+        )
+        session.get.side_effect = list(session.get.side_effect) + [
+            requests.exceptions.ConnectionError("Timed out")
+        ]
+        for _ in range(3):
+            client.get("https://clinvar/SUB1/actions", self.header)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("https://clinvar/SUB1/actions", self.header)
+
+        with self.subTest("Open once failure rate reached"):
+            assert breaker.is_open
+        with self.subTest("Further calls not made"):
+            with self.assertRaises(clinvar.CircuitOpenError):
+                client.get("https://clinvar/SUB1/actions", self.header)
+            assert session.get.call_count == 4
+
+    @mock.patch("utils.clinvar.time")
+    def test_circuit_closes_after_reset(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        breaker = clinvar.CircuitBreaker(min_calls=1, reset_after=60)
+        breaker.record(False)
+        assert breaker.is_open
+        mock_time.monotonic.return_value = 160.0
+        assert not breaker.is_open
+
+    def test_retry_after_http_date(self):
+        retry_at = pd.Timestamp.now(tz="UTC") + pd.Timedelta(seconds=30)
+        response = self.response(429, {
+            "Retry-After": retry_at.strftime("%a, %d %b %Y %H:%M:%S GMT")
+        })
+        assert 25 < clinvar.retry_after_seconds(response) <= 30
+
+    @mock.patch("utils.clinvar.time")
+    def test_token_bucket_allows_burst_then_refills(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        limiter = clinvar.RateLimiter(2, burst=2)
+        mock_time.monotonic.return_value = 110.0
+        for _ in range(3):
+            limiter.wait()
+        with self.subTest("Burst not delayed"):
+            assert [x[0][0] for x in mock_time.sleep.call_args_list] == [0.5]
+        limiter.pause(10)
+        limiter.wait()
+        with self.subTest("Paused"):
+            assert mock_time.sleep.call_args[0][0] == 10
+
+
+class TestPollSubmissionStatuses(unittest.TestCase):
+    headers = {"1234": {"SP-API-KEY": "cuh"}, "5678": {"SP-API-KEY": "nuh"}}
+    api_url = "https://clinvar-api.fake-url.com/submit"
+
+    @staticmethod
+    def processed(local_id, accession=None, error=None):
+        submission = {"identifiers": {"localID": local_id}}
+        if accession is not None:
+            submission["identifiers"]["clinvarAccession"] = accession
+        else:
+            submission["errors"] = [
+                {"output": {"errors": [{"userMessage": error}]}}
+            ]
+        return "processed", {
+            "totalSuccess": 1, "totalErrors": 0, "submissions": [submission]
+        }
+
+    @mock.patch("utils.clinvar.submission_status_check")
+    def test_results_collected_for_all_organisations(self, mock_check):
+        responses = {
+            "SUB1": self.processed("uid_1", accession="SCV1"),
+            "SUB2": self.processed("uid_2", error="Invalid"),
+            "SUB3": ("processing", {}),
+        }
+        mock_check.side_effect = lambda sub, header, url, client, cache, log: (
+            responses[sub]
+        )
+
+        accession_ids, errors, statuses = clinvar.poll_submission_statuses(
+            [("1234", "SUB1"), ("5678", "SUB2"), ("1234", "SUB3")],
+            self.headers, self.api_url, max_workers=3
+        )
+        with self.subTest("Each submission checked with its own key"):
+            assert sorted(
+                (x[0][0], x[0][1]["SP-API-KEY"])
+                for x in mock_check.call_args_list
+            ) == [("SUB1", "cuh"), ("SUB2", "nuh"), ("SUB3", "cuh")]
+        with self.subTest("Results combined"):
+            assert accession_ids == {"uid_1": "SCV1"}
+            assert errors == {"uid_2": "Invalid"}
+        with self.subTest("Status of each submission"):
+            assert statuses == {
+                "SUB1": "processed", "SUB2": "processed", "SUB3": "processing"
+            }
+
+    @mock.patch("utils.clinvar.submission_status_check")
+    def test_failed_check_left_for_next_run(self, mock_check):
+        def check(submission_id, header, url, client, cache, log):
+            if submission_id == "SUB1":
+                raise RuntimeError("Status check failed")
+            return self.processed("uid_2", accession="SCV2")
+        mock_check.side_effect = check
+
+        accession_ids, errors, statuses = clinvar.poll_submission_statuses(
+            [("1234", "SUB1"), ("5678", "SUB2")], self.headers, self.api_url
+        )
+        assert (accession_ids, errors, statuses) == (
+            {"uid_2": "SCV2"}, {}, {"SUB1": None, "SUB2": "processed"}
+        )
+
+    @mock.patch("utils.clinvar.submission_status_check")
+    def test_messages_printed_together_from_main_thread(self, mock_check):
+        def check(submission_id, header, url, client, cache, log):
+            log(f"Checking {submission_id}")
+            log(f"Checked {submission_id}")
+            return ("processing", {})
+        mock_check.side_effect = check
+        printed = []
+
+        def record_print(*args, **kwargs):
+            printed.append((threading.current_thread(), " ".join(args)))
+
+        with mock.patch("builtins.print", side_effect=record_print):
+            clinvar.poll_submission_statuses(
+                [("1234", "SUB1"), ("5678", "SUB2")], self.headers,
+                self.api_url, max_workers=2
+            )
+        with self.subTest("Printed from main thread"):
+            assert {thread for thread, _ in printed} == {
+                threading.main_thread()
+            }
+        with self.subTest("Messages of each submission together, in order"):
+            assert [
+                message for _, message in printed if "Check" in message
+            ] == ["Checking SUB1\nChecked SUB1", "Checking SUB2\nChecked SUB2"]
+
+    @mock.patch("utils.clinvar.submission_status_check")
+    def test_checks_left_for_next_run_when_circuit_open(self, mock_check):
+        mock_check.side_effect = clinvar.CircuitOpenError("Open")
+        accession_ids, errors, statuses = clinvar.poll_submission_statuses(
+            [("1234", "SUB1"), ("5678", "SUB2")], self.headers, self.api_url
+        )
+        assert (accession_ids, errors, statuses) == (
+            {}, {}, {"SUB1": None, "SUB2": None}
+        )
+
+
+class TestSubmissionBatching(unittest.TestCase):
+    variants = [{"localID": f"uid_{x}", "data": "x" * x} for x in range(5)]
+    local_ids = [f"uid_{x}" for x in range(5)]
+
+    def batch_ids(self, batches):
+        return [batch_ids for _, batch_ids in batches]
+
+    @staticmethod
+    def first_local_id(body):
+        return json.loads(body)["actions"][0]["data"]["content"][
+            "clinvarSubmission"
+        ][0]["localID"]
+
+    def test_split_by_record_count(self):
+        batches = list(clinvar.split_into_batches(
+            self.variants, self.local_ids, max_records=2
+        ))
+        with self.subTest("Batches bounded by record count"):
+            assert self.batch_ids(batches) == [
+                ["uid_0", "uid_1"], ["uid_2", "uid_3"], ["uid_4"]
+            ]
+        with self.subTest("Variants kept with their local IDs"):
+            for records, batch_ids in batches:
+                assert [json.loads(x)["localID"] for x in records] == (
+                    batch_ids
+                )
+
+    def test_serialized_records_not_encoded_again(self):
+        records = [clinvar.encode_payload(x) for x in self.variants]
+        with mock.patch("utils.clinvar.encode_payload") as mock_encode:
+            batches = list(clinvar.split_into_batches(
+                records, self.local_ids, max_records=2
+            ))
+        mock_encode.assert_not_called()
+        assert [x for batch, _ in batches for x in batch] == records
+
+    def test_split_by_serialized_size(self):
+        record_sizes = [
+            len(clinvar.encode_payload(x)) + 1 for x in self.variants
+        ]
+        batches = list(clinvar.split_into_batches(
+            self.variants, self.local_ids,
+            max_bytes=record_sizes[0] + record_sizes[1]
+        ))
+        assert self.batch_ids(batches) == [
+            ["uid_0", "uid_1"], ["uid_2"], ["uid_3"], ["uid_4"]
+        ]
+
+    def test_oversized_variant_submitted_alone(self):
+        batches = list(clinvar.split_into_batches(
+            self.variants, self.local_ids, max_bytes=1
+        ))
+        assert self.batch_ids(batches) == [[x] for x in self.local_ids]
+
+    def test_submit_batches_returns_response_for_each_batch(self):
+        def post(url, body, header):
+            if self.first_local_id(body) == "uid_2":
+                raise requests.exceptions.ConnectionError("Timed out")
+            return {"id": f"SUB_{self.first_local_id(body)}"}
+        client = mock.MagicMock()
+        client.post.side_effect = post
+        batches = list(clinvar.split_into_batches(
+            self.variants, self.local_ids, max_records=2
+        ))
+        results = clinvar.submit_batches(
+            "https://clinvar", {"SP-API-KEY": "cuh"}, batches,
+            "https://acgs", False, client, max_workers=3
+        )
+        assert results == [
+            (["uid_0", "uid_1"], {"id": "SUB_uid_0"}),
+            (["uid_4"], {"id": "SUB_uid_4"}),
+        ]
+
+    def test_submit_batches_reports_each_batch_as_it_completes(self):
+        second_done = threading.Event()
+
+        def post(url, body, header):
+            # the first batch finishes after the second has been reported
+            if self.first_local_id(body) == "uid_0":
+                second_done.wait(5)
+            return {"id": f"SUB_{self.first_local_id(body)}"}
+        client = mock.MagicMock()
+        client.post.side_effect = post
+        reported = []
+
+        def on_result(local_ids, response):
+            reported.append((threading.current_thread(), local_ids))
+            second_done.set()
+
+        batches = list(clinvar.split_into_batches(
+            self.variants[:4], self.local_ids[:4], max_records=2
+        ))
+        results = clinvar.submit_batches(
+            "https://clinvar", {"SP-API-KEY": "cuh"}, batches,
+            "https://acgs", False, client, max_workers=2,
+            on_result=on_result
+        )
+        with self.subTest("Reported as completed"):
+            assert [x[1] for x in reported] == [
+                ["uid_2", "uid_3"], ["uid_0", "uid_1"]
+            ]
+        with self.subTest("Reported from calling thread"):
+            assert {x[0] for x in reported} == {threading.current_thread()}
+        with self.subTest("Results in order of batches"):
+            assert [x[0] for x in results] == [
+                ["uid_0", "uid_1"], ["uid_2", "uid_3"]
+            ]
+
+    def test_submit_batches_stops_when_result_not_recorded(self):
+        client = mock.MagicMock()
+        client.post.side_effect = lambda url, body, header: {
+            "id": f"SUB_{self.first_local_id(body)}"
+        }
+        reported = []
+
+        def on_result(local_ids, response):
+            reported.append(local_ids)
+            raise clinvar.SubmissionRecordError("not recorded")
+
+        batches = list(clinvar.split_into_batches(
+            self.variants, self.local_ids, max_records=1
+        ))
+        with self.assertRaises(clinvar.SubmissionRecordError):
+            clinvar.submit_batches(
+                "https://clinvar", {"SP-API-KEY": "cuh"}, batches,
+                "https://acgs", False, client, max_workers=1,
+                on_result=on_result
+            )
+        with self.subTest("Batches not yet started cancelled"):
+            assert client.post.call_count < len(batches)
+        with self.subTest("Every submitted batch reported"):
+            assert len(reported) == client.post.call_count
+
+    @mock.patch("builtins.print")
+    def test_submit_batches_prints_bodies_from_calling_thread(
+        self, mock_print
+    ):
+        printed = []
+        mock_print.side_effect = lambda *args: printed.append(
+            (threading.current_thread(), *args)
+        )
+        client = mock.MagicMock()
+        batches = list(clinvar.split_into_batches(
+            self.variants, self.local_ids, max_records=2
+        ))
+        clinvar.submit_batches(
+            "https://clinvar", {"SP-API-KEY": "cuh"}, batches,
+            "https://acgs", True, client, max_workers=3
+        )
+        with self.subTest("Printed from calling thread"):
+            assert {x[0] for x in printed} == {threading.current_thread()}
+        with self.subTest("Printed JSON is each posted body"):
+            bodies = [x[0][1] for x in client.post.call_args_list]
+            assert sorted(x[1] for x in printed if x[1].startswith("{")) == (
+                sorted(x.decode() for x in bodies)
+            )
+
+    @mock.patch("utils.clinvar.time")
+    def test_rate_limiter_spaces_calls(self, mock_time):
+        mock_time.monotonic.return_value = 100.0
+        limiter = clinvar.RateLimiter(2)
+        for _ in range(3):
+            limiter.wait()
+        assert [x[0][0] for x in mock_time.sleep.call_args_list] == [
+            0.5, 1.0
+        ]
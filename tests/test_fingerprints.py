@@ -0,0 +1,100 @@
+import datetime
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from utils import fingerprints
+
+Record = namedtuple(
+    "Record", ["file_size", "file_mtime", "file_hash", "last_attempt"]
+)
+
+
+class TestFingerprints(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp_dir.name, "wb.xlsx")
+        with open(self.filename, "wb") as f:
+            f.write(b"workbook contents")
+        self.fingerprint = fingerprints.get_file_fingerprint(self.filename)
+        self.now = datetime.datetime(2024, 7, 10, 12, 0, 0)
+        self.record = Record(
+            *self.fingerprint, self.now - datetime.timedelta(days=1)
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_file_fingerprint(self):
+        with self.subTest("size"):
+            assert self.fingerprint.size == 17
+        with self.subTest("hash"):
+            assert self.fingerprint.file_hash == (
+                "55039d6ff65078005670f900008968981119b46fae87d6bd97e75bd56478e567"
+            )
+
+    def test_unchanged_workbook_not_retried_before_backoff(self):
+        assert not fingerprints.should_retry_failed_workbook(
+            self.filename, self.record, 7, self.now
+        )
+
+    def test_workbook_retried_after_backoff(self):
+        assert fingerprints.should_retry_failed_workbook(
+            self.filename, self.record, 0.5, self.now
+        )
+
+    def test_modified_workbook_retried(self):
+        with open(self.filename, "wb") as f:
+            f.write(b"edited workbook contents")
+        assert fingerprints.should_retry_failed_workbook(
+            self.filename, self.record, 7, self.now
+        )
+
+    def test_touched_but_identical_workbook_not_retried(self):
+        '''
+        A workbook whose mtime changed but whose contents are identical
+        should not be retried
+        '''
+        os.utime(self.filename, ns=(0, self.fingerprint.mtime_ns + 10 ** 9))
+        assert not fingerprints.should_retry_failed_workbook(
+            self.filename, self.record, 7, self.now
+        )
+
+    def test_workbook_without_stored_fingerprint_retried(self):
+        record = Record(np.nan, np.nan, None, None)
+        assert fingerprints.should_retry_failed_workbook(
+            self.filename, record, 7, self.now
+        )
+
+    def test_fingerprint_cache_reuses_hash_for_unchanged_file(self):
+        cache_path = os.path.join(self.tmp_dir.name, "cache", "hashes.json")
+        cache = fingerprints.FingerprintCache(cache_path)
+        with self.subTest("Fingerprint matches uncached fingerprint"):
+            assert cache.get(self.filename) == self.fingerprint
+        cache.save()
+
+        with mock.patch("utils.fingerprints.hash_file") as mock_hash:
+            reloaded = fingerprints.FingerprintCache(cache_path)
+            with self.subTest("Cached fingerprint loaded from disk"):
+                assert reloaded.get(self.filename) == self.fingerprint
+            with self.subTest("Unchanged file not hashed again"):
+                mock_hash.assert_not_called()
+
+    def test_fingerprint_cache_rehashes_changed_file(self):
+        cache = fingerprints.FingerprintCache()
+        cache.get(self.filename)
+        with open(self.filename, "wb") as f:
+            f.write(b"edited workbook contents")
+        assert cache.get(self.filename) == (
+            fingerprints.get_file_fingerprint(self.filename)
+        )
+
+    def test_build_hash_index(self):
+        df = pd.DataFrame({
+            "workbook_name": ["a.xlsx", "b.xlsx", "c.xlsx"],
+            "file_hash": ["abc", None, "abc"]
+        })
+        assert fingerprints.build_hash_index(df) == {"abc": "a.xlsx"}
@@ -0,0 +1,54 @@
+import os
+import re
+import tempfile
+import unittest
+import uuid
+from multiprocessing import Pool
+from utils import local_ids
+
+
+def _allocate_in_worker(args):
+    state_file, count = args
+    return local_ids.LocalIDAllocator(state_file).allocate(count)
+
+
+class TestLocalIDAllocator(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.tmp_dir.name, "local_id.state")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_ids_match_existing_uid_format(self):
+        '''
+        IDs should be uid_ followed by an integer of the same magnitude as
+        uuid1().time, so they sort after IDs already in the inca table
+        '''
+        before = uuid.uuid1().time
+        ids = local_ids.LocalIDAllocator(self.state_file).allocate(3)
+        with self.subTest("uid_<int> format"):
+            assert all(re.match(r"^uid_\d+$", x) for x in ids)
+        with self.subTest("IDs are later than an earlier uuid1 time"):
+            assert int(ids[0].split("_")[1]) > before
+
+    def test_ids_unique_and_increasing_across_allocators(self):
+        '''
+        Two allocators sharing a state file, as in separate pandora runs,
+        should never hand out the same ID
+        '''
+        first = local_ids.LocalIDAllocator(self.state_file).allocate(100)
+        second = local_ids.LocalIDAllocator(self.state_file).allocate(100)
+        values = [int(x.split("_")[1]) for x in first + second]
+        assert values == sorted(set(values))
+
+    def test_ids_unique_across_processes(self):
+        with Pool(4) as pool:
+            blocks = pool.map(
+                _allocate_in_worker, [(self.state_file, 50)] * 8
+            )
+        all_ids = [x for block in blocks for x in block]
+        assert len(all_ids) == len(set(all_ids)) == 400
+
+    def test_allocate_zero_returns_empty_list(self):
+        assert local_ids.LocalIDAllocator(self.state_file).allocate(0) == []
@@ -0,0 +1,265 @@
+import datetime
+import json
+import os
+import unittest
+import unittest.mock as mock
+from pathlib import Path
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.pool import StaticPool
+import utils.database_actions as db
+from utils import migrations
+from utils.fingerprints import FileFingerprint
+
+TEST_DATA_DIR = (
+    Path(__file__).parents[0]
+)
+
+with open(os.path.join(TEST_DATA_DIR, "test_data", "test_config.json")) as f:
+    config = json.load(f)
+
+# local PostgreSQL used to check query plans. Everything the tests create is
+# rolled back, and they are skipped if the database cannot be reached
+TEST_DB_URL = os.environ.get(
+    "PANDORA_TEST_DB_URL", "postgresql+psycopg2://postgres@localhost/postgres"
+)
+
+
+class TestApplyMigrations(unittest.TestCase):
+    '''
+    Test applying migrations to an in-memory SQLite database, with the
+    testdirectory schema attached
+    '''
+    test_migrations = (
+        (2, "Add row", ("INSERT INTO testdirectory.t VALUES (1)",)),
+        (1, "Create table", ("CREATE TABLE testdirectory.t (x integer)",)),
+    )
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://", poolclass=StaticPool)
+
+        @event.listens_for(self.engine, "connect")
+        def attach_schema(dbapi_connection, _):
+            dbapi_connection.execute(
+                "ATTACH DATABASE ':memory:' AS testdirectory"
+            )
+
+    def select(self, sql):
+        return [tuple(row) for row in self.engine.execute(sql)]
+
+    def test_migrations_applied_in_order_and_recorded(self):
+        applied = migrations.apply_migrations(
+            self.engine, self.test_migrations
+        )
+        with self.subTest("Applied in version order"):
+            assert applied == [1, 2]
+        with self.subTest("Changes made"):
+            assert self.select("SELECT x FROM testdirectory.t") == [(1,)]
+        with self.subTest("Versions recorded"):
+            assert migrations.get_applied_versions(self.engine) == {1, 2}
+
+    def test_applied_migrations_not_reapplied(self):
+        migrations.apply_migrations(self.engine, self.test_migrations)
+        applied = migrations.apply_migrations(
+            self.engine, self.test_migrations
+        )
+        with self.subTest("Nothing applied"):
+            assert applied == []
+        with self.subTest("Changes not repeated"):
+            assert self.select("SELECT x FROM testdirectory.t") == [(1,)]
+
+    def test_pending_versions(self):
+        with self.subTest("All pending before applying"):
+            assert migrations.get_pending_versions(
+                self.engine, self.test_migrations
+            ) == [1, 2]
+        migrations.apply_migrations(self.engine, self.test_migrations[1:])
+        with self.subTest("Applied version not pending"):
+            assert migrations.get_pending_versions(
+                self.engine, self.test_migrations
+            ) == [2]
+
+    def test_failed_migration_rolled_back(self):
+        migrations.apply_migrations(self.engine, self.test_migrations[1:])
+        failing = (
+            (2, "Add row then fail", (
+                "INSERT INTO testdirectory.t VALUES (1)",
+                "INSERT INTO testdirectory.missing VALUES (1)",
+            )),
+        )
+        with self.assertRaises(OperationalError):
+            migrations.apply_migrations(self.engine, failing)
+        with self.subTest("No partial changes"):
+            assert self.select("SELECT x FROM testdirectory.t") == []
+        with self.subTest("Not recorded as applied"):
+            assert migrations.get_applied_versions(self.engine) == {1}
+
+
+class PostgresTestCase(unittest.TestCase):
+    '''
+    Base for tests run against a local PostgreSQL with the testdirectory
+    tables created and migrations applied, in a transaction that is rolled
+    back. Skipped if the database cannot be reached
+    '''
+    @classmethod
+    def setUpClass(cls):
+        try:
+            cls.connection = create_engine(TEST_DB_URL).connect()
+        except OperationalError:
+            raise unittest.SkipTest("No local PostgreSQL available")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+
+    def setUp(self):
+        self.transaction = self.connection.begin()
+        try:
+            self.create_tables()
+        except ProgrammingError:
+            self.transaction.rollback()
+            self.skipTest("testdirectory tables already exist in database")
+        migrations.apply_migrations(self.connection)
+
+    def tearDown(self):
+        self.transaction.rollback()
+
+    def create_tables(self):
+        self.connection.exec_driver_sql(
+            "CREATE SCHEMA IF NOT EXISTS testdirectory"
+        )
+        self.connection.exec_driver_sql(
+            "CREATE TABLE testdirectory.inca (local_id text, interpreted "
+            "text, organisation_id text, submission_id text, accession_id "
+            "text, panel text, test_code text)"
+        )
+        self.connection.exec_driver_sql(
+            "CREATE TABLE testdirectory.inca_workbooks (workbook_name text "
+            "PRIMARY KEY, date timestamp, parse_status boolean, comment text)"
+        )
+
+
+class TestWorkbookFileDetails(PostgresTestCase):
+    '''
+    Test that the migrations create the inca_workbooks columns that the
+    file details of parsed and failed workbooks are written to
+    '''
+    fingerprint = FileFingerprint(1024, 1700000000000000000, "abc123")
+
+    def select_file_details(self, workbook):
+        return tuple(self.connection.exec_driver_sql(
+            "SELECT parse_status, file_size, file_mtime, file_hash, "
+            "last_attempt IS NOT NULL FROM testdirectory.inca_workbooks "
+            f"WHERE workbook_name = '{workbook}'"
+        ).fetchone())
+
+    def test_parsed_workbook_file_details_written(self):
+        db.add_wb_to_db("parsed.xlsx", "NULL", self.connection)
+        db.update_db_for_parsed_wb(
+            "parsed.xlsx", self.connection, self.fingerprint
+        )
+        assert self.select_file_details("parsed.xlsx") == (
+            True, 1024, 1700000000000000000, "abc123", False
+        )
+
+    def test_failed_workbook_file_details_written(self):
+        db.add_wb_to_db("failed.xlsx", "NULL", self.connection)
+        db.add_error_to_db(
+            self.connection, "failed.xlsx", "error", self.fingerprint
+        )
+        assert self.select_file_details("failed.xlsx") == (
+            False, 1024, 1700000000000000000, "abc123", True
+        )
+
+
+class TestIndexesUsed(PostgresTestCase):
+    '''
+    Check with EXPLAIN that pandora's queries on the inca and inca_workbooks
+    tables use the partial indexes created by the migrations. Run against a
+    local PostgreSQL, in a transaction that is rolled back
+    '''
+    def setUp(self):
+        super().setUp()
+        self.connection.exec_driver_sql("ANALYZE testdirectory.inca")
+        self.connection.exec_driver_sql("ANALYZE testdirectory.inca_workbooks")
+        # make plans independent of table size, so the check is whether an
+        # index can answer the query
+        self.connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+
+    def create_tables(self):
+        super().create_tables()
+        # 1% of variants awaiting each of submission and accession IDs
+        self.connection.exec_driver_sql(
+            "INSERT INTO testdirectory.inca SELECT 'uid_' || i, 'yes', "
+            "CASE WHEN i % 2 = 0 THEN '288359' ELSE '509428' END, "
+            "CASE WHEN i % 50 != 0 OR i % 100 = 0 THEN 'SUB' || i END, "
+            "CASE WHEN i % 50 != 0 THEN 'SCV' || i END, 'panel', 'R1' "
+            "FROM generate_series(1, 20000) AS i"
+        )
+        self.connection.exec_driver_sql(
+            "INSERT INTO testdirectory.inca_workbooks SELECT "
+            "'wb_' || i || '.xlsx', now(), i % 100 != 0, NULL "
+            "FROM generate_series(1, 5000) AS i"
+        )
+
+    def get_sql(self, func, *args, **kwargs):
+        with mock.patch("utils.database_actions.pd.read_sql") as read_sql:
+            func(*args, **kwargs)
+        return read_sql.call_args[0][0]
+
+    def explain(self, sql):
+        return "\n".join(
+            row[0] for row in self.connection.exec_driver_sql(f"EXPLAIN {sql}")
+        )
+
+    def test_variant_queries_use_indexes(self):
+        queries = {
+            "inca_awaiting_submission_idx": self.get_sql(
+                db.select_variants_by_organisation, [288359, 509428],
+                self.connection, "NULL", config["exclude"]
+            ),
+            "inca_awaiting_accession_idx": self.get_sql(
+                db.select_variants_by_organisation, [288359, 509428],
+                self.connection, "NOT NULL", columns=["submission_id"]
+            ),
+        }
+        for index, sql in queries.items():
+            with self.subTest(index):
+                assert index in self.explain(sql)
+
+    def test_due_submissions_query_uses_index(self):
+        with mock.patch("utils.database_actions.pd.read_sql") as read_sql:
+            db.select_due_submissions(
+                [288359, 509428], self.connection, datetime.datetime.now()
+            )
+        sql, _ = read_sql.call_args[0]
+        plan = self.connection.execute(
+            text(f"EXPLAIN {sql}"), read_sql.call_args[1]["params"]
+        )
+        assert "inca_awaiting_accession_idx" in "\n".join(
+            row[0] for row in plan
+        )
+
+    def test_array_lookups_use_indexes(self):
+        queries = {
+            "inca_workbooks_pkey": (
+                db.lookup_known_workbooks, ["wb_1.xlsx", "wb_2.xlsx"]
+            ),
+            "inca_workbooks_hash_idx": (
+                db.select_parsed_workbooks_by_hash, ["abc", "def"]
+            ),
+            "submission_polls_pkey": (
+                db.select_poll_schedule, ["SUB1", "SUB2"]
+            ),
+        }
+        for index, (func, values) in queries.items():
+            with self.subTest(index):
+                with mock.patch(
+                    "utils.database_actions.pd.read_sql"
+                ) as read_sql:
+                    func(values, self.connection)
+                sql, _ = read_sql.call_args[0]
+                plan = self.connection.execute(
+                    text(f"EXPLAIN {sql}"), read_sql.call_args[1]["params"]
+                )
+                assert index in "\n".join(row[0] for row in plan)
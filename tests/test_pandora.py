@@ -0,0 +1,364 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+from pathlib import Path
+import pandas as pd
+from sqlalchemy.exc import OperationalError
+import pandora
+from utils import utils
+from utils.workbook_scanner import WorkbookScanner
+from utils.fingerprints import FileFingerprint
+
+TEST_DATA_DIR = f"{Path(__file__).parent.resolve()}/test_data"
+
+with open(TEST_DATA_DIR + '/test_config.json') as f:
+    config = json.load(f)
+
+
+class TestParseWorkbooks(unittest.TestCase):
+    filenames = sorted(glob.glob(TEST_DATA_DIR + "/*/*.xlsx"))
+
+    def test_parallel_results_match_serial_order_and_errors(self):
+        '''
+        Parsing with a process pool should return one result per workbook in
+        the same order, with the same errors, as parsing serially. Workbooks
+        which raise while parsing should not stop the other workbooks
+        '''
+        serial = list(pandora.parse_workbooks(self.filenames, config, 1))
+        parallel = list(pandora.parse_workbooks(self.filenames, config, 3))
+
+        with self.subTest("Same workbooks in same order"):
+            assert [x[0] for x in parallel] == self.filenames
+            assert [x[0] for x in serial] == self.filenames
+
+        with self.subTest("Same errors"):
+            assert [x[2] for x in parallel] == [x[2] for x in serial]
+
+        with self.subTest("Same variants"):
+            for (_, df_serial, _), (_, df_parallel, _) in zip(
+                serial, parallel
+            ):
+                if df_serial is None:
+                    assert df_parallel is None
+                else:
+                    pd.testing.assert_frame_equal(
+                        df_serial.drop(columns=["local_id", "linking_id"]),
+                        df_parallel.drop(columns=["local_id", "linking_id"])
+                    )
+
+
+class TestParseNestedWorkbooks(unittest.TestCase):
+    def test_workbook_in_subfolder_parsed_for_organisation(self):
+        '''
+        A workbook found by a recursive scan in a subfolder of an
+        organisation's folder should be parsed for that organisation
+        '''
+        workbook = sorted(glob.glob(TEST_DATA_DIR + "/CUH/*.xlsx"))[0]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = os.path.join(tmp_dir, "CUH", "archive")
+            os.makedirs(archive)
+            shutil.copy(workbook, archive)
+            scanner = WorkbookScanner(recursive=True)
+            changed, _ = scanner.scan([os.path.join(tmp_dir, "CUH")])
+            _, expected, _ = utils.parse_workbook_file(workbook, config)
+            [(filename, df, error)] = pandora.parse_workbooks(
+                changed, config, 1
+            )
+        with self.subTest("Nested workbook found"):
+            assert filename == os.path.join(
+                archive, os.path.basename(workbook)
+            )
+        with self.subTest("Parsed without error"):
+            assert error is None
+        with self.subTest("Variants belong to organisation of folder"):
+            assert set(df["organisation_id"]) == {config["CUH org ID"]}
+            assert df.shape[0] == expected.shape[0]
+
+
+class TestWriteWorkbookResults(unittest.TestCase):
+    df = pd.DataFrame([{"local_id": "uid_1"}])
+
+    @staticmethod
+    def get_connection(mock_db):
+        return mock_db.workbook_transaction.return_value.__enter__.return_value
+
+    @mock.patch("pandora.db")
+    def test_successful_workbook_added_and_marked_parsed(self, mock_db):
+        engine = mock.MagicMock()
+        connection = self.get_connection(mock_db)
+        fingerprint = FileFingerprint(10, 20, "abc")
+        written = pandora.write_workbook_results(
+            [("/path/to/wb.xlsx", self.df, None, False, fingerprint)], engine
+        )
+        with self.subTest("Result written"):
+            assert written == 1
+        with self.subTest("One transaction for workbook"):
+            mock_db.workbook_transaction.assert_called_once_with(engine)
+        with self.subTest("Workbook added, then variants, then marked"):
+            assert [
+                x[0] for x in mock_db.method_calls
+                if not x[0].startswith("workbook_transaction")
+            ] == [
+                "add_wb_to_db", "add_variants_to_db",
+                "update_db_for_parsed_wb"
+            ]
+        with self.subTest("All writes use the transaction's connection"):
+            mock_db.add_wb_to_db.assert_called_once_with(
+                "wb.xlsx", "NULL", connection
+            )
+            mock_db.add_variants_to_db.assert_called_once_with(
+                self.df, connection
+            )
+        with self.subTest("Fingerprint stored with parsed workbook"):
+            mock_db.update_db_for_parsed_wb.assert_called_once_with(
+                "wb.xlsx", connection, fingerprint
+            )
+
+    @mock.patch("pandora.db")
+    def test_failed_workbook_records_error(self, mock_db):
+        engine = mock.MagicMock()
+        fingerprint = FileFingerprint(10, 20, "abc")
+        pandora.write_workbook_results(
+            [("/path/to/wb.xlsx", None, "bad", True, fingerprint)], engine
+        )
+        connection = self.get_connection(mock_db)
+        with self.subTest("Previously failed workbook not re-added"):
+            mock_db.add_wb_to_db.assert_not_called()
+        with self.subTest("Error added to db with fingerprint"):
+            mock_db.add_error_to_db.assert_called_once_with(
+                connection, "wb.xlsx", "bad", fingerprint
+            )
+        with self.subTest("Workbook not marked as parsed"):
+            mock_db.update_db_for_parsed_wb.assert_not_called()
+
+    @mock.patch("pandora.db")
+    def test_database_error_is_not_raised(self, mock_db):
+        mock_db.add_variants_to_db.side_effect = OperationalError(
+            "INSERT", {}, Exception("connection lost")
+        )
+        written = pandora.write_workbook_results(
+            [(
+                "/path/to/wb.xlsx", self.df, None, False,
+                FileFingerprint(10, 20, "abc")
+            )], mock.MagicMock()
+        )
+        with self.subTest("Result not written"):
+            assert written == 0
+        with self.subTest("Workbook not marked as parsed"):
+            mock_db.update_db_for_parsed_wb.assert_not_called()
+
+    @mock.patch("pandora.db")
+    def test_batch_variants_added_together(self, mock_db):
+        fingerprint = FileFingerprint(10, 20, "abc")
+        results = [
+            (f"/path/to/wb_{i}.xlsx", self.df, None, False, fingerprint)
+            for i in range(3)
+        ] + [("/path/to/bad.xlsx", None, "bad", False, fingerprint)]
+        written = pandora.write_workbook_results(results, mock.MagicMock())
+        with self.subTest("All workbooks written"):
+            assert written == 4
+        with self.subTest("One transaction for batch"):
+            mock_db.workbook_transaction.assert_called_once()
+        with self.subTest("Variants of all workbooks added at once"):
+            mock_db.add_variants_to_db.assert_called_once()
+            assert mock_db.add_variants_to_db.call_args[0][0].shape[0] == 3
+        with self.subTest("Parsed workbooks marked as parsed"):
+            assert mock_db.update_db_for_parsed_wb.call_count == 3
+        with self.subTest("Failed workbook has error added"):
+            mock_db.add_error_to_db.assert_called_once()
+
+    @mock.patch("pandora.db")
+    def test_failed_batch_written_separately(self, mock_db):
+        # the combined insert fails, the inserts of single workbooks do not
+        mock_db.add_variants_to_db.side_effect = lambda df, _: (
+            self.raise_error() if df.shape[0] > 1 else None
+        )
+        results = [
+            (
+                f"/path/to/wb_{i}.xlsx", self.df, None, False,
+                FileFingerprint(10, 20, "abc")
+            )
+            for i in range(2)
+        ]
+        written = pandora.write_workbook_results(results, mock.MagicMock())
+        with self.subTest("Each workbook retried in its own transaction"):
+            assert mock_db.workbook_transaction.call_count == 3
+        with self.subTest("Both workbooks written"):
+            assert written == 2
+
+    @staticmethod
+    def raise_error():
+        raise OperationalError("COPY", {}, Exception("bad row"))
+
+
+class TestGetFingerprints(unittest.TestCase):
+    def test_unreadable_workbooks_skipped(self):
+        hash_cache = mock.MagicMock()
+        hash_cache.get.side_effect = lambda filename: (
+            self.raise_missing(filename) if "moved" in filename
+            else FileFingerprint(10, 20, filename)
+        )
+        assert pandora.get_fingerprints(
+            ["/path/to/moved.xlsx", "/path/to/wb.xlsx"], hash_cache
+        ) == {"/path/to/wb.xlsx": FileFingerprint(10, 20, "/path/to/wb.xlsx")}
+
+    @staticmethod
+    def raise_missing(filename):
+        raise FileNotFoundError(2, "No such file or directory", filename)
+
+
+class TestPrepareSchema(unittest.TestCase):
+    @mock.patch("pandora.migrations")
+    def test_pending_migrations_applied_when_requested(self, mock_migrations):
+        engine = mock.MagicMock()
+        pandora.prepare_schema(engine, True)
+        mock_migrations.apply_migrations.assert_called_once_with(engine)
+
+    @mock.patch("pandora.migrations")
+    def test_run_stops_with_pending_migrations(self, mock_migrations):
+        mock_migrations.get_pending_versions.return_value = [3, 4]
+        with self.assertRaises(SystemExit) as context:
+            pandora.prepare_schema(mock.MagicMock(), False)
+        with self.subTest("Message names migrations and flag"):
+            assert "migrations 3, 4 have not been applied" in str(
+                context.exception
+            )
+            assert "--apply_migrations" in str(context.exception)
+        with self.subTest("Migrations not applied"):
+            mock_migrations.apply_migrations.assert_not_called()
+
+    @mock.patch("pandora.migrations")
+    def test_run_continues_with_schema_up_to_date(self, mock_migrations):
+        mock_migrations.get_pending_versions.return_value = []
+        pandora.prepare_schema(mock.MagicMock(), False)
+        mock_migrations.apply_migrations.assert_not_called()
+
+
+class TestRecordBatchSubmission(unittest.TestCase):
+    local_ids = ["uid_1", "uid_2"]
+
+    @staticmethod
+    def response(status_code, content):
+        response = mock.MagicMock(status_code=status_code)
+        if isinstance(content, dict):
+            response.json.return_value = content
+        else:
+            response.json.side_effect = ValueError("No JSON")
+        return response
+
+    def record(self, response, engine="engine"):
+        pandora.record_batch_submission(
+            self.local_ids, response, engine, 1, 168
+        )
+
+    @mock.patch("pandora.db")
+    def test_submission_id_recorded_and_first_poll_scheduled(self, mock_db):
+        self.record(self.response(201, {"id": "SUB1"}))
+        with self.subTest("Submission ID recorded"):
+            mock_db.add_submission_id_to_db.assert_called_once_with(
+                {"id": "SUB1"}, "engine", self.local_ids
+            )
+        with self.subTest("First poll scheduled"):
+            polls = mock_db.record_submission_polls.call_args[0][0]
+            assert list(polls) == ["SUB1"]
+            assert polls["SUB1"][:2] == (None, 0)
+
+    @mock.patch("pandora.db")
+    def test_rejected_batch_records_error(self, mock_db):
+        self.record(self.response(400, {"message": "Invalid payload"}))
+        mock_db.add_submission_id_to_db.assert_called_once_with(
+            {"message": "Invalid payload"}, "engine", self.local_ids
+        )
+        mock_db.record_submission_polls.assert_not_called()
+
+    @mock.patch("pandora.db")
+    def test_non_json_response_records_error(self, mock_db):
+        self.record(self.response(502, "<html>Bad gateway</html>"))
+        mock_db.add_submission_id_to_db.assert_called_once_with(
+            {"message": "HTTP 502 response to submission"}, "engine",
+            self.local_ids
+        )
+
+    @mock.patch("pandora.db")
+    def test_unrecorded_submission_id_raised(self, mock_db):
+        mock_db.add_submission_id_to_db.side_effect = OperationalError(
+            "UPDATE", {}, Exception("connection lost")
+        )
+        with mock.patch("builtins.print") as mock_print:
+            with self.assertRaises(pandora.clinvar.SubmissionRecordError):
+                self.record(self.response(201, {"id": "SUB1"}))
+        with self.subTest("Submission ID printed to record by hand"):
+            printed = mock_print.call_args[0][0]
+            assert "SUB1" in printed and "uid_1, uid_2" in printed
+        with self.subTest("No poll scheduled"):
+            mock_db.record_submission_polls.assert_not_called()
+
+    @mock.patch("pandora.db")
+    def test_unrecorded_error_not_raised(self, mock_db):
+        mock_db.add_submission_id_to_db.side_effect = OperationalError(
+            "UPDATE", {}, Exception("connection lost")
+        )
+        self.record(self.response(400, {"message": "Invalid payload"}))
+
+    @mock.patch("pandora.db")
+    def test_unscheduled_poll_not_raised(self, mock_db):
+        mock_db.record_submission_polls.side_effect = OperationalError(
+            "INSERT", {}, Exception("connection lost")
+        )
+        self.record(self.response(201, {"id": "SUB1"}))
+        mock_db.add_submission_id_to_db.assert_called_once()
+
+
+class TestCollectBatchesToSubmit(unittest.TestCase):
+    @mock.patch("pandora.clinvar.collect_clinvar_data_to_submit")
+    @mock.patch("pandora.db.select_variants_by_organisation")
+    def test_batches_split_as_chunks_arrive(self, mock_select, mock_collect):
+        chunks_read = []
+
+        def select(*args, **kwargs):
+            for i, dfs in enumerate([
+                {
+                    1: pd.DataFrame({"local_id": ["uid_1", "uid_2", "uid_3"]}),
+                    2: pd.DataFrame({"local_id": ["uid_4"]}),
+                },
+                {
+                    1: pd.DataFrame({"local_id": ["uid_5"]}),
+                    2: pd.DataFrame({"local_id": []}),
+                },
+            ]):
+                chunks_read.append(i)
+                yield dfs
+        mock_select.side_effect = select
+        mock_collect.side_effect = lambda df, _: [
+            {"localID": x} for x in df["local_id"]
+        ]
+        engine = mock.MagicMock()
+        batches = pandora.collect_batches_to_submit(
+            [1, 2], engine, config, 2, max_records=2
+        )
+        with self.subTest("Full batch yielded after first chunk"):
+            assert next(batches) == (
+                1, [([b'{"localID":"uid_1"}', b'{"localID":"uid_2"}'],
+                     ["uid_1", "uid_2"])]
+            )
+            assert chunks_read == [0]
+        with self.subTest("One query for all organisations, in chunks"):
+            mock_select.assert_called_once_with(
+                [1, 2], engine, "NULL", config["exclude"],
+                columns=pandora.clinvar.SUBMISSION_COLUMNS, chunksize=2
+            )
+        with self.subTest("Partly filled batches carried over chunks"):
+            assert list(batches) == [
+                (1, [([b'{"localID":"uid_3"}', b'{"localID":"uid_5"}'],
+                      ["uid_3", "uid_5"])]),
+                (2, [([b'{"localID":"uid_4"}'], ["uid_4"])]),
+            ]
+
+    def test_get_organisations(self):
+        assert pandora.get_organisations(config) == {
+            288359: "CUH", 509428: "NUH"
+        }
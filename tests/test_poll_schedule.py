@@ -0,0 +1,34 @@
+import datetime
+import unittest
+from utils import poll_schedule
+
+
+class TestPollSchedule(unittest.TestCase):
+    now = datetime.datetime(2024, 7, 10, 12, 0)
+
+    def test_interval_doubles_up_to_maximum(self):
+        intervals = [
+            poll_schedule.next_poll_at(poll_count, self.now, 1, 24) - self.now
+            for poll_count in range(7)
+        ]
+        assert [x / datetime.timedelta(hours=1) for x in intervals] == [
+            1, 2, 4, 8, 16, 24, 24
+        ]
+
+    def test_update_schedule(self):
+        schedule = {
+            "SUB1": (2, self.now, False), "SUB2": (5, self.now, False)
+        }
+        polls = poll_schedule.update_schedule(
+            {
+                "SUB1": "processing", "SUB2": "processed", "SUB3": "submitted",
+                "SUB4": None,
+            },
+            schedule, self.now, 1, 168
+        )
+        hours = datetime.timedelta(hours=1)
+        assert polls == {
+            "SUB1": (self.now, 3, self.now + 8 * hours, False),
+            "SUB2": (self.now, 6, None, True),
+            "SUB3": (self.now, 1, self.now + 2 * hours, False),
+        }
@@ -0,0 +1,168 @@
+import glob
+import json
+import os
+import pstats
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+from pathlib import Path
+import pandora
+from utils import profiling
+
+TEST_DATA_DIR = (
+    Path(__file__).parents[0]
+)
+
+with open(os.path.join(TEST_DATA_DIR, "test_data", "test_config.json")) as f:
+    config = json.load(f)
+
+
+@profiling.timed
+def add_one(x):
+    return x + 1
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling._profiler = None
+
+    def test_timed_function_not_recorded_when_disabled(self):
+        with mock.patch("utils.profiling.Profiler.record") as mock_record:
+            assert add_one(1) == 2
+        mock_record.assert_not_called()
+
+    def test_stages_recorded_in_total_and_for_workbook(self):
+        profiler = profiling.enable_profiling()
+        with profiling.stage("run"):
+            add_one(1)
+            with profiling.workbook("wb.xlsx"):
+                add_one(2)
+        name = f"{__name__}.add_one"
+        with self.subTest("Totals"):
+            assert profiler.stages[name]["calls"] == 2
+            assert profiler.stages["run"]["calls"] == 1
+        with self.subTest("Workbook"):
+            assert list(profiler.workbooks) == ["wb.xlsx"]
+            assert profiler.workbooks["wb.xlsx"][name]["calls"] == 1
+
+    def test_workbook_attributed_per_thread(self):
+        profiler = profiling.enable_profiling()
+        in_workbook = threading.Event()
+        recorded = threading.Event()
+
+        def record_in_other_thread():
+            in_workbook.wait()
+            add_one(1)
+            recorded.set()
+
+        thread = threading.Thread(target=record_in_other_thread)
+        thread.start()
+        with profiling.workbook("wb.xlsx"):
+            in_workbook.set()
+            recorded.wait()
+            add_one(2)
+        thread.join()
+        name = f"{__name__}.add_one"
+        with self.subTest("Both calls in totals"):
+            assert profiler.stages[name]["calls"] == 2
+        with self.subTest("Other thread's call not attributed to workbook"):
+            assert profiler.workbooks["wb.xlsx"][name]["calls"] == 1
+
+    def test_run_profiled_returns_timings_and_restores_profiler(self):
+        profiler = profiling.enable_profiling()
+        result, stages, stats = profiling.run_profiled(True, add_one, 1)
+        with self.subTest("Result"):
+            assert result == 2
+        with self.subTest("Timings of call only"):
+            assert stages[f"{__name__}.add_one"]["calls"] == 1
+            assert profiler.stages == {}
+        with self.subTest("Main profiler restored"):
+            assert profiling.get_profiler() is profiler
+        with self.subTest("cProfile stats collected"):
+            assert any(func[2] == "add_one" for func in stats)
+
+    def test_report_orders_stages_by_time(self):
+        profiler = profiling.Profiler()
+        profiler.record("fast", 0.1)
+        profiler.record("slow", 1.0)
+        profiler.merge({"slow": {"calls": 2, "seconds": 2.0}}, "wb.xlsx")
+        assert profiler.report() == {
+            "stages": {
+                "slow": {"calls": 3, "seconds": 3.0},
+                "fast": {"calls": 1, "seconds": 0.1},
+            },
+            "workbooks": {
+                "wb.xlsx": {"slow": {"calls": 2, "seconds": 2.0}},
+            },
+        }
+
+    def test_write_report_with_cprofile_stats(self):
+        profiler = profiling.enable_profiling()
+        for x in range(2):
+            _, stages, stats = profiling.run_profiled(True, add_one, x)
+            profiler.merge(stages, f"wb_{x}.xlsx")
+            profiler.add_cprofile_stats(stats)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_path = os.path.join(tmp_dir, "report.json")
+            stats_path = os.path.join(tmp_dir, "parse.prof")
+            profiler.write_report(report_path, stats_path)
+            with open(report_path) as f:
+                report = json.load(f)
+            stats = pstats.Stats(stats_path)
+
+        with self.subTest("Report has each workbook"):
+            assert list(report["workbooks"]) == ["wb_0.xlsx", "wb_1.xlsx"]
+        with self.subTest("cProfile stats combined"):
+            assert [
+                stat[1] for func, stat in stats.stats.items()
+                if func[2] == "add_one"
+            ] == [2]
+
+
+class TestProfiledParsing(unittest.TestCase):
+    filenames = sorted(glob.glob(f"{TEST_DATA_DIR}/test_data/*/*.xlsx"))[:3]
+
+    def tearDown(self):
+        profiling._profiler = None
+
+    def test_workbook_timings_collected_from_workers(self):
+        for workers in [1, 2]:
+            profiler = profiling.enable_profiling()
+            results = list(pandora.parse_workbooks(
+                self.filenames, config, workers, cprofile=True
+            ))
+            with self.subTest("Results unchanged", workers=workers):
+                assert [x[0] for x in results] == self.filenames
+            with self.subTest("Timings for each workbook", workers=workers):
+                assert sorted(profiler.workbooks) == sorted(
+                    os.path.basename(x) for x in self.filenames
+                )
+                assert profiler.stages[
+                    "utils.workbook_loader.load_workbook_values"
+                ]["calls"] == len(self.filenames)
+            with self.subTest("cProfile stats collected", workers=workers):
+                assert profiler._cprofile_stats is not None
+
+
+class TestMainProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling._profiler = None
+
+    def test_report_written_when_run_fails(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_path = os.path.join(tmp_dir, "report.json")
+            args = mock.Mock(profile=report_path, cprofile=None)
+
+            def failing_run(args):
+                with profiling.stage("accession_polling"):
+                    raise RuntimeError("database unavailable")
+
+            with mock.patch("pandora.parse_args", return_value=args), \
+                    mock.patch("pandora.run", side_effect=failing_run):
+                with self.assertRaises(RuntimeError):
+                    pandora.main()
+            with open(report_path) as f:
+                report = json.load(f)
+        assert list(report["stages"]) == ["accession_polling"]
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+from utils import summary_cache
+from utils import utils
+
+
+class TestSummaryFileCache(unittest.TestCase):
+    url = "https://clinvar/files/SUB1/summary.json"
+    summary = {"submissions": [], "totalSuccess": 0, "totalErrors": 0}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, "summary_files")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def content(self, n=0):
+        return json.dumps(dict(self.summary, totalSuccess=n)).encode()
+
+    def objects(self):
+        return os.listdir(os.path.join(self.directory, "objects"))
+
+    def test_cached_summary_read_from_disk(self):
+        cache = summary_cache.SummaryFileCache(self.directory)
+        cache.put("SUB1", self.url, "processed", self.content())
+        reloaded = summary_cache.SummaryFileCache(self.directory)
+        with self.subTest("Persisted"):
+            assert "SUB1" in reloaded
+            assert reloaded.get("SUB1") == ("processed", self.summary)
+        with self.subTest("Must match URL if given"):
+            assert reloaded.get("SUB1", self.url) is not None
+            assert reloaded.get("SUB1", "https://other") is None
+
+    def test_only_terminal_statuses_cached(self):
+        cache = summary_cache.SummaryFileCache(self.directory)
+        cache.put("SUB1", self.url, "processing", self.content())
+        assert "SUB1" not in cache
+
+    def test_identical_files_stored_once(self):
+        cache = summary_cache.SummaryFileCache(self.directory)
+        cache.put("SUB1", self.url, "processed", self.content())
+        cache.put("SUB2", self.url, "processed", self.content())
+        assert len(self.objects()) == 1
+
+    @mock.patch("utils.summary_cache.time")
+    def test_least_recently_used_evicted(self, mock_time):
+        size = len(self.content())
+        cache = summary_cache.SummaryFileCache(self.directory, 2 * size)
+        for n, submission_id in enumerate(["SUB1", "SUB2"]):
+            mock_time.time.return_value = n
+            cache.put(submission_id, self.url, "processed", self.content(n))
+        mock_time.time.return_value = 2
+        cache.get("SUB1")
+        mock_time.time.return_value = 3
+        cache.put("SUB3", self.url, "error", self.content(3))
+
+        with self.subTest("Oldest entry removed"):
+            assert ["SUB1" in cache, "SUB2" in cache, "SUB3" in cache] == [
+                True, False, True
+            ]
+        with self.subTest("File removed"):
+            assert len(self.objects()) == 2
+
+
+class TestStatusCheckWithCache(unittest.TestCase):
+    api_url = "https://clinvar/api"
+    file_url = "https://clinvar/files/SUB1/summary.json"
+    summary = {"submissions": [], "totalSuccess": 0, "totalErrors": 0}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = summary_cache.SummaryFileCache(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    @staticmethod
+    def response(content):
+        return mock.MagicMock(
+            status_code=200, content=json.dumps(content).encode(), headers={}
+        )
+
+    def test_summary_cached_then_served_without_api(self):
+        client = mock.MagicMock()
+        client.get.side_effect = [
+            self.response({"actions": [{
+                "status": "processed",
+                "responses": [{"files": [{"url": self.file_url}]}],
+            }]}),
+            self.response(self.summary),
+        ]
+        first = utils.submission_status_check(
+            "SUB1", {}, self.api_url, client, self.cache
+        )
+        second = utils.submission_status_check(
+            "SUB1", {}, self.api_url, client, self.cache
+        )
+        with self.subTest("Same result"):
+            assert first == second == ("processed", self.summary)
+        with self.subTest("API only called on first check"):
+            assert client.get.call_count == 2
@@ -0,0 +1,173 @@
+import glob
+import json
+import unittest
+from pathlib import Path
+import pandas as pd
+from openpyxl import load_workbook
+from tests import legacy_implementations as legacy
+from utils import utils
+from utils import workbook_loader
+
+TEST_DATA_DIR = f"{Path(__file__).parent.resolve()}/test_data"
+
+workbooks = sorted(glob.glob(TEST_DATA_DIR + "/*/*.xlsx"))
+
+with open(TEST_DATA_DIR + '/test_config.json') as f:
+    config = json.load(f)
+
+INCLUDED_COLUMNS = [
+    "CHROM", "POS", "REF", "ALT", "SYMBOL", "HGVSc", "Consequence",
+    "Interpreted", "Comment",
+]
+
+
+def run_or_error(func, *args, **kwargs):
+    '''
+    Run a parsing function, returning the exception type instead of raising
+    so that malformed workbooks can be compared between loaders
+    '''
+    try:
+        return func(*args, **kwargs)
+    except Exception as error:
+        return type(error)
+
+
+class TestWorkbookLoader(unittest.TestCase):
+    cuh = TEST_DATA_DIR + "/CUH/cuh.xlsx"
+    workbook = workbook_loader.load_workbook_values(cuh)
+
+    def test_only_required_sheets_loaded(self):
+        assert self.workbook.sheetnames == [
+            "summary", "interpret_1", "interpret_2", "interpret_3",
+            "included"
+        ]
+
+    def test_cell_and_column_lookup(self):
+        with self.subTest("single cell lookup"):
+            assert self.workbook["summary"]["G21"].value == "Date"
+        with self.subTest("missing cell is None"):
+            assert self.workbook["summary"]["ZZ9999"].value is None
+        with self.subTest("column lookup gives cells with row numbers"):
+            column = self.workbook["summary"]["A"]
+            assert [cell.row for cell in column[:3]] == [1, 2, 3]
+
+    def test_included_sheet_matches_read_excel(self):
+        '''
+        The included sheet dataframe built from the loaded values should be
+        identical to reading the sheet again with pd.read_excel
+        '''
+        for wb in workbooks:
+            with self.subTest(wb):
+                values = workbook_loader.load_workbook_values(wb)
+                num_variants = values["summary"]["C38"].value
+                expected = run_or_error(
+                    pd.read_excel, wb, sheet_name="included",
+                    usecols=INCLUDED_COLUMNS, nrows=num_variants
+                )
+                df = run_or_error(
+                    workbook_loader.sheet_to_dataframe, values["included"],
+                    usecols=INCLUDED_COLUMNS, nrows=num_variants
+                )
+                if isinstance(expected, pd.DataFrame):
+                    pd.testing.assert_frame_equal(df, expected)
+                else:
+                    assert df == expected
+
+    def test_parsing_matches_openpyxl_workbook(self):
+        '''
+        Summary, interpret and sheet checks should give the same results from
+        the loaded values as from a full openpyxl workbook
+        '''
+        for wb in workbooks:
+            values = workbook_loader.load_workbook_values(wb)
+            full = load_workbook(wb)
+            with self.subTest(f"{wb} summary"):
+                result = run_or_error(
+                    utils.get_summary_fields, values, config, wb
+                )
+                expected = run_or_error(
+                    utils.get_summary_fields, full, config, wb
+                )
+                if isinstance(expected, tuple):
+                    assert result[1] == expected[1]
+                    if expected[0] is not None:
+                        pd.testing.assert_frame_equal(result[0], expected[0])
+                else:
+                    assert result == expected
+
+            with self.subTest(f"{wb} interpret"):
+                df_included = run_or_error(
+                    utils.get_included_fields, values, wb
+                )
+                if isinstance(df_included, pd.DataFrame):
+                    df, msg = utils.get_report_fields(
+                        values, config, df_included
+                    )
+                    expected_df, expected_msg = utils.get_report_fields(
+                        full, config, df_included
+                    )
+                    assert msg == expected_msg
+                    pd.testing.assert_frame_equal(df, expected_df)
+
+            with self.subTest(f"{wb} checking sheets"):
+                assert utils.checking_sheets(values) == (
+                    utils.checking_sheets(full)
+                )
+
+
+class TestCellExtractionPlan(unittest.TestCase):
+    field_cells = config["field_cells"]
+
+    def test_plan_reads_interpret_cells_in_one_block(self):
+        plan = workbook_loader.get_extraction_plan(self.field_cells)
+        with self.subTest("One block for interpret sheet cells"):
+            assert [bounds for bounds, _ in plan.blocks] == [(3, 26, 3, 11)]
+        with self.subTest("Fields in config order"):
+            assert plan.fields == [field for field, _ in self.field_cells]
+
+    def test_plan_splits_distant_rows(self):
+        plan = workbook_loader.CellExtractionPlan(
+            [["a", "A1"], ["b", "C2"], ["c", "B40"]]
+        )
+        assert [bounds for bounds, _ in plan.blocks] == [
+            (1, 2, 1, 3), (40, 40, 2, 2)
+        ]
+
+    def test_report_extraction_matches_cell_by_cell(self):
+        '''
+        The report dataframe built from extraction plan records should match
+        the one built cell by cell, including skipping empty interpret sheets
+        '''
+        for wb in workbooks:
+            workbook = load_workbook(wb)
+            workbook.create_sheet("interpret_empty")
+            with self.subTest(wb):
+                expected = legacy.legacy_extract_report_fields(
+                    workbook, self.field_cells
+                )
+                plan = workbook_loader.get_extraction_plan(self.field_cells)
+                records = [
+                    plan.extract(workbook[sheet])
+                    for sheet in workbook.sheetnames
+                    if sheet.startswith("interpret")
+                ]
+                df = pd.DataFrame(
+                    [record for record in records if record],
+                    columns=plan.fields, dtype=object
+                )
+                pd.testing.assert_frame_equal(df, expected)
+
+    def test_sheet_values_iter_rows_matches_openpyxl(self):
+        '''
+        Row slices of in-memory sheet values should match openpyxl, padded
+        with None beyond the sheet's dimensions
+        '''
+        full = load_workbook(workbooks[0])["interpret_1"]
+        values = workbook_loader.load_workbook_values(workbooks[0])[
+            "interpret_1"
+        ]
+        bounds = dict(min_row=3, max_row=values.max_row + 2, min_col=2,
+                      max_col=values.max_column + 3)
+        assert list(values.iter_rows(values_only=True, **bounds)) == list(
+            full.iter_rows(values_only=True, **bounds)
+        )
@@ -5,9 +5,11 @@ from utils import utils
 import pandas as pd
 from pathlib import Path
 import unittest
+import unittest.mock as mock
 from openpyxl import load_workbook
 from freezegun import freeze_time
 import numpy as np
+from tests import legacy_implementations as legacy
 
 TEST_DATA_DIR = f"{Path(__file__).parent.resolve()}/test_data"
 
@@ -42,6 +44,19 @@ class TestParsing(unittest.TestCase):
             NUH_folder = utils.get_folder_of_input_file(cuh)
             assert NUH_folder == "CUH"
 
+    def test_get_organisation_folder(self):
+        folders = ["CUH", "NUH"]
+        with self.subTest("Workbook in organisation folder"):
+            assert utils.get_organisation_folder(cuh, folders) == "CUH"
+        with self.subTest("Workbook in subfolder of organisation folder"):
+            assert utils.get_organisation_folder(
+                "/data/NUH/archive/2024/wb.xlsx", folders
+            ) == "NUH"
+        with self.subTest("Workbook not in organisation folder"):
+            assert utils.get_organisation_folder(
+                "/data/other/wb.xlsx", folders
+            ) is None
+
     def test_get_included_fields(self):
         """
         Test "get_included_fields" generates df with expected shape
@@ -447,3 +462,181 @@ class TestParsing(unittest.TestCase):
         assert error_msg == (
             "Values in interpreted column are not all either 'yes' or 'no'"
         )
+
+    def test_parse_workbook_returns_df_and_no_error(self):
+        df, msg = utils.parse_workbook(self.cuh_workbook, config, cuh)
+        with self.subTest("No error for valid workbook"):
+            assert msg is None
+        with self.subTest("One row per included variant"):
+            assert df.shape[0] == 2
+
+    def test_parse_workbook_file_isolates_failures(self):
+        '''
+        Test that an exception while parsing a workbook is returned as that
+        workbook's error instead of being raised, so one bad workbook does
+        not stop a parallel parse
+        '''
+        filename, df, msg = utils.parse_workbook_file(nuh_wrong_summary, config)
+        with self.subTest("Filename returned"):
+            assert filename == nuh_wrong_summary
+        with self.subTest("No dataframe returned"):
+            assert df is None
+        with self.subTest("Error message returned"):
+            assert msg.startswith("Workbook could not be parsed: ")
+
+
+    def test_parse_workbook_file_missing_file_returned_as_error(self):
+        filename, df, msg = utils.parse_workbook_file(
+            os.path.join(TEST_DATA_DIR, "moved.xlsx"), config
+        )
+        with self.subTest("No dataframe returned"):
+            assert df is None
+        with self.subTest("Error message returned"):
+            assert msg.startswith("Workbook file could not be read: ")
+
+    def test_parse_workbook_file_raises_environment_errors(self):
+        '''
+        Test that errors not caused by the workbook's contents, e.g. an
+        unwritable local ID state file, are raised rather than recorded as
+        the workbook failing parsing
+        '''
+        with mock.patch(
+            "utils.utils.parse_workbook",
+            side_effect=PermissionError("local_id state file")
+        ):
+            with self.assertRaises(PermissionError):
+                utils.parse_workbook_file(cuh, config)
+
+def make_random_report_df(config, n_rows, seed=0):
+    '''
+    Make a dataframe like the one extracted from interpret sheets, with
+    random strengths (including "NA" and empty cells) for each ACGS criterion
+    '''
+    rng = np.random.default_rng(seed)
+    strengths = config["strength_dropdown"] + [np.nan, np.nan, np.nan]
+    data = {}
+    for criterion in config["acgs_criteria"]:
+        data[criterion] = rng.choice(np.array(strengths, dtype=object), n_rows)
+        data[criterion + "_evidence"] = [
+            f"{criterion} evidence {i}" for i in range(n_rows)
+        ]
+    return pd.DataFrame(data)
+
+
+class TestACGSCriteriaParity(unittest.TestCase):
+    '''
+    Test that the column-wise ACGS criteria functions give the same results
+    as the previous row-by-row implementations
+    '''
+    acgs = config["acgs_criteria"]
+
+    def test_parity_with_random_strengths(self):
+        df = make_random_report_df(config, 500)
+        expected = legacy.legacy_make_acgs_criteria_null_if_not_applied(
+            df.copy(), self.acgs
+        )
+        expected = legacy.legacy_add_comment_on_classification(
+            expected, self.acgs, config
+        )
+        result = utils.make_acgs_criteria_null_if_not_applied(
+            df.copy(), self.acgs
+        )
+        result = utils.add_comment_on_classification(
+            result, self.acgs, config
+        )
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_parity_with_empty_df(self):
+        df = make_random_report_df(config, 0)
+        expected = legacy.legacy_add_comment_on_classification(
+            df.copy(), self.acgs, config
+        )
+        result = utils.add_comment_on_classification(
+            df.copy(), self.acgs, config
+        )
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_comment_uses_strength_only_if_not_default(self):
+        df = pd.DataFrame([{
+            criterion: np.nan for criterion in self.acgs
+        }])
+        df.loc[0, "pm3"] = "Supporting"
+        df.loc[0, "pp3"] = "Supporting"
+        df = utils.add_comment_on_classification(df, self.acgs, config)
+        assert df.loc[0, "comment_on_classification"] == "PM3_Supporting,PP3"
+
+
+class TestValidationParity(unittest.TestCase):
+    '''
+    Test that the compiled validation engine gives the same error messages
+    as the previous row-by-row checks
+    '''
+    def make_interpret_df(self, n_rows, seed=0):
+        '''
+        Make a random interpret table with some invalid classifications,
+        HGVSc values and strengths
+        '''
+        rng = np.random.default_rng(seed)
+        df = make_random_report_df(config, n_rows, seed)
+        df["germline_classification"] = rng.choice(np.array([
+            "Pathogenic", "Likely Pathogenic", "Benign", "Not a class",
+            np.nan
+        ], dtype=object), n_rows, p=[0.3, 0.3, 0.3, 0.05, 0.05])
+        df["hgvsc"] = rng.choice(np.array([
+            "NM_1:c.1A>G", "NM_1:c.2A>G", "NM_1:c.3A>G", np.nan
+        ], dtype=object), n_rows, p=[0.4, 0.4, 0.15, 0.05])
+        df["ba1"] = rng.choice(np.array(
+            config["BA1_dropdown"] + ["Wrong", np.nan], dtype=object
+        ), n_rows)
+        for criterion in config["acgs_criteria"]:
+            wrong = rng.random(n_rows) < 0.01
+            df.loc[wrong, criterion] = "Wrong"
+        return df
+
+    def test_check_interpret_table_parity(self):
+        df_included = pd.DataFrame({"hgvsc": ["NM_1:c.1A>G", "NM_1:c.2A>G"]})
+        for seed in range(5):
+            df = self.make_interpret_df(200, seed)
+            with self.subTest(seed=seed):
+                expected = legacy.legacy_check_interpret_table(
+                    df, df_included, config
+                )
+                assert expected is not None
+                assert utils.check_interpret_table(
+                    df, df_included, config
+                ) == expected
+
+    def test_check_interpreted_col_parity(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            "interpreted": rng.choice(["yes", "no", "maybe"], 100),
+            "germline_classification": rng.choice(
+                np.array(["Pathogenic", np.nan], dtype=object), 100
+            ),
+            "hgvsc": [f"NM_1:c.{i}A>G" for i in range(100)],
+        })
+        assert utils.check_interpreted_col(df) == (
+            legacy.legacy_check_interpreted_col(df)
+        )
+
+    def test_checking_sheets_parity(self):
+        for wb in nuh_workbooks + cuh_workbooks:
+            workbook = load_workbook(wb)
+            with self.subTest(wb):
+                assert utils.checking_sheets(workbook) == (
+                    legacy.legacy_checking_sheets(workbook)
+                )
+
+    def test_check_sample_name(self):
+        with self.subTest("Valid sample name"):
+            assert utils.check_sample_name(
+                "123456789", "12345R1234", "23NGWES12", "1234", "99347387"
+            ) is None
+        with self.subTest("Invalid sample ID"):
+            assert utils.check_sample_name(
+                "123456789", "X12345", "23NGWES12", "1234", "99347387"
+            ) == "Unusual sampleID"
+        with self.subTest("Invalid probeset ID"):
+            assert utils.check_sample_name(
+                "123456789", "12345R1234", "23NGWES12", "1234", "PROBES"
+            ) == "Unusual probesetID"
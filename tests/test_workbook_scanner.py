@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+from utils.workbook_scanner import WorkbookScanner
+
+
+class TestWorkbookScanner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cuh = os.path.join(self.tmp_dir.name, "CUH")
+        self.nuh = os.path.join(self.tmp_dir.name, "NUH")
+        os.makedirs(os.path.join(self.cuh, "archive"))
+        os.makedirs(self.nuh)
+        self.manifest = os.path.join(self.tmp_dir.name, "manifest.json")
+        self.cuh_wb = self.write(self.cuh, "cuh_1.xlsx")
+        self.nuh_wb = self.write(self.nuh, "nuh_1.xlsx")
+        self.archived_wb = self.write(
+            os.path.join(self.cuh, "archive"), "old.xlsx"
+        )
+        self.write(self.cuh, "notes.txt")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, folder, name, content=b"data"):
+        path = os.path.join(folder, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_first_scan_finds_workbooks_in_all_roots(self):
+        scanner = WorkbookScanner(self.manifest)
+        changed, unchanged = scanner.scan([self.cuh, self.nuh])
+        with self.subTest("All workbooks in roots are new"):
+            assert changed == [self.cuh_wb, self.nuh_wb]
+        with self.subTest("Nothing unchanged"):
+            assert unchanged == []
+
+    def test_recursive_scan_includes_subfolders(self):
+        scanner = WorkbookScanner(self.manifest, recursive=True)
+        changed, _ = scanner.scan([self.cuh])
+        assert changed == [self.archived_wb, self.cuh_wb]
+
+    def test_rescan_after_save_only_reports_new_files(self):
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh, self.nuh])
+        scanner.save()
+
+        new_wb = self.write(self.nuh, "nuh_2.xlsx")
+        changed, unchanged = WorkbookScanner(self.manifest).scan(
+            [self.cuh, self.nuh]
+        )
+        with self.subTest("Only new workbook is changed"):
+            assert changed == [new_wb]
+        with self.subTest("Previously scanned workbooks are unchanged"):
+            assert unchanged == [self.cuh_wb, self.nuh_wb]
+
+    def test_unchanged_directory_files_not_stat_ed(self):
+        '''
+        Files in a directory whose modification time has not changed since
+        the last saved scan should be taken from the manifest, without
+        listing the directory
+        '''
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh])
+        scanner.save()
+
+        with mock.patch("os.scandir") as mock_scandir:
+            changed, unchanged = WorkbookScanner(self.manifest).scan(
+                [self.cuh]
+            )
+        with self.subTest("Directory not listed"):
+            mock_scandir.assert_not_called()
+        with self.subTest("Workbook reported as unchanged"):
+            assert (changed, unchanged) == ([], [self.cuh_wb])
+
+    def test_unsaved_scan_is_not_persisted(self):
+        WorkbookScanner(self.manifest).scan([self.cuh])
+        changed, _ = WorkbookScanner(self.manifest).scan([self.cuh])
+        assert changed == [self.cuh_wb]
+
+    def test_full_scan_finds_file_edited_in_place(self):
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh])
+        scanner.save()
+        dir_stat = os.stat(self.cuh)
+        self.write(self.cuh, "cuh_1.xlsx", b"edited data")
+        os.utime(self.cuh, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+        changed, _ = WorkbookScanner(self.manifest).scan(
+            [self.cuh], full_scan=True
+        )
+        assert changed == [self.cuh_wb]
+
+    def test_parsed_marks_persisted_for_unchanged_workbooks(self):
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh, self.nuh])
+        scanner.mark_parsed([self.cuh_wb])
+        scanner.save()
+
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh, self.nuh])
+        with self.subTest("Marked workbook is parsed"):
+            assert scanner.is_parsed(self.cuh_wb)
+        with self.subTest("Unmarked workbook is not"):
+            assert not scanner.is_parsed(self.nuh_wb)
+
+    def test_parsed_mark_cleared_when_workbook_changes(self):
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh])
+        scanner.mark_parsed([self.cuh_wb])
+        scanner.save()
+        self.write(self.cuh, "cuh_1.xlsx", b"edited data")
+
+        scanner = WorkbookScanner(self.manifest)
+        changed, _ = scanner.scan([self.cuh], full_scan=True)
+        with self.subTest("Workbook changed"):
+            assert changed == [self.cuh_wb]
+        with self.subTest("No longer marked as parsed"):
+            assert not scanner.is_parsed(self.cuh_wb)
+
+    def test_parsed_marks_of_removed_workbooks_not_saved(self):
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh])
+        scanner.mark_parsed([self.cuh_wb])
+        scanner.save()
+        os.remove(self.cuh_wb)
+
+        scanner = WorkbookScanner(self.manifest)
+        scanner.scan([self.cuh])
+        scanner.save()
+        with open(self.manifest) as f:
+            assert json.load(f)["parsed"] == []
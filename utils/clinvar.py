@@ -1,8 +1,51 @@
+import datetime
+import numpy as np
 import pandas as pd
 import requests
 import json
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
 from requests.adapters import HTTPAdapter, Retry
 from utils.database_actions import add_clinvar_submission_error_to_db
+from utils.profiling import timed
+from utils.utils import submission_status_check
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# (connect, read) timeouts in seconds for ClinVar API requests
+CLINVAR_TIMEOUT = (10, 120)
+
+# default limits on the variants in one ClinVar submission, by number of
+# records and by size of the serialized records in bytes
+MAX_BATCH_RECORDS = 1000
+MAX_BATCH_BYTES = 5_000_000
+
+# columns of the inca table read by extract_clinvar_information
+SUBMISSION_COLUMNS = (
+    "local_id",
+    "linking_id",
+    "ref_genome",
+    "germline_classification",
+    "comment_on_classification",
+    "date_last_evaluated",
+    "preferred_condition_name",
+    "affected_status",
+    "allele_origin",
+    "collection_method",
+    "chromosome",
+    "start",
+    "reference_allele",
+    "alternate_allele",
+    "gene_symbol",
+)
+
 
 def extract_clinvar_information(variant_row, ref_genomes):
     '''
@@ -54,26 +97,342 @@ def extract_clinvar_information(variant_row, ref_genomes):
     return clinvar_dict
 
 
-def collect_clinvar_data_to_submit(clinvar_df, ref_genomes):
+def build_submission_records(clinvar_df, ref_genomes):
     '''
-    Cycle through a dataframe, and extract variants for each row. Call the
-    function to reformat this into a dictionary for submission to ClinVar and
-    return a list of these dictionaries
+    Build the dictionary for submission to ClinVar of every variant in a
+    dataframe in one pass over its columns, giving the same dictionaries as
+    extract_clinvar_information for each row
     Inputs
-        clinvar_df (pandas.Dataframe): variant dataframe
+        clinvar_df (pandas.Dataframe): variant dataframe with at least the
+        SUBMISSION_COLUMNS
         ref_genomes (list): list of valid reference genome values from config
     Outputs
         variants (list): list of dictionaries with variant data for submission
         to ClinVar
     '''
+    assemblies = {genome: genome.split('.')[0] for genome in ref_genomes}
     variants = []
-    for index, variant in clinvar_df.iterrows():
-        clinvar_dict = extract_clinvar_information(variant, ref_genomes)
-        variants.append(clinvar_dict)
+    for (
+        local_id, linking_id, ref_genome, classification, comment,
+        date_last_evaluated, condition, affected_status, allele_origin,
+        collection_method, chromosome, start, reference_allele,
+        alternate_allele, gene_symbol
+    ) in zip(*(clinvar_df[column] for column in SUBMISSION_COLUMNS)):
+        if ref_genome not in assemblies:
+            raise ValueError("Invalid genome build")
+
+        variants.append({
+            'clinicalSignificance': {
+                'clinicalSignificanceDescription': classification,
+                'comment': comment,
+                'dateLastEvaluated': date_last_evaluated
+            },
+            'conditionSet': {
+                'condition': [{'name': condition}]
+            },
+            'localID': local_id,
+            'localKey': linking_id,
+            'observedIn': [{
+                'affectedStatus': affected_status,
+                'alleleOrigin': allele_origin,
+                'collectionMethod': collection_method
+            }],
+            'recordStatus': "novel",
+            'variantSet': {
+                'variant': [{
+                    'chromosomeCoordinates': {
+                        'assembly': assemblies[ref_genome],
+                        'alternateAllele': alternate_allele,
+                        'referenceAllele': reference_allele,
+                        'chromosome': str(chromosome),
+                        'start': start
+                    },
+                    'gene': [{
+                        'symbol': gene_symbol
+                    }],
+                }],
+            },
+        })
 
     return variants
 
 
+@timed
+def collect_clinvar_data_to_submit(clinvar_df, ref_genomes):
+    '''
+    Extract the variants in a dataframe and reformat them into dictionaries
+    for submission to ClinVar
+    Inputs
+        clinvar_df (pandas.Dataframe): variant dataframe
+        ref_genomes (list): list of valid reference genome values from config
+    Outputs
+        variants (list): list of dictionaries with variant data for submission
+        to ClinVar
+    '''
+    return build_submission_records(clinvar_df, ref_genomes)
+
+
+def _to_json_type(value):
+    '''
+    Convert a value that is not a JSON type, e.g. a date or NumPy scalar
+    from a pandas dataframe, into one. Dates are written as str would write
+    them, and anything else unrecognised is converted with str
+    '''
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return _finite_or_none(float(value))
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.ndarray):
+        return _finite_or_none(value.tolist())
+    return str(value)
+
+
+def _finite_or_none(data):
+    '''
+    Replace NaN and infinite floats in data, e.g. empty cells read by
+    pandas, with None, as orjson writes them as null
+    '''
+    if isinstance(data, float):
+        return data if math.isfinite(data) else None
+    if isinstance(data, dict):
+        return {key: _finite_or_none(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_finite_or_none(value) for value in data]
+    return data
+
+
+def encode_payload(data):
+    '''
+    Serialize data for the ClinVar API to JSON bytes, once, so the same
+    bytes can be printed and sent. Uses orjson if it is installed, otherwise
+    json with the same output: compact, UTF-8 and with NaN written as null
+    Inputs:
+        data (dict or list): data to serialize
+    Outputs:
+        (bytes): UTF-8 encoded JSON
+    '''
+    if orjson is not None:
+        return orjson.dumps(
+            data, default=_to_json_type,
+            option=orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(
+        _finite_or_none(data), default=_to_json_type, separators=(",", ":"),
+        ensure_ascii=False, allow_nan=False
+    ).encode()
+
+
+def split_into_batches(
+    variants, local_ids, max_records=MAX_BATCH_RECORDS,
+    max_bytes=MAX_BATCH_BYTES
+):
+    '''
+    Split variants to submit into batches, each of which is submitted to
+    ClinVar separately, so no submission exceeds ClinVar's limits and a
+    rejected submission only affects the variants in it. A variant larger
+    than max_bytes is submitted in a batch on its own. Each variant is
+    serialized once, to measure it, and its JSON is kept to build the
+    submission body from
+    Inputs:
+        variants (list): dictionaries of variant data for submission, or
+        their JSON from an earlier batch
+        local_ids (list): local IDs of the variants, in the same order
+        max_records (int): maximum number of variants in a batch
+        max_bytes (int): maximum size of the variants in a batch once
+        serialized to JSON
+    Outputs:
+        batches (generator): (records, local_ids) for each batch, where
+        records is the JSON bytes of each variant
+    '''
+    batch_records, batch_ids, size = [], [], 0
+    for variant, local_id in zip(variants, local_ids):
+        record = variant if isinstance(variant, bytes) else (
+            encode_payload(variant)
+        )
+        # size of record plus separator in the clinvarSubmission array
+        record_size = len(record) + 1
+        if batch_records and (
+            len(batch_records) >= max_records
+            or size + record_size > max_bytes
+        ):
+            yield batch_records, batch_ids
+            batch_records, batch_ids, size = [], [], 0
+        batch_records.append(record)
+        batch_ids.append(local_id)
+        size += record_size
+
+    if batch_records:
+        yield batch_records, batch_ids
+
+
+class RateLimiter:
+    '''
+    Token bucket limiting how often calls start, shared across threads.
+    Tokens are added at the given rate up to burst, and each call takes one,
+    waiting for it if none are left. Calls can also be paused, e.g. when the
+    API asks clients to retry after a delay
+    '''
+    def __init__(self, rate, burst=1):
+        '''
+        Inputs:
+            rate (float): calls allowed per second, or None for no limit
+            burst (int): calls that can be made at once after being idle
+        '''
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        '''
+        Wait until the next call is allowed
+        '''
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._paused_until)
+            if self.rate:
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                # take a token now, waiting until it would have been added
+                self._tokens -= 1
+                if self._tokens < 0:
+                    start = max(start, now - self._tokens / self.rate)
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        '''
+        Stop calls starting for a number of seconds
+        Inputs:
+            seconds (float): time to pause calls for
+        '''
+        with self._lock:
+            self._paused_until = max(
+                self._paused_until, time.monotonic() + seconds
+            )
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    '''
+    Raised instead of making a request while the circuit breaker is open
+    '''
+
+
+class SubmissionRecordError(Exception):
+    '''
+    Raised by the on_result function of submit_batches when a batch accepted
+    by ClinVar could not be recorded, to stop further batches being submitted
+    '''
+
+
+class CircuitBreaker:
+    '''
+    Stops calls to an API once too many recent calls have failed, so a run
+    against a degraded API fails fast rather than waiting on every call.
+    After reset_after seconds calls are allowed again
+    '''
+    def __init__(
+        self, failure_rate=0.5, min_calls=5, window=20, reset_after=300
+    ):
+        '''
+        Inputs:
+            failure_rate (float): fraction of recent calls failing at which
+            the breaker opens
+            min_calls (int): recent calls needed before the breaker can open
+            window (int): number of recent calls to consider
+            reset_after (float): seconds after opening to allow calls again
+        '''
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_after = reset_after
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._check_open()
+
+    def _check_open(self):
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            self._opened_at = None
+            self._outcomes.clear()
+            return False
+        return True
+
+    def before_call(self):
+        '''
+        Check a call can be made
+        Raises:
+            CircuitOpenError: if the breaker is open
+        '''
+        with self._lock:
+            if self._check_open():
+                raise CircuitOpenError(
+                    "Too many recent ClinVar API calls failed; not calling "
+                    "the API until it recovers"
+                )
+
+    def record(self, success):
+        '''
+        Record the outcome of a call, opening the breaker if too many recent
+        calls failed
+        Inputs:
+            success (bool): whether the call succeeded
+        '''
+        with self._lock:
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if (
+                self._opened_at is None
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate
+            ):
+                print(
+                    f"{failures} of the last {len(self._outcomes)} ClinVar "
+                    "API calls failed. Skipping further calls for "
+                    f"{self.reset_after} s"
+                )
+                self._opened_at = time.monotonic()
+
+
+def retry_after_seconds(response):
+    '''
+    Get the delay requested by a response's Retry-After header
+    Inputs:
+        response: API response object
+    Outputs:
+        (float): seconds to wait, or None if not given
+    '''
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(retry_at.tzinfo)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
 def create_header(api_key):
     '''
     Format header for ClinVar API submission
@@ -89,19 +448,171 @@ def create_header(api_key):
     return header
 
 
-def clinvar_api_request(url, header, var_list, org_guidelines_url, print_json):
+class ClinVarClient:
     '''
-    Make request to the ClinVar API endpoint specified.
+    Makes requests to the ClinVar API, keeping one pooled keep-alive session
+    and one rate limiter for each API key so connections are reused across a
+    run. All requests share one retry policy, timeout and circuit breaker,
+    so a run against a degraded API finishes in bounded time and leaves
+    the remaining work for the next run. Sessions may be used from several
+    threads, e.g. when checking submission statuses concurrently
+    '''
+    def __init__(
+        self, pool_size=10, timeout=CLINVAR_TIMEOUT, rate=None,
+        circuit_breaker=None, rate_limit_retries=3, max_retry_after=120
+    ):
+        '''
+        Inputs:
+            pool_size (int): number of connections to keep open for each
+            API key, at least the number of concurrent requests
+            timeout (tuple): (connect, read) timeouts in seconds
+            rate (float): requests allowed per second for each API key, or
+            None for no limit
+            circuit_breaker (CircuitBreaker): breaker for all requests, a
+            default one is used if not given
+            rate_limit_retries (int): times to retry a request rejected
+            with HTTP 429, after the delay given in its Retry-After header
+            max_retry_after (float): longest Retry-After delay in seconds to
+            wait for before retrying
+        '''
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate = rate
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.rate_limit_retries = rate_limit_retries
+        self.max_retry_after = max_retry_after
+        self._sessions = {}
+        self._rate_limiters = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _create_session(self):
+        # POST is not retried after it reaches ClinVar, to avoid duplicate
+        # submissions; failed connections and GETs are. Retries are few so
+        # a degraded API trips the circuit breaker rather than blocking
+        retries = Retry(
+            total=3, backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504)
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size,
+            max_retries=retries
+        )
+        session = requests.Session()
+        session.mount('https://', adapter)
+        return session
+
+    def session(self, header):
+        '''
+        Get the session for the API key in a header, creating it if needed
+        Inputs:
+            header (dict): header for ClinVar API query
+        Outputs:
+            session (requests.Session): session for the API key
+        '''
+        api_key = header.get("SP-API-KEY")
+        with self._lock:
+            if api_key not in self._sessions:
+                self._sessions[api_key] = self._create_session()
+            return self._sessions[api_key]
+
+    def rate_limiter(self, header):
+        '''
+        Get the rate limiter for the API key in a header, creating it if
+        needed
+        Inputs:
+            header (dict): header for ClinVar API query
+        Outputs:
+            rate_limiter (RateLimiter): rate limiter for the API key
+        '''
+        api_key = header.get("SP-API-KEY")
+        with self._lock:
+            if api_key not in self._rate_limiters:
+                self._rate_limiters[api_key] = RateLimiter(self.rate)
+            return self._rate_limiters[api_key]
+
+    def _request(self, method, url, headers, **kwargs):
+        '''
+        Make a request through the circuit breaker and the API key's rate
+        limiter, retrying after the requested delay if rate limited
+        '''
+        self.circuit_breaker.before_call()
+        rate_limiter = self.rate_limiter(headers)
+        send = getattr(self.session(headers), method)
+        for attempt in range(self.rate_limit_retries + 1):
+            rate_limiter.wait()
+            try:
+                response = send(
+                    url, headers=headers, timeout=self.timeout, **kwargs
+                )
+            except requests.exceptions.RequestException:
+                self.circuit_breaker.record(False)
+                raise
+            if response.status_code != 429:
+                break
+            delay = retry_after_seconds(response)
+            if (
+                attempt == self.rate_limit_retries
+                or delay is None or delay > self.max_retry_after
+            ):
+                break
+            print(f"ClinVar API rate limit reached. Retrying in {delay} s")
+            rate_limiter.pause(delay)
+
+        self.circuit_breaker.record(
+            response.status_code < 500 and response.status_code != 429
+        )
+        return response
+
+    def get(self, url, headers):
+        '''
+        GET a ClinVar API url, e.g. a submission status or summary file
+        Inputs:
+            url (str): url to get
+            headers (dict): header for ClinVar API query
+        Outputs:
+            response: API response object
+        '''
+        return self._request("get", url, headers)
+
+    def post(self, url, data, headers):
+        '''
+        POST data to a ClinVar API url, e.g. a submission
+        Inputs:
+            url (str): url to post to
+            data (bytes): request body
+            headers (dict): header for ClinVar API query
+        Outputs:
+            response: API response object
+        '''
+        return self._request("post", url, headers, data=data)
+
+    def close(self):
+        '''
+        Close the sessions for all API keys
+        '''
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+def build_submission_body(records, org_guidelines_url):
+    '''
+    Build the JSON body of a ClinVar API submission of variants from the
+    JSON of each variant, without serializing the variants again
     Inputs:
-        url (str): API endpoint URL
-        api_key (dict): ClinVar API key
-        var_list (list): list of variant data for each clinvar variant
+        records (list): JSON bytes of each clinvar variant, as returned by
+        split_into_batches
         org_guidelines_url (str): url for the ACGS guidelines. These are
         different for CUH and NUH.
-        print_json (boolean): controls whether or not to print each submission
-        JSON
     Returns:
-        response: API response object
+        body (bytes): UTF-8 encoded JSON to submit
     '''
     clinvar_data = {
         "actions": [
@@ -110,7 +621,7 @@ def clinvar_api_request(url, header, var_list, org_guidelines_url, print_json):
             "targetDb": "clinvar",
             "data": {
                 "content": {
-                    'clinvarSubmission': var_list,
+                    'clinvarSubmission': [],
                     'assertionCriteria': {
                         'url': org_guidelines_url
                         }
@@ -119,18 +630,59 @@ def clinvar_api_request(url, header, var_list, org_guidelines_url, print_json):
             }
         ]
     }
+    # quotes in string values are escaped, so this only matches the key
+    return encode_payload(clinvar_data).replace(
+        b'"clinvarSubmission":[]',
+        b'"clinvarSubmission":[' + b",".join(records) + b"]", 1
+    )
+
+
+@timed
+def post_submission(url, header, body, client=None):
+    '''
+    POST a submission body built by build_submission_body to the ClinVar API
+    Inputs:
+        url (str): API endpoint URL
+        header (dict): header for ClinVar API query
+        body (bytes): JSON to submit
+        client (ClinVarClient): client to make the request with, a new one
+        is used if not given
+    Returns:
+        response: API response object
+    '''
+    if client is None:
+        client = ClinVarClient()
+    return client.post(url, body, header)
+
 
+def clinvar_api_request(
+    url, header, var_list, org_guidelines_url, print_json, client=None
+):
+    '''
+    Make request to the ClinVar API endpoint specified.
+    Inputs:
+        url (str): API endpoint URL
+        api_key (dict): ClinVar API key
+        var_list (list): list of variant data for each clinvar variant
+        org_guidelines_url (str): url for the ACGS guidelines. These are
+        different for CUH and NUH.
+        print_json (boolean): controls whether or not to print each submission
+        JSON
+        client (ClinVarClient): client to make the request with, a new one
+        is used if not given
+    Returns:
+        response: API response object
+    '''
+    body = build_submission_body(
+        [encode_payload(variant) for variant in var_list], org_guidelines_url
+    )
     if print_json is True:
         print("JSON to submit:")
-        print(json.dumps(clinvar_data, indent=4, default=str))
-
-    s = requests.Session()
-    retries = Retry(total=10, backoff_factor=0.5)
-    s.mount('https://', HTTPAdapter(max_retries=retries))
-    response = s.post(url, data=json.dumps(clinvar_data, default=str), headers=header)
-    return response
+        print(body.decode())
+    return post_submission(url, header, body, client)
 
 
+@timed
 def process_submission_status(status, response):
     '''
     Process response to API query about submission status.
@@ -180,3 +732,171 @@ def process_submission_status(status, response):
         )
 
     return accession_ids, errors
+
+
+def check_submission(
+    submission_id, header, api_url, client, cache=None
+):
+    '''
+    Check the status of one ClinVar submission, collecting the messages
+    about it rather than printing them, so checks can run in worker threads
+    without their output interleaving
+    Inputs:
+        submission_id (str): ClinVar submission ID
+        header (dict): header for ClinVar API query
+        api_url (str): ClinVar API url
+        client (ClinVarClient): client to make requests with
+        cache (summary_cache.SummaryFileCache): cache of summary files
+    Outputs:
+        status (str): status of submission
+        response (dict): API response or summary file for the submission
+        messages (list): messages about the check, to print
+    '''
+    messages = []
+    status, response = submission_status_check(
+        submission_id, header, api_url, client, cache, messages.append
+    )
+    return status, response, messages
+
+
+@timed
+def poll_submission_statuses(
+    submissions, headers, api_url, max_workers=8, client=None, cache=None
+):
+    '''
+    Check the status of many ClinVar submissions concurrently, for any
+    organisation, and collect the accession IDs and errors from all of them
+    so they can be written back to the database together. A submission whose
+    status cannot be checked is left to be checked on the next run
+    Inputs:
+        submissions (list): (organisation_id, submission_id) tuples
+        headers (dict): header for ClinVar API query for each organisation_id
+        api_url (str): ClinVar API url
+        max_workers (int): maximum number of status checks to run at once
+        client (ClinVarClient): client to make requests with, a new one is
+        used if not given
+        cache (summary_cache.SummaryFileCache): cache of summary files, used
+        instead of the API for submissions in it
+    Outputs:
+        accession_ids (dict): dict of accession IDs for all submissions
+        errors (dict): dict of errors for all submissions
+        statuses (dict): status of each submission, or None if its status
+        could not be checked
+    '''
+    accession_ids = {}
+    errors = {}
+    statuses = {}
+    if not submissions:
+        return accession_ids, errors, statuses
+
+    if client is None:
+        client = ClinVarClient(pool_size=max_workers)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(
+                check_submission, submission_id, headers[organisation_id],
+                api_url, client, cache
+            )
+            for organisation_id, submission_id in submissions
+        ]
+        # collect results in the order submissions were given, printing
+        # each submission's messages together from this thread
+        for (_, submission_id), future in zip(submissions, futures):
+            try:
+                status, response, messages = future.result()
+                if messages:
+                    print("\n".join(messages))
+                submission_accession_ids, submission_errors = (
+                    process_submission_status(status, response)
+                )
+            except (RuntimeError, ValueError, KeyError,
+                    requests.exceptions.RequestException) as error:
+                print(
+                    f"Could not check status of submission {submission_id}; "
+                    f"it will be checked on the next run: {error}"
+                )
+                statuses[submission_id] = None
+                continue
+            statuses[submission_id] = status
+            accession_ids.update(submission_accession_ids)
+            errors.update(submission_errors)
+
+    return accession_ids, errors, statuses
+
+
+@timed
+def submit_batches(
+    url, header, batches, org_guidelines_url, print_json, client=None,
+    max_workers=2, on_result=None
+):
+    '''
+    Submit batches of variants to ClinVar concurrently, within the client's
+    rate limit. A batch whose request fails is not submitted, and its
+    variants are submitted on the next run
+    Inputs:
+        url (str): API endpoint URL
+        header (dict): header for ClinVar API query
+        batches (list): (records, local_ids) for each batch, as returned by
+        split_into_batches
+        org_guidelines_url (str): url for the ACGS guidelines
+        print_json (boolean): controls whether or not to print each submission
+        JSON
+        client (ClinVarClient): client to make requests with, a new one is
+        used if not given
+        max_workers (int): maximum number of batches to submit at once
+        on_result (callable): optional function called with the local_ids
+        and response of each batch as soon as it is submitted, from this
+        thread, e.g. to record its submission ID before the other batches
+        finish. If it raises SubmissionRecordError, batches not yet started
+        are cancelled and the error is raised once those already being
+        submitted have finished
+    Outputs:
+        results (list): (local_ids, response) for each batch submitted, in
+        the order of batches
+    '''
+    if client is None:
+        client = ClinVarClient(pool_size=max_workers)
+
+    results = [None] * len(batches)
+    record_error = None
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {}
+        for index, (records, _) in enumerate(batches):
+            # built and printed here so printed bodies are not interleaved
+            body = build_submission_body(records, org_guidelines_url)
+            if print_json is True:
+                print("JSON to submit:")
+                print(body.decode())
+            futures[executor.submit(
+                post_submission, url, header, body, client
+            )] = index
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            records, local_ids = batches[futures[future]]
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as error:
+                print(
+                    f"Submission of a batch of {len(records)} variants "
+                    f"failed; they will be submitted on the next run: {error}"
+                )
+                continue
+            results[futures[future]] = (local_ids, response)
+            if on_result is None:
+                continue
+            try:
+                on_result(local_ids, response)
+            except SubmissionRecordError as error:
+                if record_error is None:
+                    record_error = error
+                    cancelled = sum(x.cancel() for x in futures)
+                    print(
+                        f"Stopped submitting batches: {error}. {cancelled} "
+                        "batches not yet started will be submitted on the "
+                        "next run"
+                    )
+
+    if record_error is not None:
+        raise record_error
+    return [result for result in results if result is not None]
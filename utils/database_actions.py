@@ -1,25 +1,130 @@
 import pandas as pd
 import datetime
+import io
+from contextlib import contextmanager
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from utils.profiling import timed
 
+
+def create_db_engine(url, pool_size=5, max_overflow=5):
+    '''
+    Create a SQLAlchemy engine with a pool of connections to the database,
+    so connections are reused rather than opened for each statement
+    Inputs
+        url (str): database URL
+        pool_size (int): number of connections kept open in the pool
+        max_overflow (int): number of extra connections allowed when all
+        pooled connections are in use
+    Outputs
+        (sqlalchemy.engine.Engine): engine connected to the database
+    '''
+    return create_engine(
+        url, pool_size=pool_size, max_overflow=max_overflow,
+        pool_pre_ping=True
+    )
+
+
+@contextmanager
+def workbook_transaction(engine):
+    '''
+    Unit of work for writing one workbook to the database. Borrows a single
+    pooled connection and runs everything in one transaction, which is
+    committed if the block completes and rolled back if it raises, so a
+    workbook's variants are never left in the inca table without the
+    workbook being marked as parsed. The connection is returned to the pool
+    afterwards
+    Inputs
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        connection (sqlalchemy.engine.Connection): connection to pass to
+        the database functions in place of the engine
+    '''
+    with engine.begin() as connection:
+        yield connection
+
+
+@timed
 def add_variants_to_db(df, engine):
     '''
-    Update inca table to add variants
+    Update inca table to add variants. Uses COPY on PostgreSQL, falling back
+    to pandas to_sql for other databases
     Inputs
-        df (pd.Dataframe): dataframe with variant information
+        df (pd.Dataframe): dataframe with variant information, which may
+        combine variants from several workbooks
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
     Outputs
         None, adds data to db
     '''
-    rows = df.to_sql(
-        "inca",
-        engine,
-        if_exists='append',
-        schema='testdirectory',
-        index=False
-    )
+    if engine.dialect.name == "postgresql":
+        rows = copy_variants_to_db(df, engine)
+    else:
+        rows = df.to_sql(
+            "inca",
+            engine,
+            if_exists='append',
+            schema='testdirectory',
+            index=False
+        )
     print(f"Added {rows} records to inca table")
 
 
+def _format_for_copy(df):
+    '''
+    Convert float columns that only hold whole numbers, e.g. integer
+    columns with missing values, to nullable integers so they are written
+    as 1 rather than 1.0 and can be copied into integer columns
+    '''
+    converted = {}
+    for column in df.select_dtypes(include="float").columns:
+        values = df[column].dropna()
+        if not values.empty and (values % 1 == 0).all():
+            converted[column] = df[column].astype("Int64")
+    if converted:
+        df = df.assign(**converted)
+    return df
+
+
+def copy_variants_to_db(df, engine):
+    '''
+    Add variants to the inca table with a single PostgreSQL COPY, streaming
+    the dataframe as CSV from an in-memory buffer
+    Inputs
+        df (pd.Dataframe): dataframe with variant information
+        engine (sqlalchemy.engine.Engine or Connection): SQLAlchemy
+        connection to AWS db. If a connection is given, the COPY runs in
+        its current transaction
+    Outputs
+        rows (int): number of records added
+    '''
+    if isinstance(engine, Engine):
+        with engine.begin() as connection:
+            return copy_variants_to_db(df, connection)
+
+    buffer = io.StringIO()
+    _format_for_copy(df).to_csv(
+        buffer, index=False, header=False, na_rep="\\N"
+    )
+    buffer.seek(0)
+
+    columns = ", ".join(f'"{column}"' for column in df.columns)
+    statement = (
+        f"COPY testdirectory.inca ({columns}) FROM STDIN "
+        "WITH (FORMAT csv, NULL '\\N')"
+    )
+    cursor = engine.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except engine.dialect.dbapi.Error as err:
+        # raised as SQLAlchemy errors are for statements run by SQLAlchemy
+        raise DBAPIError(statement, None, err) from err
+    finally:
+        cursor.close()
+    return df.shape[0]
+
+
+@timed
 def add_wb_to_db(workbook, parse_status, engine):
     '''
     Update inca_workbooks table to add workbooks
@@ -39,22 +144,53 @@ def add_wb_to_db(workbook, parse_status, engine):
     )
 
 
-def update_db_for_parsed_wb(workbook, engine):
+@timed
+def update_db_for_parsed_wb(workbook, engine, fingerprint=None):
     '''
     Update inca_workbooks table to set parse_status to true for parsed
     workbooks
     Inputs
         workbook (str): filename of workbook
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+        fingerprint (FileFingerprint): optional size, mtime and hash of the
+        parsed workbook file, used to detect duplicate workbooks
+    Outputs
+        None, adds data to db
+    '''
+    file_details = ""
+    if fingerprint is not None:
+        file_details = (
+            f", file_size = {fingerprint.size}, "
+            f"file_mtime = {fingerprint.mtime_ns}, "
+            f"file_hash = '{fingerprint.file_hash}'"
+        )
+    engine.execute(
+        f"UPDATE testdirectory.inca_workbooks SET parse_status = TRUE"
+        f"{file_details} WHERE workbook_name = '{workbook}'"
+    )
+
+
+@timed
+def add_fingerprint_to_db(workbook, fingerprint, engine):
+    '''
+    Store the size, mtime and content hash of a workbook that was parsed
+    before hashes were recorded, so it is included in duplicate detection
+    Inputs
+        workbook (str): filename of workbook
+        fingerprint (FileFingerprint): size, mtime and hash of workbook file
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
     Outputs
         None, adds data to db
     '''
     engine.execute(
-        "UPDATE testdirectory.inca_workbooks SET parse_status = TRUE "
+        f"UPDATE testdirectory.inca_workbooks SET file_size = "
+        f"{fingerprint.size}, file_mtime = {fingerprint.mtime_ns}, "
+        f"file_hash = '{fingerprint.file_hash}' "
         f"WHERE workbook_name = '{workbook}'"
     )
 
 
+@timed
 def add_submission_id_to_db(response, engine, variants):
     '''
     Add batch submission ID to inca table for all submitted variants
@@ -74,96 +210,416 @@ def add_submission_id_to_db(response, engine, variants):
             f"WHERE local_id in ({submitted_variants})"
         )
     else:
-        error = response.get('message')
+        error = str(response.get('message')).replace("'", "''")
         engine.execute(
             f"UPDATE testdirectory.inca SET clinvar_status = 'ERROR: {error}' "
             f"WHERE local_id in ({submitted_variants})"
         )
 
 
-def select_variants_from_db(organisation_id, engine, submitted, exclude=""):
+def _select_variants_sql(organisations, submitted, exclude, columns):
     '''
-    Select variants from inca table
+    Build the query for interpreted variants without an accession ID
     Inputs
-        organisation_id (str): ClinVar organisation ID for NUH or CUH
+        organisations (str): condition on organisation_id
+        submitted (str): value for column submission_id to filter on
+        exclude (str): string for further filtering
+        columns (list): columns to select, or None for all columns
+    Outputs
+        sql (str): SQL SELECT statement
+    '''
+    selected = ", ".join(columns) if columns else "*"
+    return (
+        f"SELECT {selected} FROM testdirectory.inca WHERE interpreted = 'yes' "
+        f"AND submission_id is {submitted} AND accession_id is NULL AND "
+        f"organisation_id {organisations}{exclude}"
+    )
+
+
+@timed
+def select_variants_by_organisation(
+    organisation_ids, engine, submitted, exclude="", columns=None,
+    chunksize=None
+):
+    '''
+    Select variants of several organisations from inca table in a single
+    query, and split them by organisation
+    Inputs
+        organisation_ids (list): ClinVar organisation IDs
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
         submitted (str): value for column submission_id to filter SQL SELECT
         statement on
-        exclude (str): Optional string for further filtering. 
+        exclude (str): Optional string for further filtering.
+        columns (list): Optional list of the columns needed, to which
+        organisation_id is added. All columns are selected if not given
+        chunksize (int): Optional number of records to read at a time. If
+        given, records are read through a server-side cursor and an
+        iterator of dicts is returned, one for each chunk
     Outputs
-        df (pandas.DataFrame): dataframe of records in table that meet the
-        given filter
+        dfs (dict): organisation ID -> dataframe of its records that meet
+        the given filter, for every organisation ID given, or an iterator
+        of these dicts if chunksize is given
     '''
-    df = pd.read_sql(
-            "SELECT * FROM testdirectory.inca WHERE interpreted = 'yes' AND "
-            f"submission_id is {submitted} AND accession_id is NULL AND "
-            f"organisation_id = '{organisation_id}'{exclude}",
-            engine
+    if columns and "organisation_id" not in columns:
+        columns = [*columns, "organisation_id"]
+    organisations = ", ".join(f"'{x}'" for x in organisation_ids)
+    sql = _select_variants_sql(
+        f"IN ({organisations})", submitted, exclude, columns
+    )
+    if chunksize is not None:
+        return (
+            split_by_organisation(df, organisation_ids)
+            for df in _read_sql_chunks(sql, engine, chunksize)
         )
-    return df
 
+    return split_by_organisation(pd.read_sql(sql, engine), organisation_ids)
 
-def select_workbooks_from_db(engine, parameter):
+
+def split_by_organisation(df, organisation_ids):
+    '''
+    Split variants by organisation
+    Inputs
+        df (pandas.DataFrame): dataframe of variants with organisation_id
+        organisation_ids (list): ClinVar organisation IDs
+    Outputs
+        dfs (dict): organisation ID -> dataframe of its variants, which is
+        empty if it has none
+    '''
+    organisation = df["organisation_id"].astype(str)
+    return {
+        organisation_id: df[
+            organisation == str(organisation_id)
+        ].reset_index(drop=True)
+        for organisation_id in organisation_ids
+    }
+
+
+def _read_sql_chunks(sql, engine, chunksize):
     '''
-    Select workbooks from inca_workbooks table
+    Read the results of a query as dataframes of at most chunksize records,
+    streamed from a server-side cursor on one connection
     Inputs
+        sql (str): query to run
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
-        parameter (str): parameter to filter SQL SELECT statement on
+        chunksize (int): number of records per dataframe
     Outputs
-        df (pandas.DataFrame): dataframe of records in table that meet the
-        given parameter
+        chunks (iterator): dataframes of query results
     '''
-    df = pd.read_sql(
-            f"SELECT * FROM testdirectory.inca_workbooks WHERE {parameter}",
-            engine
+    with engine.connect() as connection:
+        yield from pd.read_sql(
+            sql, connection.execution_options(stream_results=True),
+            chunksize=chunksize
         )
-    return df
 
 
-def add_error_to_db(engine, workbook, error):
+def _select_workbooks_matching(column, values, engine, columns="*"):
+    '''
+    Select rows from inca_workbooks table where a column matches any of the
+    given values, sent to PostgreSQL as a single array parameter
+    Inputs
+        column (str): column to match values against
+        values (iterable): values to match
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+        columns (str): columns to select
+    Outputs
+        df (pandas.DataFrame): matching records in table
+    '''
+    return pd.read_sql(
+            text(
+                f"SELECT {columns} FROM testdirectory.inca_workbooks "
+                f"WHERE {column} = ANY(:values)"
+            ),
+            engine,
+            params={"values": sorted(values)}
+        )
+
+
+@timed
+def lookup_known_workbooks(workbook_names, engine):
+    '''
+    Look up which of the given workbooks are already in inca_workbooks
+    table, so only the candidate workbooks are queried rather than all
+    workbooks ever parsed
+    Inputs
+        workbook_names (iterable): names of candidate workbooks
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        parsed (set): names of workbooks with parse_status TRUE
+        failed (set): names of workbooks with parse_status FALSE
+        unhashed (set): names of parsed workbooks with no stored file hash
+    '''
+    parsed, failed, unhashed = set(), set(), set()
+    workbook_names = set(workbook_names)
+    if not workbook_names:
+        return parsed, failed, unhashed
+
+    df = _select_workbooks_matching(
+        "workbook_name", workbook_names, engine,
+        "workbook_name, parse_status, file_hash IS NULL AS unhashed"
+    )
+    for name, parse_status, is_unhashed in df.itertuples(index=False):
+        if parse_status is None or pd.isna(parse_status):
+            continue
+        if parse_status:
+            parsed.add(name)
+            if is_unhashed:
+                unhashed.add(name)
+        else:
+            failed.add(name)
+    return parsed, failed, unhashed
+
+
+@timed
+def select_workbooks_by_name(workbook_names, engine):
+    '''
+    Select records of the given workbooks from inca_workbooks table
+    Inputs
+        workbook_names (iterable): names of workbooks to select
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        df (pandas.DataFrame): records of the workbooks in table
+    '''
+    return _select_workbooks_matching("workbook_name", workbook_names, engine)
+
+
+@timed
+def select_parsed_workbooks_by_hash(file_hashes, engine):
+    '''
+    Select parsed workbooks from inca_workbooks table which have any of the
+    given file hashes, used to find renamed or copied workbooks
+    Inputs
+        file_hashes (iterable): content hashes of candidate workbooks
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        df (pandas.DataFrame): workbook_name and file_hash of matching
+        parsed workbooks
+    '''
+    return pd.read_sql(
+            text(
+                "SELECT workbook_name, file_hash FROM "
+                "testdirectory.inca_workbooks WHERE parse_status = TRUE "
+                "AND file_hash = ANY(:values)"
+            ),
+            engine,
+            params={"values": sorted(file_hashes)}
+        )
+
+
+@timed
+def add_error_to_db(engine, workbook, error, fingerprint=None):
     '''
     If a workbook failed parsing, add the reason to the inca_workbooks table
     Inputs
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
         workbook (str): file name of workbook
         error (str): reason for workbook failing parsing
+        fingerprint (FileFingerprint): optional size, mtime and hash of the
+        workbook file that failed, used to decide whether to retry it
     Outputs
         None, adds data to db
     '''
+    error = error.replace("'", "''")
+    file_details = ""
+    if fingerprint is not None:
+        now = datetime.datetime.now()
+        file_details = (
+            f"file_size = {fingerprint.size}, "
+            f"file_mtime = {fingerprint.mtime_ns}, "
+            f"file_hash = '{fingerprint.file_hash}', last_attempt = '{now}', "
+        )
     engine.execute(
         "UPDATE testdirectory.inca_workbooks SET parse_status = FALSE, "
-        f"comment = '{error}' WHERE workbook_name = '{workbook}'"
+        f"{file_details}comment = '{error}' WHERE workbook_name = '{workbook}'"
     )
 
 
-def add_accession_ids_to_db(accession_ids, engine):
+def _bulk_update_inca(column, values, engine):
     '''
-    Add ClinVar accession IDs to INCA database
+    Set a column of the inca table for many variants in one statement, by
+    joining to a VALUES list of bound (local_id, value) parameters
     Inputs
-        accession_ids (dict): dict mapping local_id to ClinVar accession ID
+        column (str): name of column to update
+        values (dict): dict mapping local_id to new value
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        count (int): number of rows updated
+    '''
+    if not values:
+        return 0
+
+    rows = []
+    params = {}
+    for i, (local_id, value) in enumerate(values.items()):
+        rows.append(f"(:local_id_{i}, :value_{i})")
+        params[f"local_id_{i}"] = local_id
+        params[f"value_{i}"] = value
+
+    result = engine.execute(
+        text(
+            f"UPDATE testdirectory.inca SET {column} = new.value "
+            f"FROM (VALUES {', '.join(rows)}) AS new (local_id, value) "
+            "WHERE inca.local_id = new.local_id"
+        ),
+        params
+    )
+    return result.rowcount
+
+
+@timed
+def select_due_submissions(organisation_ids, engine, now):
+    '''
+    Select the ClinVar submissions of variants awaiting accession IDs whose
+    status is due to be checked, in a single query: those never checked, and
+    those not in a terminal state whose next check is due
+    Inputs
+        organisation_ids (list): ClinVar organisation IDs
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+        now (datetime.datetime): current time
+    Outputs
+        submissions (list): (organisation_id, submission_id) of each due
+        submission
+        schedule (dict): submission_id -> (poll_count, next_poll_at,
+        terminal) for due submissions with a schedule
+    '''
+    organisations = ", ".join(f"'{x}'" for x in organisation_ids)
+    df = pd.read_sql(
+            text(
+                "SELECT DISTINCT i.organisation_id, i.submission_id, "
+                "p.poll_count, p.next_poll_at FROM testdirectory.inca i "
+                "LEFT JOIN testdirectory.submission_polls p "
+                "ON p.submission_id = i.submission_id "
+                "WHERE i.interpreted = 'yes' AND i.submission_id IS NOT NULL "
+                "AND i.accession_id IS NULL "
+                f"AND i.organisation_id IN ({organisations}) "
+                "AND NOT COALESCE(p.terminal, FALSE) "
+                "AND (p.next_poll_at IS NULL OR p.next_poll_at <= :now)"
+            ),
+            engine,
+            params={"now": now}
+        )
+    organisation_ids = {str(x): x for x in organisation_ids}
+    submissions = sorted(
+        (organisation_ids[str(organisation_id)], submission_id)
+        for organisation_id, submission_id in zip(
+            df["organisation_id"], df["submission_id"]
+        )
+    )
+    schedule = {
+        submission_id: (int(poll_count), next_poll_at, False)
+        for _, submission_id, poll_count, next_poll_at
+        in df.itertuples(index=False)
+        if not pd.isna(poll_count)
+    }
+    return submissions, schedule
+
+
+@timed
+def select_poll_schedule(submission_ids, engine):
+    '''
+    Select the poll schedule of the given ClinVar submissions from the
+    submission_polls table
+    Inputs
+        submission_ids (iterable): submission IDs to select
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        schedule (dict): submission_id -> (poll_count, next_poll_at,
+        terminal) for submissions with a schedule
+    '''
+    submission_ids = set(submission_ids)
+    if not submission_ids:
+        return {}
+
+    df = pd.read_sql(
+            text(
+                "SELECT submission_id, poll_count, next_poll_at, terminal "
+                "FROM testdirectory.submission_polls WHERE submission_id = "
+                "ANY(:values)"
+            ),
+            engine,
+            params={"values": sorted(submission_ids)}
+        )
+    return {
+        submission_id: (int(poll_count), next_poll_at, bool(terminal))
+        for submission_id, poll_count, next_poll_at, terminal
+        in df.itertuples(index=False)
+    }
+
+
+@timed
+def record_submission_polls(polls, engine):
+    '''
+    Record when ClinVar submissions were checked and are next due to be
+    checked, or that they are in a terminal state and need no more checks,
+    in the submission_polls table, in one statement
+    Inputs
+        polls (dict): submission_id -> (last_polled_at, poll_count,
+        next_poll_at, terminal)
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
     Outputs
         None, adds data to db
     '''
-    for local_id, accession in accession_ids.items():
-        engine.execute(
-            f"UPDATE testdirectory.inca SET accession_id = '{accession}' "
-            f"WHERE local_id = '{local_id}'"
+    if not polls:
+        return
+
+    rows = []
+    params = {}
+    for i, (submission_id, poll) in enumerate(polls.items()):
+        rows.append(
+            f"(:submission_id_{i}, :last_polled_at_{i}, :poll_count_{i}, "
+            f":next_poll_at_{i}, :terminal_{i})"
         )
+        params[f"submission_id_{i}"] = submission_id
+        (
+            params[f"last_polled_at_{i}"],
+            params[f"poll_count_{i}"],
+            params[f"next_poll_at_{i}"],
+            params[f"terminal_{i}"]
+        ) = poll
+
+    engine.execute(
+        text(
+            "INSERT INTO testdirectory.submission_polls (submission_id, "
+            "last_polled_at, poll_count, next_poll_at, terminal) VALUES "
+            f"{', '.join(rows)} ON CONFLICT (submission_id) DO UPDATE SET "
+            "last_polled_at = excluded.last_polled_at, "
+            "poll_count = excluded.poll_count, "
+            "next_poll_at = excluded.next_poll_at, "
+            "terminal = excluded.terminal"
+        ),
+        params
+    )
+
+
+@timed
+def add_accession_ids_to_db(accession_ids, engine):
+    '''
+    Add ClinVar accession IDs to INCA database in a single update
+    Inputs
+        accession_ids (dict): dict mapping local_id to ClinVar accession ID
+        engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
+    Outputs
+        count (int): number of variants updated
+    '''
+    count = _bulk_update_inca("accession_id", accession_ids, engine)
+    print(f"Added {count} accession IDs to inca table")
+    return count
 
 
+@timed
 def add_clinvar_submission_error_to_db(errors, engine):
     '''
-    Add any ClinVar submission error to INCA database
+    Add any ClinVar submission errors to INCA database in a single update
     Inputs
         errors (dict): dict mapping local_id to ClinVar submission error
         message
         engine (sqlalchemy.engine.Engine): SQLAlchemy connection to AWS db
     Outputs
-        None, adds data to db
+        count (int): number of variants updated
     '''
-    for local_id, error in errors.items():
-        engine.execute(
-            f"UPDATE testdirectory.inca SET clinvar_status = 'ERROR: {error}' "
-            f"WHERE local_id = '{local_id}'"
-        )
+    count = _bulk_update_inca(
+        "clinvar_status",
+        {local_id: f"ERROR: {error}" for local_id, error in errors.items()},
+        engine
+    )
+    print(f"Added {count} ClinVar submission errors to inca table")
+    return count
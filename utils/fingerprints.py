@@ -0,0 +1,153 @@
+import datetime
+import hashlib
+import json
+import os
+from collections import namedtuple
+import pandas as pd
+
+FileFingerprint = namedtuple(
+    "FileFingerprint", ["size", "mtime_ns", "file_hash"]
+)
+
+
+def hash_file(filename, chunk_size=1024 * 1024):
+    '''
+    Get SHA-256 hash of the contents of a file, read in chunks
+    Inputs
+        filename (str): path to file
+        chunk_size (int): number of bytes to read at a time
+    Outputs
+        (str): hex digest of file contents
+    '''
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_file_fingerprint(filename):
+    '''
+    Get size, modification time and content hash of a file
+    Inputs
+        filename (str): path to file
+    Outputs
+        (FileFingerprint): fingerprint of file
+    '''
+    stat = os.stat(filename)
+    return FileFingerprint(stat.st_size, stat.st_mtime_ns, hash_file(filename))
+
+
+def fingerprint_changed(filename, size, mtime_ns, file_hash):
+    '''
+    Check if a file differs from a stored fingerprint. The file is only
+    hashed if its size or modification time differ from those stored, so
+    unchanged files are checked with a single stat call
+    Inputs
+        filename (str): path to file
+        size (int): stored file size in bytes
+        mtime_ns (int): stored modification time in ns since the epoch
+        file_hash (str): stored SHA-256 hex digest of file contents
+    Outputs
+        (bool): True if file contents may have changed
+    '''
+    stat = os.stat(filename)
+    if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+        return False
+    return hash_file(filename) != file_hash
+
+
+def should_retry_failed_workbook(filename, record, backoff_days, now=None):
+    '''
+    Decide whether a workbook that previously failed parsing should be parsed
+    again. It is retried if no fingerprint was stored with its failure, if
+    the file has changed since it failed, or if the retry backoff has expired
+    Inputs
+        filename (str): path to workbook
+        record (pd.Series or namedtuple): workbook's row in inca_workbooks
+        backoff_days (float): days after which a failed workbook is retried
+        even if unchanged
+        now (datetime.datetime): current time, defaults to now
+    Outputs
+        (bool): True if workbook should be parsed again
+    '''
+    now = now or datetime.datetime.now()
+    fields = ["file_size", "file_mtime", "file_hash", "last_attempt"]
+    values = [getattr(record, field, None) for field in fields]
+    if any(value is None or pd.isna(value) for value in values):
+        return True
+
+    size, mtime_ns, file_hash, last_attempt = values
+    if pd.Timestamp(last_attempt) + pd.Timedelta(days=backoff_days) <= now:
+        return True
+
+    return fingerprint_changed(filename, int(size), int(mtime_ns), file_hash)
+
+
+class FingerprintCache:
+    '''
+    Local cache of file fingerprints, stored as JSON, so that workbooks which
+    have not changed since the last run are not hashed again
+    '''
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._entries = json.load(f)
+
+    def get(self, filename):
+        '''
+        Get the fingerprint of a file, reusing the cached hash if the file's
+        size and modification time are unchanged
+        Inputs
+            filename (str): path to file
+        Outputs
+            (FileFingerprint): fingerprint of file
+        '''
+        key = os.path.abspath(filename)
+        stat = os.stat(filename)
+        cached = self._entries.get(key)
+        if (
+            cached is not None
+            and cached[:2] == [stat.st_size, stat.st_mtime_ns]
+        ):
+            return FileFingerprint(*cached)
+
+        fingerprint = FileFingerprint(
+            stat.st_size, stat.st_mtime_ns, hash_file(filename)
+        )
+        self._entries[key] = list(fingerprint)
+        return fingerprint
+
+    def save(self):
+        '''
+        Write cache to disk, if a path was given
+        '''
+        if self.path is None:
+            return
+        os.makedirs(
+            os.path.dirname(os.path.abspath(self.path)), exist_ok=True
+        )
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def build_hash_index(workbook_df):
+    '''
+    Build an index of content hash to workbook name for workbooks in the
+    inca_workbooks table which have a stored hash
+    Inputs
+        workbook_df (pd.DataFrame): rows from inca_workbooks table
+    Outputs
+        (dict): file_hash -> workbook_name
+    '''
+    index = {}
+    for name, file_hash in zip(
+        workbook_df["workbook_name"], workbook_df["file_hash"]
+    ):
+        if isinstance(file_hash, str) and file_hash not in index:
+            index[file_hash] = name
+    return index
@@ -0,0 +1,106 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+
+# Offset between the Gregorian epoch used by uuid1 (1582-10-15) and the Unix
+# epoch, in 100 ns intervals. uuid.uuid1().time is
+# time.time_ns() // 100 + UUID_EPOCH_OFFSET, so IDs built from this counter
+# sort alongside the uid_ values already held in testdirectory.inca
+UUID_EPOCH_OFFSET = 0x01b21dd213814000
+
+DEFAULT_STATE_FILE = os.environ.get(
+    "PANDORA_LOCAL_ID_STATE",
+    os.path.join(tempfile.gettempdir(), "pandora_local_id.state")
+)
+
+
+def current_uuid_time():
+    '''
+    Get the current time in the same units as uuid.uuid1().time
+    Outputs
+        (int): 100 ns intervals since 1582-10-15
+    '''
+    return time.time_ns() // 100 + UUID_EPOCH_OFFSET
+
+
+class LocalIDAllocator:
+    '''
+    Hands out blocks of monotonic, unique local_id values in the uid_<int>
+    format. The last issued value is persisted in a state file which is
+    locked while a block is reserved, so parallel worker processes and
+    separate pandora runs never issue the same value. Each block starts at
+    the later of the current uuid1 timestamp and the last issued value + 1,
+    so IDs stay unique even if the state file is removed between runs.
+    '''
+    def __init__(self, state_file=DEFAULT_STATE_FILE):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._last = 0
+
+    def _reserve(self, count):
+        '''
+        Reserve a contiguous block of count integers
+        Inputs
+            count (int): number of values to reserve
+        Outputs
+            start (int): first value in reserved block
+        '''
+        with self._lock:
+            if self.state_file is None:
+                start = max(current_uuid_time(), self._last + 1)
+                self._last = start + count - 1
+                return start
+
+            fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                content = os.read(fd, 64).decode().strip()
+                last = int(content) if content else 0
+                start = max(current_uuid_time(), last + 1, self._last + 1)
+                self._last = start + count - 1
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, str(self._last).encode())
+                os.fsync(fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            return start
+
+    def allocate(self, count):
+        '''
+        Allocate local IDs for a workbook or batch of workbooks at once
+        Inputs
+            count (int): number of IDs required
+        Outputs
+            ids (list): list of count unique IDs, in increasing order, in the
+            format uid_<int>
+        '''
+        if count <= 0:
+            return []
+        start = self._reserve(count)
+        return [f"uid_{value}" for value in range(start, start + count)]
+
+
+_default_allocator = None
+
+
+def allocate_local_ids(count, state_file=DEFAULT_STATE_FILE):
+    '''
+    Allocate local IDs using a process-wide allocator
+    Inputs
+        count (int): number of IDs required
+        state_file (str): path to shared state file. If None, uniqueness is
+        only guaranteed within this process
+    Outputs
+        ids (list): list of unique IDs in the format uid_<int>
+    '''
+    global _default_allocator
+    if (
+        _default_allocator is None
+        or _default_allocator.state_file != state_file
+    ):
+        _default_allocator = LocalIDAllocator(state_file)
+    return _default_allocator.allocate(count)
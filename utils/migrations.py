@@ -0,0 +1,156 @@
+import datetime
+from contextlib import contextmanager
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Versioned changes to the testdirectory schema, applied in order by
+# apply_migrations. Each is (version, description, statements). Applied
+# migrations must not be edited; make further changes in a new version
+MIGRATIONS = (
+    (
+        1,
+        "Add workbook file details to inca_workbooks",
+        (
+            "ALTER TABLE testdirectory.inca_workbooks "
+            "ADD COLUMN IF NOT EXISTS file_size bigint",
+            "ALTER TABLE testdirectory.inca_workbooks "
+            "ADD COLUMN IF NOT EXISTS file_mtime bigint",
+            "ALTER TABLE testdirectory.inca_workbooks "
+            "ADD COLUMN IF NOT EXISTS file_hash text",
+            "ALTER TABLE testdirectory.inca_workbooks "
+            "ADD COLUMN IF NOT EXISTS last_attempt timestamp",
+        ),
+    ),
+    (
+        2,
+        "Add partial indexes for variants awaiting submission or accession "
+        "IDs",
+        (
+            # variants to submit to ClinVar
+            "CREATE INDEX IF NOT EXISTS inca_awaiting_submission_idx "
+            "ON testdirectory.inca (organisation_id) "
+            "WHERE interpreted = 'yes' AND submission_id IS NULL "
+            "AND accession_id IS NULL",
+            # submitted variants to get accession IDs for
+            "CREATE INDEX IF NOT EXISTS inca_awaiting_accession_idx "
+            "ON testdirectory.inca (organisation_id, submission_id) "
+            "WHERE interpreted = 'yes' AND submission_id IS NOT NULL "
+            "AND accession_id IS NULL",
+        ),
+    ),
+    (
+        3,
+        "Add partial index for parsed workbooks by file hash",
+        (
+            # looking up candidate workbooks' hashes to find duplicates
+            "CREATE INDEX IF NOT EXISTS inca_workbooks_hash_idx "
+            "ON testdirectory.inca_workbooks (file_hash) "
+            "WHERE parse_status = TRUE",
+        ),
+    ),
+    (
+        4,
+        "Add poll schedule of ClinVar submissions",
+        (
+            "CREATE TABLE IF NOT EXISTS testdirectory.submission_polls "
+            "(submission_id text PRIMARY KEY, last_polled_at timestamp, "
+            "poll_count integer NOT NULL DEFAULT 0, next_poll_at timestamp, "
+            "terminal boolean NOT NULL DEFAULT FALSE)",
+        ),
+    ),
+)
+
+
+@contextmanager
+def _transaction(engine):
+    '''
+    Run a block in a transaction, or in a savepoint if given a connection
+    that may already be in a transaction
+    '''
+    if isinstance(engine, Connection):
+        with engine.begin_nested():
+            yield engine
+    else:
+        with engine.begin() as connection:
+            yield connection
+
+
+def get_applied_versions(engine):
+    '''
+    Get the versions of migrations already applied to the database,
+    creating the table that records them if needed
+    Inputs
+        engine (sqlalchemy.engine.Engine or Connection): SQLAlchemy
+        connection to AWS db
+    Outputs
+        versions (set): versions of applied migrations
+    '''
+    with _transaction(engine) as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE IF NOT EXISTS testdirectory.schema_migrations "
+            "(version integer PRIMARY KEY, description text NOT NULL, "
+            "applied_at timestamp NOT NULL)"
+        )
+        result = connection.exec_driver_sql(
+            "SELECT version FROM testdirectory.schema_migrations"
+        )
+        return {row[0] for row in result}
+
+
+def get_pending_versions(engine, migrations=MIGRATIONS):
+    '''
+    Get the versions of migrations not yet applied to the database
+    Inputs
+        engine (sqlalchemy.engine.Engine or Connection): SQLAlchemy
+        connection to AWS db
+        migrations (tuple): (version, description, statements) for each
+        migration
+    Outputs
+        pending (list): versions of unapplied migrations, in order
+    '''
+    applied_versions = get_applied_versions(engine)
+    return sorted(
+        version for version, _, _ in migrations
+        if version not in applied_versions
+    )
+
+
+def apply_migrations(engine, migrations=MIGRATIONS):
+    '''
+    Apply any migrations not yet applied to the database, in version order.
+    Each migration is applied and recorded in one transaction, so a failed
+    migration leaves no partial changes and is retried next time
+    Inputs
+        engine (sqlalchemy.engine.Engine or Connection): SQLAlchemy
+        connection to AWS db
+        migrations (tuple): (version, description, statements) for each
+        migration
+    Outputs
+        applied (list): versions of the migrations applied
+    '''
+    applied_versions = get_applied_versions(engine)
+    applied = []
+    for version, description, statements in sorted(migrations):
+        if version in applied_versions:
+            continue
+        with _transaction(engine) as connection:
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+            connection.execute(
+                text(
+                    "INSERT INTO testdirectory.schema_migrations "
+                    "(version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {
+                    "version": version,
+                    "description": description,
+                    "applied_at": datetime.datetime.now(),
+                }
+            )
+        print(f"Applied migration {version}: {description}")
+        applied.append(version)
+
+    if not applied:
+        print("Database schema is up to date")
+    return applied
@@ -0,0 +1,54 @@
+import datetime
+from utils.summary_cache import TERMINAL_STATUSES
+
+
+def next_poll_at(poll_count, now, interval_hours, max_interval_hours):
+    '''
+    Get when a submission that has not yet been processed should next be
+    checked, doubling the interval with each check up to a maximum
+    Inputs
+        poll_count (int): times the submission has been checked
+        now (datetime.datetime): current time
+        interval_hours (float): interval before the first check
+        max_interval_hours (float): longest interval between checks
+    Outputs
+        (datetime.datetime): time of next check
+    '''
+    hours = min(interval_hours * 2 ** poll_count, max_interval_hours)
+    return now + datetime.timedelta(hours=hours)
+
+
+def update_schedule(
+    statuses, schedule, now, interval_hours, max_interval_hours
+):
+    '''
+    Update the poll schedule of submissions after checking their statuses.
+    Submissions not yet processed are next checked after a backoff, and
+    those in a terminal state are marked so they are not checked again.
+    Submissions whose status could not be checked are not updated, so they
+    are checked next run
+    Inputs
+        statuses (dict): status of each submission checked, or None if its
+        status could not be checked
+        schedule (dict): submission_id -> (poll_count, next_poll_at,
+        terminal) of submissions with a schedule
+        now (datetime.datetime): current time
+        interval_hours (float): interval before the first check
+        max_interval_hours (float): longest interval between checks
+    Outputs
+        polls (dict): submission_id -> (last_polled_at, poll_count,
+        next_poll_at, terminal) for each submission checked
+    '''
+    polls = {}
+    for submission_id, status in statuses.items():
+        if status is None:
+            continue
+        poll_count = schedule.get(submission_id, (0, None, False))[0] + 1
+        terminal = status in TERMINAL_STATUSES
+        next_poll = None
+        if not terminal:
+            next_poll = next_poll_at(
+                poll_count, now, interval_hours, max_interval_hours
+            )
+        polls[submission_id] = (now, poll_count, next_poll, terminal)
+    return polls
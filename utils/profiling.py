@@ -0,0 +1,248 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# profiler for the current process, None unless profiling is enabled
+_profiler = None
+
+
+class Profiler:
+    '''
+    Collects wall clock timings of named stages for a run, both in total and
+    for each workbook. Timings of nested stages are inclusive, so a stage's
+    time includes that of any stages run within it. Stages may be recorded
+    from several threads, each with its own current workbook
+    '''
+    def __init__(self):
+        self.stages = {}
+        self.workbooks = {}
+        self._local = threading.local()
+        self._cprofile_stats = None
+        self._lock = threading.Lock()
+
+    @property
+    def _workbook(self):
+        return getattr(self._local, "workbook", None)
+
+    @_workbook.setter
+    def _workbook(self, name):
+        self._local.workbook = name
+
+    @staticmethod
+    def _add(timings, name, calls, seconds):
+        timing = timings.setdefault(name, {"calls": 0, "seconds": 0.0})
+        timing["calls"] += calls
+        timing["seconds"] += seconds
+
+    def record(self, name, seconds, calls=1):
+        '''
+        Record time spent in a stage, against the current workbook if there
+        is one
+        Inputs
+            name (str): name of stage
+            seconds (float): time spent in stage
+            calls (int): number of times stage was run
+        '''
+        with self._lock:
+            self._add(self.stages, name, calls, seconds)
+            if self._workbook is not None:
+                self._add(
+                    self.workbooks.setdefault(self._workbook, {}),
+                    name, calls, seconds
+                )
+
+    def merge(self, stages, workbook=None):
+        '''
+        Add stage timings collected elsewhere, e.g. in a worker process
+        Inputs
+            stages (dict): stage name -> {"calls": int, "seconds": float}
+            workbook (str): name of workbook the timings are for, if any
+        '''
+        with self.workbook(workbook):
+            for name, timing in stages.items():
+                self.record(name, timing["seconds"], timing["calls"])
+
+    @contextmanager
+    def workbook(self, name):
+        '''
+        Attribute stages run within this context to a workbook
+        Inputs
+            name (str): name of workbook
+        '''
+        previous = self._workbook
+        self._workbook = name if name is not None else previous
+        try:
+            yield
+        finally:
+            self._workbook = previous
+
+    def add_cprofile_stats(self, stats):
+        '''
+        Add cProfile stats collected by run_profiled
+        Inputs
+            stats (dict): stats of a cProfile.Profile, after create_stats
+        '''
+        collected = _CollectedStats(stats)
+        if self._cprofile_stats is None:
+            self._cprofile_stats = pstats.Stats(collected)
+        else:
+            self._cprofile_stats.add(collected)
+
+    def report(self):
+        '''
+        Outputs
+            (dict): timings of each stage in total and for each workbook,
+            with the stages taking the longest first
+        '''
+        def by_time(timings):
+            return dict(sorted(
+                timings.items(), key=lambda x: x[1]["seconds"], reverse=True
+            ))
+
+        return {
+            "stages": by_time(self.stages),
+            "workbooks": {
+                workbook: by_time(timings)
+                for workbook, timings in sorted(self.workbooks.items())
+            },
+        }
+
+    def write_report(self, path, cprofile_path=None):
+        '''
+        Write the JSON timing report, and the cProfile stats for the parse
+        path if any were collected
+        Inputs
+            path (str): path to write JSON report to
+            cprofile_path (str): path to write cProfile stats to, or None
+        '''
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=4)
+        print(f"Timing report written to {path}")
+
+        if cprofile_path is not None and self._cprofile_stats is not None:
+            self._cprofile_stats.dump_stats(cprofile_path)
+            print(f"cProfile stats written to {cprofile_path}")
+
+
+class _CollectedStats:
+    '''
+    Stats from a cProfile.Profile, which may have been run in another
+    process, in the form that pstats.Stats loads
+    '''
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def enable_profiling():
+    '''
+    Start collecting timings in this process
+    Outputs
+        (Profiler): profiler that timings are recorded to
+    '''
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def get_profiler():
+    '''
+    Outputs
+        (Profiler): profiler for this process, or None if not enabled
+    '''
+    return _profiler
+
+
+@contextmanager
+def stage(name):
+    '''
+    Time the code run within this context as a stage. Does nothing if
+    profiling is not enabled
+    Inputs
+        name (str): name of stage
+    '''
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.record(name, time.perf_counter() - start)
+
+
+@contextmanager
+def workbook(name):
+    '''
+    Attribute stages run within this context to a workbook. Does nothing if
+    profiling is not enabled
+    Inputs
+        name (str): name of workbook
+    '''
+    if _profiler is None:
+        yield
+        return
+    with _profiler.workbook(name):
+        yield
+
+
+def timed(func):
+    '''
+    Decorator recording each call of a function as a stage, named
+    <module>.<function>
+    '''
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if _profiler is None:
+            return func(*args, **kwargs)
+        with stage(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def run_profiled(cprofile, func, *args):
+    '''
+    Run a function with a new profiler, e.g. in a worker process, so the
+    timings of that call can be returned and merged into the main profiler
+    Inputs
+        cprofile (bool): if True, also collect cProfile stats
+        func (function): function to run
+        *args: arguments to func
+    Outputs
+        result: return value of func
+        stages (dict): stage timings recorded while running func
+        stats (dict): cProfile stats, or None
+    '''
+    global _profiler
+    previous = _profiler
+    _profiler = Profiler()
+    profile = cProfile.Profile() if cprofile else None
+    try:
+        if profile is not None:
+            profile.enable()
+        try:
+            result = func(*args)
+        finally:
+            if profile is not None:
+                profile.disable()
+        stages = _profiler.stages
+    finally:
+        _profiler = previous
+
+    stats = None
+    if profile is not None:
+        profile.create_stats()
+        stats = profile.stats
+    return result, stages, stats
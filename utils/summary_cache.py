@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# statuses of ClinVar submissions which will not change, whose summary files
+# can be cached
+TERMINAL_STATUSES = ("processed", "error")
+
+
+class SummaryFileCache:
+    '''
+    Local cache of the summary files of ClinVar submissions in a terminal
+    state, so they are not downloaded again if writing their results to the
+    database fails or a run is repeated. Files are stored by the SHA-256 of
+    their contents, with an index of submission ID to file URL, status and
+    hash. The least recently used files are evicted once the cache is larger
+    than max_bytes. Safe to use from several threads
+    '''
+    def __init__(self, directory, max_bytes=500 * 1024 ** 2):
+        '''
+        Inputs
+            directory (str): directory to store the cache in
+            max_bytes (int): maximum total size of cached files
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(directory, "index.json")
+        self._entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._entries = json.load(f)
+
+    def __contains__(self, submission_id):
+        with self._lock:
+            return submission_id in self._entries
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", f"{digest}.json")
+
+    def get(self, submission_id, url=None):
+        '''
+        Get the cached summary file of a submission
+        Inputs
+            submission_id (str): ClinVar submission ID
+            url (str): URL of summary file, if known, which must match the
+            cached file's
+        Outputs
+            (tuple): (status, summary file contents) or None if not cached
+        '''
+        with self._lock:
+            entry = self._entries.get(submission_id)
+            if entry is None or url not in (None, entry["url"]):
+                return None
+            try:
+                with open(self._object_path(entry["sha256"]), "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                del self._entries[submission_id]
+                return None
+            entry["last_used"] = time.time()
+        return entry["status"], json.loads(content)
+
+    def put(self, submission_id, url, status, content):
+        '''
+        Cache the summary file of a submission in a terminal state
+        Inputs
+            submission_id (str): ClinVar submission ID
+            url (str): URL the summary file was downloaded from
+            status (str): status of submission
+            content (bytes): summary file contents
+        '''
+        if status not in TERMINAL_STATUSES:
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            path = self._object_path(digest)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            self._entries[submission_id] = {
+                "url": url,
+                "status": status,
+                "sha256": digest,
+                "size": len(content),
+                "last_used": time.time(),
+            }
+            self._evict()
+            self._save()
+
+    def _evict(self):
+        '''
+        Remove least recently used entries until the files cached fit in
+        max_bytes, and delete files no longer used by any entry
+        '''
+        sizes = {
+            entry["sha256"]: entry["size"] for entry in self._entries.values()
+        }
+        total = sum(sizes.values())
+        for submission_id, entry in sorted(
+            self._entries.items(), key=lambda x: x[1]["last_used"]
+        ):
+            if total <= self.max_bytes:
+                break
+            del self._entries[submission_id]
+            if all(
+                x["sha256"] != entry["sha256"] for x in self._entries.values()
+            ):
+                total -= sizes.pop(entry["sha256"])
+                try:
+                    os.remove(self._object_path(entry["sha256"]))
+                except FileNotFoundError:
+                    pass
+
+    def save(self):
+        '''
+        Write the index to disk, e.g. to record when files were last used
+        '''
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self._index_path)
@@ -1,13 +1,25 @@
 from datetime import date
+from functools import lru_cache
 from dateutil import parser as date_parser
-from utils.database_actions import add_error_to_db
+from utils.local_ids import allocate_local_ids
+from utils.profiling import timed
+from utils.validation import ValidationEngine, get_validation_engine
+from utils.workbook_loader import (
+    get_extraction_plan, load_workbook_values, sheet_to_dataframe
+)
 import pandas as pd
 import numpy as np
 import os
-import requests
 import json
-import uuid
-import time
+import zipfile
+from openpyxl.utils.exceptions import InvalidFileException
+
+# errors raised by a workbook that is corrupt or not laid out as expected,
+# which are recorded as the workbook failing parsing
+WORKBOOK_CONTENT_ERRORS = (
+    InvalidFileException, zipfile.BadZipFile, KeyError, ValueError,
+    IndexError, TypeError
+)
 
 
 def get_folder_of_input_file(filename: str) -> str:
@@ -22,18 +34,42 @@ def get_folder_of_input_file(filename: str) -> str:
     return folder
 
 
-def get_workbook_data(workbook, config, filename, file, engine):
+def get_organisation_folder(filename, folders):
+    '''
+    Get the nearest folder containing a workbook that is one of the given
+    organisation folders, so workbooks in subfolders, e.g. CUH/archive,
+    belong to the organisation of the folder they are in
+    Inputs:
+        filename (str): path to workbook
+        folders (list): names of organisation folders
+    Outputs:
+        folder (str): name of organisation folder, or None if the workbook
+        is not in one
     '''
-    Function that runs functions to extract data from each sheet in the
-    workbook and merges it together into one dataframe
+    directory = os.path.dirname(os.path.abspath(filename))
+    while True:
+        folder = os.path.basename(directory)
+        if folder in folders:
+            return folder
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+@timed
+def parse_workbook(workbook, config, filename):
+    '''
+    Extract data from each sheet in the workbook and merge it together into
+    one dataframe, without touching the database
     Inputs
-        workbook (openpyxl wb object): workbook being used
+        workbook (WorkbookValues or openpyxl wb object): workbook being used
         config (dict): config variable
         filename (str): string of workbook name with preceding path
-        file (str): string of workbook name without preceding path
-        engine (SQLAlchemy engine): connection to database
     Outputs
-        df_final (pd.DataFrame): data frame extracted from workbook
+        df_final (pd.DataFrame): data frame extracted from workbook, or None
+        if the workbook failed checks
+        error (str): reasons the workbook failed checks, or None
     '''
     errors = []
     # get data from summary sheet, included variants sheet and interpret sheets
@@ -66,18 +102,44 @@ def get_workbook_data(workbook, config, filename, file, engine):
 
     if any(error is not None for error in errors):
         errors_to_add = [err for err in errors if err is not None]
-        error_to_add = ", ".join(errors_to_add)
-        add_error_to_db(engine, file, error_to_add)
-        return None
+        return None, ", ".join(errors_to_add)
+
+    return df_final, None
+
+
+def parse_workbook_file(filename, config):
+    '''
+    Load and parse one workbook file. Used as the unit of work for parallel
+    parsing, so errors caused by the workbook's contents are returned as the
+    workbook's parsing error rather than raised. Other errors, e.g. from the
+    environment, are raised so they are not recorded against the workbook
+    Inputs
+        filename (str): string of workbook name with preceding path
+        config (dict): config variable
+    Outputs
+        filename (str): string of workbook name with preceding path
+        df_final (pd.DataFrame): data frame extracted from workbook, or None
+        error (str): reason workbook failed parsing, or None
+    '''
+    try:
+        workbook = load_workbook_values(filename)
+    except OSError as err:
+        # e.g. moved or deleted since it was selected for parsing
+        return filename, None, f"Workbook file could not be read: {err}"
+    try:
+        df_final, error = parse_workbook(workbook, config, filename)
+    except WORKBOOK_CONTENT_ERRORS as err:
+        df_final, error = None, f"Workbook could not be parsed: {err}"
 
-    return df_final
+    return filename, df_final, error
 
 
+@timed
 def get_summary_fields(workbook, config, filename):
     '''
     Extract data from summary sheet of variant workbook
     Inputs
-        workbook (openpyxl wb object): workbook being used
+        workbook (WorkbookValues or openpyxl wb object): workbook being used
         config (dict): config variable
         filename (str): string of workbook name
     Outputs
@@ -156,9 +218,11 @@ def get_summary_fields(workbook, config, filename):
     df_summary["allele_origin"] = config.get("Allele origin")
     df_summary["affected_status"] = config.get("Affected status")
 
-    # getting the folder name of workbook
-    # the folder name should return designated folder for either CUH or NUH
-    folder_name = get_folder_of_input_file(filename)
+    # getting the folder of workbook, which is, or is in, the designated
+    # folder for either CUH or NUH
+    folder_name = get_organisation_folder(
+        filename, [config.get("CUH folder"), config.get("NUH folder")]
+    )
     if folder_name == config.get("CUH folder"):
         df_summary["organisation"] = config.get("CUH Organisation")
         df_summary["organisation_id"] = config.get("CUH org ID")
@@ -173,20 +237,20 @@ def get_summary_fields(workbook, config, filename):
     return df_summary, error_msg
 
 
+@timed
 def get_included_fields(workbook, filename) -> pd.DataFrame:
     '''
     Extract data from included sheet of variant workbook
     Inputs:
-        workbook (openpyxl wb object): workbook being used
+        workbook (WorkbookValues or openpyxl wb object): workbook being used
         filename (str): string of workbook name
     Outputs
         df_included (pd.DataFrame): data frame extracted from included sheet
     '''
     num_variants = workbook["summary"]["C38"].value
-    df = pd.read_excel(
-        filename,
-        sheet_name="included",
-        usecols= [
+    df = sheet_to_dataframe(
+        workbook["included"],
+        usecols=[
             "CHROM",
             "POS",
             "REF",
@@ -217,21 +281,18 @@ def get_included_fields(workbook, filename) -> pd.DataFrame:
         },
         inplace=True,
     )
-    df["local_id"] = ""
-    for row in range(df.shape[0]):
-        unique_id = uuid.uuid1()
-        df.loc[row, "local_id"] = f"uid_{unique_id.time}"
-        time.sleep(0.5)
+    df["local_id"] = allocate_local_ids(df.shape[0])
     df["linking_id"] = df["local_id"]
 
     return df
 
 
+@timed
 def get_report_fields(workbook, config, df_included):
     '''
     Extract data from interpret sheet(s) of variant workbook
     Inputs:
-        workbook (openpyxl wb object): workbook being used
+        workbook (WorkbookValues or openpyxl wb object): workbook being used
         config (dict): config variable
         df_included (pd.DataFrame): data frame extracted from included sheet
     Outputs
@@ -239,20 +300,19 @@ def get_report_fields(workbook, config, df_included):
         err_msg (str): error message
 
     '''
-    field_cells = config.get("field_cells")
-    col_name = [i[0] for i in field_cells]
-    df_report = pd.DataFrame(columns=col_name)
+    plan = get_extraction_plan(config.get("field_cells"))
     report_sheets = [
         idx
         for idx in workbook.sheetnames
         if idx.lower().startswith("interpret")
     ]
 
-    for idx, sheet in enumerate(report_sheets):
-        for field, cell in field_cells:
-            if workbook[sheet][cell].value is not None:
-                df_report.loc[idx, field] = workbook[sheet][cell].value
-    df_report.reset_index(drop=True, inplace=True)
+    # one record per interpret sheet with any values filled in
+    records = [plan.extract(workbook[sheet]) for sheet in report_sheets]
+    df_report = pd.DataFrame(
+        [record for record in records if record], columns=plan.fields,
+        dtype=object
+    )
     error_msg = None
     if not df_report.empty:
         error_msg = check_interpret_table(df_report, df_included, config)
@@ -267,6 +327,7 @@ def get_report_fields(workbook, config, df_included):
     return df_report, error_msg
 
 
+@timed
 def make_acgs_criteria_null_if_not_applied(df, acgs_criteria):
     '''
     The workbook has a value "NA" for ACGS criteria that was not applied. This
@@ -284,19 +345,50 @@ def make_acgs_criteria_null_if_not_applied(df, acgs_criteria):
         for criteria that were not applied, and a null value for evidence for
         all criteria not applied.
     '''
-    for index, row, in df.iterrows():
-        for criterion in acgs_criteria:
-            if row[criterion] == "NA":
-                df.loc[index, criterion] = np.nan
-
-    for index, row, in df.iterrows():
-        for criterion in acgs_criteria:
-            if pd.isna(row[criterion]):
-                df.loc[index, criterion + "_evidence"] = np.nan
+    strengths = df[acgs_criteria].to_numpy(dtype=object)
+    is_na_string = strengths == "NA"
+    not_applied = is_na_string | pd.isna(strengths)
+
+    # only touch columns which have a criterion not applied
+    for i, criterion in enumerate(acgs_criteria):
+        if is_na_string[:, i].any():
+            column = strengths[:, i].copy()
+            column[is_na_string[:, i]] = np.nan
+            df[criterion] = column
+        if not_applied[:, i].any():
+            df.loc[not_applied[:, i], criterion + "_evidence"] = np.nan
 
     return df
 
 
+@lru_cache(maxsize=None)
+def get_classification_comment(acgs_criteria, matched_strength, strengths):
+    '''
+    Build the comment on classification for one combination of ACGS criteria
+    strengths. Memoised, as most variants share a few combinations
+    Inputs:
+        acgs_criteria (tuple): ACGS criteria, in comment order
+        matched_strength (tuple): (criterion prefix, default strength) pairs
+        strengths (tuple): strength applied for each criterion, or None if
+        not applied
+    Outputs:
+        comment (str): summary of applied criteria e.g. PVS1,PM3_Supporting
+    '''
+    default_strengths = dict(matched_strength)
+    acgs = []
+    for criterion, strength in zip(acgs_criteria, strengths):
+        if strength is None:
+            continue
+        criterion = criterion.upper()
+        if default_strengths[criterion[:-1]] == strength or strength == "":
+            acgs.append(criterion)
+        else:
+            acgs.append(f"{criterion}_{strength}")
+
+    return ','.join(acgs)
+
+
+@timed
 def add_comment_on_classification(df, acgs_criteria, config):
     '''
     This function should take in a df with a column for each ACGS criteria with
@@ -322,22 +414,22 @@ def add_comment_on_classification(df, acgs_criteria, config):
         comment_on_classification column which summarises all the ACGS criteria
         applied for the variants
     '''
-    matched_strength = config.get("matched_strength")
-    df["comment_on_classification"] = ""
+    acgs_criteria = tuple(acgs_criteria)
+    matched_strength = tuple(sorted(config.get("matched_strength").items()))
 
-    for index, row, in df.iterrows():
-        acgs = {}
-        for criterion in acgs_criteria:
-            if pd.notna(row[criterion]):
-                acgs[criterion.upper()] = row[criterion]
-                if matched_strength[criterion.upper()[:-1]] == row[criterion]:
-                    acgs[criterion.upper()] = ""
+    # one tuple of strengths per variant, with None for criteria not applied
+    strengths = df[list(acgs_criteria)].to_numpy(dtype=object)
+    strengths[pd.isna(strengths)] = None
 
-        comment = ','.join([
-            f"{criterion}_{strength}"if strength != ""
-            else criterion for criterion, strength in acgs.items()
-        ])
-        df.loc[index, "comment_on_classification"] = comment
+    df["comment_on_classification"] = pd.Series(
+        [
+            get_classification_comment(
+                acgs_criteria, matched_strength, tuple(row)
+            )
+            for row in strengths
+        ],
+        index=df.index, dtype=object
+    )
 
     return df
 
@@ -370,6 +462,7 @@ def select_api_url(clinvar_testing, config):
     return api_url
 
 
+@timed
 def check_interpret_table(df_interpret, df_included, config):
     '''
     Check if ACMG classification and HGVSc are correctly
@@ -381,86 +474,24 @@ def check_interpret_table(df_interpret, df_included, config):
     Outputs
       error_msg (str): error message
     '''
-    error_msg = []
-    strength_dropdown = config.get("strength_dropdown")
-    BA1_dropdown = config.get("BA1_dropdown")
-    for row in range(df_interpret.shape[0]):
-        try:
-            assert (
-                pd.notna(df_interpret.loc[row, "germline_classification"])
-            ), "empty ACMG classification in interpret table"
-            assert df_interpret.loc[row, "germline_classification"] in [
-                "Pathogenic",
-                "Likely Pathogenic",
-                "Uncertain Significance",
-                "Likely Benign",
-                "Benign",
-            ], "wrong ACMG classification in interpret table"
-            assert (
-                pd.notna(df_interpret.loc[row, "hgvsc"])
-            ), "empty HGVSc in interpret table"
-            assert df_interpret.loc[row, "hgvsc"] in list(df_included["hgvsc"]), (
-                "HGVSc in interpret table does not match with that in "
-                "included sheet"
-            )
-            acgs_criteria = config.get("acgs_criteria")
-            for criteria in acgs_criteria:
-                if pd.notna(df_interpret.loc[row, criteria]):
-                    assert (
-                        df_interpret.loc[row, criteria] in strength_dropdown
-                    ), f"Wrong strength in {criteria}"
-
-            if pd.notna(df_interpret.loc[row, "ba1"]):
-                assert (
-                    df_interpret.loc[row, "ba1"] in BA1_dropdown
-                ), "Wrong strength in BA1"
-
-        except AssertionError as msg:
-            error_msg.append(str(msg))
-
-    error_msg = "".join(error_msg)
-
-    if error_msg == "":
-        error_msg = None
-
-    return error_msg
+    return get_validation_engine(config).check_interpret_table(
+        df_interpret, df_included
+    )
 
 
 def checking_sheets(workbook):
     '''
     Check if extra row(s)/col(s) are added in the sheets
     Inputs
-        workbook (openpyxl wb object): object of query workbook with variants
+        workbook (WorkbookValues or openpyxl wb object): object of query
+        workbook with variants
     Outputs
         error_msg (str): error message
     '''
-    summary = workbook["summary"]
-    reports = [
-        idx
-        for idx in workbook.sheetnames
-        if idx.lower().startswith("interpret")
-    ]
-    try:
-        assert (
-            summary["G21"].value == "Date"
-        ), "extra col(s) added or change(s) done in summary sheet"
-        for sheet in reports:
-            report = workbook[sheet]
-            assert report["B26"].value == "FINAL ACMG CLASSIFICATION", (
-                "extra row(s) or col(s) added or change(s) done in "
-                "interpret sheet"
-            )
-            assert report["L8"].value == "B_POINTS", (
-                "extra row(s) or col(s) added or change(s) done in "
-                "interpret sheet"
-            )
-        error_msg = None
-    except AssertionError as msg:
-        error_msg = str(msg)
-
-    return error_msg
+    return ValidationEngine.checking_sheets(workbook)
 
 
+@timed
 def check_interpreted_col(df):
     '''
     Check if interpreted col in included sheet is correctly filled in
@@ -468,35 +499,7 @@ def check_interpreted_col(df):
         df (pd.DataFrame): merged dataframe with data from workbook
         error_msg (str): error message
     '''
-    error_msg = []
-    yes_df = df[df["interpreted"] == "yes"]
-    no_df = df[df["interpreted"] == "no"]
-
-    if not df["interpreted"].isin(['yes', 'no']).all():
-        error_msg.append(
-            "Values in interpreted column are not all either 'yes' or 'no'"
-        )
-
-    for index, row in yes_df.iterrows():
-        if pd.isna(row["germline_classification"]):
-            error_msg.append(
-                f"Variant {row['hgvsc']} has interpreted = yes, but no final "
-                "classification could be extracted from interpret sheets."
-            )
-
-    for index, row in no_df.iterrows():
-        if pd.notna(row["germline_classification"]):
-            error_msg.append(
-                f"Variant {row['hgvsc']} has interpreted = no, but a final "
-                "classification could be extracted from interpret sheets."
-            )
-
-    error_msg = " ".join(error_msg)
-
-    if error_msg == "":
-        error_msg = None
-
-    return error_msg
+    return ValidationEngine.check_interpreted_col(df)
 
 
 def check_sample_name(instrumentID, sample_ID, batchID, testcode, probesetID):
@@ -508,25 +511,15 @@ def check_sample_name(instrumentID, sample_ID, batchID, testcode, probesetID):
     Outputs
         error_msg (str): error message
     '''
-    try:
-        assert re.match(
-            r"^\d{9}$", instrumentID
-        ), "Unusual name for instrumentID"
-        assert re.match(r"^\d{5}[A-Z]\d{4}$", sample_ID), "Unusual sampleID"
-        assert re.match(r"^\d{2}[A-Z]{5}\d{1,}$", batchID), "Unusual batchID"
-        assert re.match(r"^\d{4}$", testcode), "Unusual testcode"
-        assert 0 < len(probesetID) < 20, "probesetID is too long/short"
-        assert (
-            probesetID.isalnum() and not probesetID.isalpha()
-        ), "Unusual probesetID"
-        error_msg = None
-    except AssertionError as msg:
-        error_msg = str(msg)
-
-    return error_msg
+    return ValidationEngine.check_sample_name(
+        instrumentID, sample_ID, batchID, testcode, probesetID
+    )
 
 
-def submission_status_check(submission_id, headers, api_url):
+@timed
+def submission_status_check(
+    submission_id, headers, api_url, client, cache=None, log=print
+):
     '''
     Queries ClinVar API about a submission ID to obtain more details about its
     submission record.
@@ -534,16 +527,28 @@ def submission_status_check(submission_id, headers, api_url):
         submission_id:  the generated submission id from ClinVar when a
         submission has been posted to their API
         headers: the required API url
+        client (clinvar.ClinVarClient): client to make requests with, which
+        applies its timeouts, retries and rate limit
+        cache (summary_cache.SummaryFileCache): cache of summary files of
+        submissions in a terminal state, used instead of the API for
+        submissions in it
+        log (callable): called with each message about the check, e.g. to
+        collect them when checking from a worker thread
     Outputs:
         status_response: the API response
     '''
+    if cache is not None:
+        cached = cache.get(submission_id)
+        if cached is not None:
+            log(f"Using cached summary file for submission {submission_id}")
+            return cached
 
     url = os.path.join(api_url, submission_id, "actions")
-    response = requests.get(url, headers=headers)
+    response = client.get(url, headers=headers)
     response_content = response.content.decode("UTF-8")
     for k, v in response.headers.items():
-        print(f"{k}: {v}")
-    print(response_content)
+        log(f"{k}: {v}")
+    log(response_content)
     if response.status_code not in [200]:
         raise RuntimeError(
             "Status check failed:\n" + str(headers) + "\n" + url
@@ -555,13 +560,13 @@ def submission_status_check(submission_id, headers, api_url):
     # Load summary file
     action = status_response["actions"][0]
     status = action["status"]
-    print(f"Submission {submission_id} has status {status}")
+    log(f"Submission {submission_id} has status {status}")
 
     responses = action["responses"]
     if len(responses) == 0:
-        print("Status 'responses' field had no items, check back later")
+        log("Status 'responses' field had no items, check back later")
     else:
-        print(
+        log(
             "Status response had a response, attempting to "
             "retrieve any files listed"
         )
@@ -569,15 +574,15 @@ def submission_status_check(submission_id, headers, api_url):
             f_url = responses[0]["files"][0]["url"]
         except (KeyError, IndexError) as error:
             f_url = None
-            print(
+            log(
                 f"Error retrieving files: {error}.\n No API url for summary"
                 "file found. Cannot query API for summary file based on "
                 f"response {responses}"
             )
 
         if f_url is not None:
-            print("GET " + f_url)
-            f_response = requests.get(f_url, headers=headers)
+            log("GET " + f_url)
+            f_response = client.get(f_url, headers=headers)
             f_response_content = f_response.content.decode("UTF-8")
             if f_response.status_code not in [200]:
                 raise RuntimeError(
@@ -586,5 +591,7 @@ def submission_status_check(submission_id, headers, api_url):
                 )
             file_content = json.loads(f_response_content)
             status_response = file_content
+            if cache is not None:
+                cache.put(submission_id, f_url, status, f_response.content)
 
     return status, status_response
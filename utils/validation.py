@@ -0,0 +1,226 @@
+import re
+import numpy as np
+
+ACMG_CLASSIFICATIONS = frozenset([
+    "Pathogenic",
+    "Likely Pathogenic",
+    "Uncertain Significance",
+    "Likely Benign",
+    "Benign",
+])
+
+# (cell, expected value, error message) for summary and interpret sheets
+SUMMARY_LAYOUT_RULES = (
+    (
+        "G21", "Date",
+        "extra col(s) added or change(s) done in summary sheet"
+    ),
+)
+INTERPRET_LAYOUT_RULES = (
+    (
+        "B26", "FINAL ACMG CLASSIFICATION",
+        "extra row(s) or col(s) added or change(s) done in interpret sheet"
+    ),
+    (
+        "L8", "B_POINTS",
+        "extra row(s) or col(s) added or change(s) done in interpret sheet"
+    ),
+)
+
+# (compiled pattern, error message) for each part of the sample name
+SAMPLE_NAME_RULES = (
+    (re.compile(r"^\d{9}$"), "Unusual name for instrumentID"),
+    (re.compile(r"^\d{5}[A-Z]\d{4}$"), "Unusual sampleID"),
+    (re.compile(r"^\d{2}[A-Z]{5}\d{1,}$"), "Unusual batchID"),
+    (re.compile(r"^\d{4}$"), "Unusual testcode"),
+)
+
+
+class ValidationEngine:
+    '''
+    Checks for data extracted from variant workbooks, compiled once from the
+    config into sets and column rules so that whole columns are validated at
+    once. Each check returns the same error strings as the row-by-row checks
+    it replaces
+    '''
+    def __init__(self, config):
+        self.acgs_criteria = tuple(config.get("acgs_criteria"))
+        self.strength_dropdown = frozenset(config.get("strength_dropdown"))
+        self.ba1_dropdown = frozenset(config.get("BA1_dropdown"))
+
+    def _interpret_rules(self, df_interpret, included_hgvsc):
+        '''
+        Evaluate each interpret table rule over whole columns, in the order
+        the rules are checked for each row
+        Outputs
+            failures (list): (boolean np.array of failing rows, error message)
+        '''
+        classification = df_interpret["germline_classification"]
+        hgvsc = df_interpret["hgvsc"]
+        failures = [
+            (
+                classification.isna(),
+                "empty ACMG classification in interpret table"
+            ),
+            (
+                ~classification.isin(ACMG_CLASSIFICATIONS),
+                "wrong ACMG classification in interpret table"
+            ),
+            (hgvsc.isna(), "empty HGVSc in interpret table"),
+            (
+                ~hgvsc.isin(included_hgvsc),
+                "HGVSc in interpret table does not match with that in "
+                "included sheet"
+            ),
+        ]
+        for criterion in self.acgs_criteria:
+            strength = df_interpret[criterion]
+            failures.append((
+                strength.notna() & ~strength.isin(self.strength_dropdown),
+                f"Wrong strength in {criterion}"
+            ))
+        ba1 = df_interpret["ba1"]
+        failures.append((
+            ba1.notna() & ~ba1.isin(self.ba1_dropdown),
+            "Wrong strength in BA1"
+        ))
+        return [
+            (failed.to_numpy(dtype=bool), msg) for failed, msg in failures
+        ]
+
+    def check_interpret_table(self, df_interpret, df_included):
+        '''
+        Check if ACMG classification and HGVSc are correctly
+        filled in in the interpret table(s)
+        Inputs
+            df_interpret (pd.Dataframe): df from interpret sheet(s)
+            df_included (pd.Dataframe): df from included sheet
+        Outputs
+            error_msg (str): error message, with the first failed check for
+            each row that failed, or None
+        '''
+        failures = self._interpret_rules(
+            df_interpret, frozenset(df_included["hgvsc"].dropna())
+        )
+        messages = [msg for _, msg in failures]
+        failed = np.column_stack([rows for rows, _ in failures])
+
+        # argmax gives the first failed rule for each row
+        first_failure = failed.argmax(axis=1)[failed.any(axis=1)]
+        error_msg = "".join(messages[rule] for rule in first_failure)
+
+        if error_msg == "":
+            error_msg = None
+
+        return error_msg
+
+    @staticmethod
+    def check_interpreted_col(df):
+        '''
+        Check if interpreted col in included sheet is correctly filled in
+        Inputs
+            df (pd.DataFrame): merged dataframe with data from workbook
+        Outputs
+            error_msg (str): error message
+        '''
+        error_msg = []
+        interpreted = df["interpreted"]
+        has_classification = df["germline_classification"].notna()
+
+        if not interpreted.isin(['yes', 'no']).all():
+            error_msg.append(
+                "Values in interpreted column are not all either 'yes' or 'no'"
+            )
+
+        for hgvsc in df.loc[
+            (interpreted == "yes") & ~has_classification, "hgvsc"
+        ]:
+            error_msg.append(
+                f"Variant {hgvsc} has interpreted = yes, but no final "
+                "classification could be extracted from interpret sheets."
+            )
+
+        for hgvsc in df.loc[
+            (interpreted == "no") & has_classification, "hgvsc"
+        ]:
+            error_msg.append(
+                f"Variant {hgvsc} has interpreted = no, but a final "
+                "classification could be extracted from interpret sheets."
+            )
+
+        error_msg = " ".join(error_msg)
+
+        if error_msg == "":
+            error_msg = None
+
+        return error_msg
+
+    @staticmethod
+    def checking_sheets(workbook):
+        '''
+        Check if extra row(s)/col(s) are added in the sheets
+        Inputs
+            workbook (WorkbookValues or openpyxl wb object): object of query
+            workbook with variants
+        Outputs
+            error_msg (str): error message for the first failed check, or None
+        '''
+        summary = workbook["summary"]
+        for cell, expected, msg in SUMMARY_LAYOUT_RULES:
+            if summary[cell].value != expected:
+                return msg
+
+        for sheet in workbook.sheetnames:
+            if not sheet.lower().startswith("interpret"):
+                continue
+            report = workbook[sheet]
+            for cell, expected, msg in INTERPRET_LAYOUT_RULES:
+                if report[cell].value != expected:
+                    return msg
+
+        return None
+
+    @staticmethod
+    def check_sample_name(
+        instrumentID, sample_ID, batchID, testcode, probesetID
+    ):
+        '''
+        Checking that individual parts of sample name have expected naming
+        format
+        Inputs
+            str values for instrumentID, sample_ID, batchID, testcode,
+            probesetID
+        Outputs
+            error_msg (str): error message for the first failed check, or None
+        '''
+        parts = (instrumentID, sample_ID, batchID, testcode)
+        for value, (pattern, msg) in zip(parts, SAMPLE_NAME_RULES):
+            if not pattern.match(value):
+                return msg
+
+        if not 0 < len(probesetID) < 20:
+            return "probesetID is too long/short"
+        if not (probesetID.isalnum() and not probesetID.isalpha()):
+            return "Unusual probesetID"
+
+        return None
+
+
+_engines = {}
+
+
+def get_validation_engine(config):
+    '''
+    Get the validation engine for a config, compiling it on first use
+    Inputs
+        config (dict): config variable
+    Outputs
+        (ValidationEngine): engine compiled from config
+    '''
+    key = tuple(
+        tuple(config.get(field) or ())
+        for field in ["acgs_criteria", "strength_dropdown", "BA1_dropdown"]
+    )
+    if key not in _engines:
+        _engines[key] = ValidationEngine(config)
+    return _engines[key]
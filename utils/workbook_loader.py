@@ -0,0 +1,254 @@
+from collections import namedtuple
+from functools import lru_cache
+from openpyxl import load_workbook
+from openpyxl.utils.cell import (
+    column_index_from_string, coordinate_from_string
+)
+from pandas.io.parsers import TextParser
+from utils.profiling import timed
+
+CellValue = namedtuple("CellValue", ["row", "column", "value"])
+
+
+def is_required_sheet(sheet_name):
+    '''
+    Check whether a sheet is one pandora extracts data from
+    Inputs
+        sheet_name (str): name of sheet in workbook
+    Outputs
+        (bool): True for summary, included and interpret sheets
+    '''
+    return (
+        sheet_name in ("summary", "included")
+        or sheet_name.lower().startswith("interpret")
+    )
+
+
+class SheetValues:
+    '''
+    In-memory cell values of one worksheet. Supports the subset of the
+    openpyxl worksheet interface used by pandora: single cell lookup by
+    coordinate (ws["B1"].value), whole column lookup (ws["A"]) and iter_rows
+    '''
+    def __init__(self, title, rows):
+        self.title = title
+        self._rows = [tuple(row) for row in rows]
+        self.max_row = len(self._rows)
+        self.max_column = max((len(row) for row in self._rows), default=0)
+
+    def cell(self, row, column):
+        '''
+        Get a cell by 1-based row and column index
+        Inputs
+            row (int): row number
+            column (int): column number
+        Outputs
+            (CellValue): cell with row, column and value
+        '''
+        value = None
+        if 0 < row <= self.max_row and 0 < column <= len(self._rows[row - 1]):
+            value = self._rows[row - 1][column - 1]
+        return CellValue(row, column, value)
+
+    def __getitem__(self, key):
+        if key.isalpha():
+            column = column_index_from_string(key)
+            return tuple(
+                self.cell(row, column) for row in range(1, self.max_row + 1)
+            )
+        column_letter, row = coordinate_from_string(key)
+        return self.cell(row, column_index_from_string(column_letter))
+
+    def iter_rows(
+        self, min_row=1, max_row=None, min_col=1, max_col=None,
+        values_only=False
+    ):
+        '''
+        Iterate over a range of rows, as openpyxl Worksheet.iter_rows
+        '''
+        max_row = max_row or self.max_row
+        max_col = max_col or self.max_column
+        width = max_col - min_col + 1
+        for row in range(min_row, max_row + 1):
+            if values_only:
+                values = ()
+                if 0 < row <= self.max_row:
+                    values = self._rows[row - 1][min_col - 1:max_col]
+                yield values + (None,) * (width - len(values))
+            else:
+                yield tuple(
+                    self.cell(row, col) for col in range(min_col, max_col + 1)
+                )
+
+
+class WorkbookValues:
+    '''
+    Values of the sheets of a workbook that pandora reads, parsed from a
+    single read-only open of the file
+    '''
+    def __init__(self, filename, sheets):
+        self.filename = filename
+        self._sheets = sheets
+        self.sheetnames = list(sheets)
+
+    def __getitem__(self, sheet_name):
+        return self._sheets[sheet_name]
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self._sheets
+
+
+@timed
+def load_workbook_values(filename):
+    '''
+    Open a workbook once in read-only mode and materialise the values of
+    only the summary, included and interpret sheets
+    Inputs
+        filename (str): path to xlsx workbook
+    Outputs
+        (WorkbookValues): values of required sheets in workbook
+    '''
+    workbook = load_workbook(filename, read_only=True, data_only=True)
+    try:
+        sheets = {}
+        for sheet_name in workbook.sheetnames:
+            if not is_required_sheet(sheet_name):
+                continue
+            worksheet = workbook[sheet_name]
+            worksheet.reset_dimensions()
+            sheets[sheet_name] = SheetValues(
+                sheet_name, worksheet.iter_rows(values_only=True)
+            )
+    finally:
+        workbook.close()
+
+    return WorkbookValues(filename, sheets)
+
+
+def _convert_value(value):
+    '''
+    Convert a cell value the same way pandas' openpyxl reader does, so
+    frames built from sheet values match those from pd.read_excel
+    '''
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def sheet_to_dataframe(worksheet, usecols=None, nrows=None):
+    '''
+    Build a dataframe from a worksheet using its first row as the header,
+    equivalent to pd.read_excel(filename, sheet_name=..., usecols=...,
+    nrows=...) without re-reading the file
+    Inputs
+        worksheet (SheetValues or openpyxl worksheet): sheet to convert
+        usecols (list): optional list of column names to keep
+        nrows (int): optional number of data rows to read
+    Outputs
+        (pd.DataFrame): dataframe of sheet values
+    '''
+    data = []
+    last_row_with_data = -1
+    for row_number, row in enumerate(worksheet.iter_rows(values_only=True)):
+        converted_row = [_convert_value(value) for value in row]
+        while converted_row and converted_row[-1] == "":
+            converted_row.pop()
+        if converted_row:
+            last_row_with_data = row_number
+        data.append(converted_row)
+        if isinstance(nrows, int) and len(data) > nrows:
+            break
+    data = data[: last_row_with_data + 1]
+
+    if data:
+        max_width = max(len(row) for row in data)
+        data = [row + [""] * (max_width - len(row)) for row in data]
+
+    parser = TextParser(
+        data, header=0, usecols=usecols, nrows=nrows, skip_blank_lines=False
+    )
+    return parser.read(nrows=nrows)
+
+
+class CellExtractionPlan:
+    '''
+    Plan for reading a fixed set of named cells from many sheets. Cell
+    coordinates are compiled once into blocks of nearby rows, each read with
+    a single iter_rows call per sheet
+    '''
+    def __init__(self, field_cells, max_row_gap=5):
+        self.fields = [field for field, _ in field_cells]
+        coordinates = []
+        for field, cell in field_cells:
+            column_letter, row = coordinate_from_string(cell)
+            coordinates.append(
+                (field, row, column_index_from_string(column_letter))
+            )
+
+        # group cells into blocks of rows with gaps no larger than
+        # max_row_gap, each spanning the columns its cells use
+        self.blocks = []
+        block = []
+        for coordinate in sorted(coordinates, key=lambda x: x[1]):
+            if block and coordinate[1] - block[-1][1] > max_row_gap:
+                self.blocks.append(self._compile_block(block))
+                block = []
+            block.append(coordinate)
+        if block:
+            self.blocks.append(self._compile_block(block))
+
+    @staticmethod
+    def _compile_block(coordinates):
+        '''
+        Compile a block of cells into the bounds to read and the offset of
+        each field's cell within those bounds
+        '''
+        min_row = min(row for _, row, _ in coordinates)
+        max_row = max(row for _, row, _ in coordinates)
+        min_col = min(col for _, _, col in coordinates)
+        max_col = max(col for _, _, col in coordinates)
+        offsets = [
+            (field, row - min_row, col - min_col)
+            for field, row, col in coordinates
+        ]
+        return (min_row, max_row, min_col, max_col), offsets
+
+    def extract(self, worksheet):
+        '''
+        Read the planned cells from a worksheet
+        Inputs
+            worksheet (SheetValues or openpyxl worksheet): sheet to read
+        Outputs
+            record (dict): field -> value for each cell that is not empty
+        '''
+        record = {}
+        for (min_row, max_row, min_col, max_col), offsets in self.blocks:
+            rows = list(worksheet.iter_rows(
+                min_row=min_row, max_row=max_row, min_col=min_col,
+                max_col=max_col, values_only=True
+            ))
+            for field, row, col in offsets:
+                value = rows[row][col]
+                if value is not None:
+                    record[field] = value
+        return record
+
+
+@lru_cache(maxsize=None)
+def _compile_extraction_plan(field_cells):
+    return CellExtractionPlan(field_cells)
+
+
+def get_extraction_plan(field_cells):
+    '''
+    Get the extraction plan for config field_cells, compiling it on first use
+    Inputs
+        field_cells (list): list of [field, cell coordinate] pairs
+    Outputs
+        (CellExtractionPlan): compiled extraction plan
+    '''
+    return _compile_extraction_plan(
+        tuple((field, cell) for field, cell in field_cells)
+    )
@@ -0,0 +1,150 @@
+import json
+import os
+
+
+class WorkbookScanner:
+    '''
+    Incremental scanner for workbook files across one or more root folders.
+    A manifest of each scanned directory's modification time and the size
+    and modification time of its workbooks is persisted between runs.
+    Directories whose modification time is unchanged have had no files
+    added, removed or renamed, so they are not listed again and their files
+    are not stat-ed; only files in changed directories are compared with the
+    manifest. Use a full scan to pick up files edited in place.
+
+    The manifest also records which workbooks are known to have been
+    handled, e.g. parsed, so unchanged workbooks do not need looking up in
+    the database again. A workbook's mark is cleared when it changes.
+    '''
+    def __init__(self, manifest_path=None, recursive=False, suffix=".xlsx"):
+        self.manifest_path = manifest_path
+        self.recursive = recursive
+        self.suffix = suffix
+        self._directories = {}
+        self._parsed = set()
+        if manifest_path is not None and os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self._directories = manifest.get("directories", {})
+            self._parsed = set(manifest.get("parsed", []))
+        self._scanned = {}
+
+    def _is_workbook(self, entry):
+        return (
+            entry.name.endswith(self.suffix)
+            and not entry.name.startswith(".")
+            and entry.is_file()
+        )
+
+    def _scan_directory(self, directory, full_scan, changed, unchanged):
+        '''
+        Scan one directory, adding new or changed workbook paths to changed
+        and others to unchanged
+        Outputs
+            subdirs (list): paths of subdirectories of directory
+        '''
+        dir_mtime = os.stat(directory).st_mtime_ns
+        previous = self._directories.get(directory)
+
+        if (
+            not full_scan
+            and previous is not None
+            and previous["mtime_ns"] == dir_mtime
+        ):
+            unchanged.extend(
+                os.path.join(directory, name) for name in previous["files"]
+            )
+            self._scanned[directory] = previous
+            return previous["subdirs"]
+
+        previous_files = previous["files"] if previous else {}
+        files = {}
+        subdirs = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif self._is_workbook(entry):
+                    stat = entry.stat()
+                    files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+                    if previous_files.get(entry.name) == files[entry.name]:
+                        unchanged.append(entry.path)
+                    else:
+                        changed.append(entry.path)
+
+        self._scanned[directory] = {
+            "mtime_ns": dir_mtime, "files": files, "subdirs": subdirs
+        }
+        return subdirs
+
+    def scan(self, roots, full_scan=False):
+        '''
+        Find workbooks in root folders
+        Inputs
+            roots (list): paths of folders to scan
+            full_scan (bool): if True, ignore the manifest and stat every
+            workbook
+        Outputs
+            changed (list): sorted paths of workbooks that are new or have
+            changed since the last saved scan
+            unchanged (list): sorted paths of workbooks that have not
+            changed since the last saved scan
+        '''
+        changed = []
+        unchanged = []
+        to_scan = [os.path.normpath(root) for root in roots]
+        while to_scan:
+            directory = to_scan.pop()
+            if directory in self._scanned or not os.path.isdir(directory):
+                continue
+            subdirs = self._scan_directory(
+                directory, full_scan, changed, unchanged
+            )
+            if self.recursive:
+                to_scan.extend(subdirs)
+
+        self._parsed.difference_update(changed)
+        return sorted(changed), sorted(unchanged)
+
+    def is_parsed(self, path):
+        '''
+        Inputs
+            path (str): path of workbook found by scan
+        Outputs
+            (bool): True if the workbook was marked as parsed and has not
+            changed since
+        '''
+        return path in self._parsed
+
+    def mark_parsed(self, paths):
+        '''
+        Record that workbooks have been handled, so they can be skipped
+        while they are unchanged. Saved with the manifest
+        Inputs
+            paths (iterable): paths of workbooks found by scan
+        '''
+        self._parsed.update(paths)
+
+    def save(self):
+        '''
+        Persist the manifest of this scan, if a path was given. Should only
+        be called once the scanned workbooks have been processed
+        '''
+        if self.manifest_path is None:
+            return
+        directories = dict(self._directories)
+        directories.update(self._scanned)
+        # forget workbooks that have been removed or renamed
+        parsed = sorted(
+            path for path in self._parsed
+            if os.path.basename(path)
+            in directories.get(os.path.dirname(path), {}).get("files", {})
+        )
+        os.makedirs(
+            os.path.dirname(os.path.abspath(self.manifest_path)),
+            exist_ok=True
+        )
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"directories": directories, "parsed": parsed}, f)
+        os.replace(tmp_path, self.manifest_path)